@@ -1,5 +1,14 @@
 from django.contrib import admin
-from .models import Post, Comment
+from django.utils import timezone
+from .changelist import (
+    ScalableAdminMixin,
+    CachedBooleanFieldListFilter,
+    CachedChoicesFieldListFilter,
+    CachedDateFieldListFilter,
+    CachedRelatedFieldListFilter,
+)
+from .models import Post, Comment, OutboundEmail
+from .signals import comments_bulk_updated, posts_bulk_updated
 
 
 # Register your models here.
@@ -7,9 +16,14 @@ from .models import Post, Comment
 # admin.site.register(Post)
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['title', 'slug', 'author', 'publish', 'status']
-    list_filter = ['status', 'created_on', 'publish', 'author']
+    list_filter = [
+        ('status', CachedChoicesFieldListFilter),
+        ('created_on', CachedDateFieldListFilter),
+        ('publish', CachedDateFieldListFilter),
+        ('author', CachedRelatedFieldListFilter),
+    ]
     search_fields = ['title', 'body']
     prepopulated_fields = {'slug': ('title',)}
     raw_id_fields = ['author']
@@ -17,11 +31,75 @@ class PostAdmin(admin.ModelAdmin):
     ordering = ['status', 'publish']
     # django 5.0 new introduced feature
     # Adding facet counts to the filters
+    # (cached, see blog/changelist.py, so a changelist page does not run one
+    # aggregate per filter every time)
     show_facets = admin.ShowFacets.ALWAYS
+    # author is in list_display, so django loads the authors with a JOIN; the long
+    # text columns are not shown and stay in the database
+    changelist_defer = ['body', 'body_html', 'excerpt_html', 'search_vector']
+    actions = ['publish_posts', 'unpublish_posts']
+
+    def set_status(self, request, queryset, status):
+        # one UPDATE for the whole selection; updated_on is set by hand because
+        # update() skips auto_now, and the conditional GET validators rely on it
+        post_ids = list(queryset.exclude(status=status).values_list('id', flat=True))
+        if post_ids:
+            Post.objects.filter(id__in=post_ids).update(status=status, updated_on=timezone.now())
+            posts_bulk_updated.send(sender=Post, post_ids=post_ids)
+        return len(post_ids)
+
+    @admin.action(description='Publish selected posts')
+    def publish_posts(self, request, queryset):
+        changed = self.set_status(request, queryset, Post.Status.PUBLISHED)
+        self.message_user(request, f'{changed} posts published.')
+
+    @admin.action(description='Unpublish selected posts (back to draft)')
+    def unpublish_posts(self, request, queryset):
+        changed = self.set_status(request, queryset, Post.Status.DRAFT)
+        self.message_user(request, f'{changed} posts moved back to draft.')
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['name', 'email', 'post', 'created_on', 'active']
-    list_filter = ['active', 'created_on', 'updated_on']
-    search_fields = ['name', 'email', 'body']
\ No newline at end of file
+    list_filter = [
+        ('active', CachedBooleanFieldListFilter),
+        ('created_on', CachedDateFieldListFilter),
+        ('updated_on', CachedDateFieldListFilter),
+    ]
+    search_fields = ['name', 'email', 'body']
+    raw_id_fields = ['post']
+    # the post column shows Post.__str__ (its title): JOIN the posts instead of one
+    # query per row, without their long text columns
+    list_select_related = ['post']
+    changelist_defer = [
+        'body', 'post__body', 'post__body_html', 'post__excerpt_html', 'post__search_vector',
+    ]
+    actions = ['approve_comments', 'hide_comments']
+
+    def set_active(self, request, queryset, active):
+        changed = queryset.exclude(active=active)
+        post_ids = set(changed.values_list('post_id', flat=True))
+        # the active_comment_count triggers keep the posts' counts in step
+        count = changed.update(active=active, updated_on=timezone.now())
+        if count:
+            comments_bulk_updated.send(sender=Comment, post_ids=post_ids)
+        return count
+
+    @admin.action(description='Approve selected comments')
+    def approve_comments(self, request, queryset):
+        changed = self.set_active(request, queryset, True)
+        self.message_user(request, f'{changed} comments approved.')
+
+    @admin.action(description='Hide selected comments')
+    def hide_comments(self, request, queryset):
+        changed = self.set_active(request, queryset, False)
+        self.message_user(request, f'{changed} comments hidden.')
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ['to', 'subject', 'status', 'attempts', 'next_attempt_on', 'sent_on']
+    list_filter = ['status']
+    search_fields = ['to', 'subject']
+    readonly_fields = ['created_on', 'sent_on', 'last_error']
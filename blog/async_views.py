@@ -0,0 +1,184 @@
+import asyncio
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sites.shortcuts import get_current_site
+from django.db import connections
+from django.shortcuts import render, aget_object_or_404
+from django.http import Http404
+from taggit.models import Tag
+
+from .feeds import LatestPostsFeed
+from .forms import CommentForm, SearchForm
+from .freshness import async_condition, content_etag, content_last_modified, posts_last_modified
+from .models import Post, Comment, publish_day_range
+from .pagination import keyset_paginate, comment_page
+from .templatetags.blog_tags import cached_sidebar
+from .pagecache import add_surrogate_keys
+from .views import detail_keys, listing_keys, numbered_page, search_page, tag_post_count
+
+
+# Native async versions of the public read views, used instead of the ones in
+# blog/views.py when BLOG_ASYNC_VIEWS is on and the site is served over ASGI
+# (myblog/asgi.py), e.g. `uvicorn myblog.asgi:application`.
+#
+# Single lookups use the async ORM (aget_object_or_404, afirst, async for). The async
+# ORM of Django 5.1 still sends every query through the one thread-sensitive executor,
+# though, so asyncio.gather() over a*() calls would run them one after another.
+# Independent queries of a page (the post, its comments, its similar posts, the
+# sidebar) are therefore given to run_concurrently(), which runs each one in its own
+# worker thread at the same time, on a connection of that thread's own. When the
+# function returns the thread's connections are closed: with the connection pool
+# (DB_POOL) that hands them back to the pool, whose max_size then bounds them; without
+# it each function opens a new connection and closes it again, so no worker thread
+# keeps a connection open between requests, at the price of one connect per function.
+#
+# The pages are rendered with everything already loaded (and the sidebar passed in as
+# `sidebar`), so rendering does not touch the database.
+
+
+def _own_connection(func):
+    def run():
+        try:
+            return func()
+        finally:
+            # request_finished does not reach the worker thread's connections
+            connections.close_all()
+    return run
+
+
+async def run_concurrently(*funcs):
+    return await asyncio.gather(
+        *(sync_to_async(_own_connection(func), thread_sensitive=False)() for func in funcs)
+    )
+
+
+def _sidebar():
+    # same arguments as the {% cached_sidebar 3 3 %} tag in base.html
+    return cached_sidebar(3, 3)
+
+
+@async_condition(etag_func=content_etag, last_modified_func=content_last_modified)
+async def post_list(request, tag_slug=None):
+    published_list = Post.published.for_listing()
+    tag = None
+    count = None
+    if tag_slug:
+        tag = await aget_object_or_404(Tag.objects.select_related('stats'), slug=tag_slug)
+        published_list = published_list.filter(tags__in=[tag])
+        count = tag_post_count(tag)
+
+    def page():
+        if settings.POST_LIST_PAGINATION == 'keyset':
+            return keyset_paginate(published_list, 3, request.GET)
+        posts = numbered_page(published_list, request.GET.get('page', 1), count=count)
+        # evaluate the page (and its prefetched tags) here, not while rendering
+        posts.object_list = list(posts.object_list)
+        return posts
+
+    posts, sidebar = await run_concurrently(page, _sidebar)
+    response = render(request, 'blog/post/list.html', {
+        'posts': posts,
+        'tag': tag,
+        'sidebar': sidebar,
+    })
+    return add_surrogate_keys(response, listing_keys(posts, tag))
+
+
+def _published_post_lookup(prefix, bounds, slug):
+    # the post_detail URL lookup (the day as a publish range, see
+    # PostQuerySet.published_on), also usable through a relation (e.g. prefix='post__')
+    return {
+        f'{prefix}status': Post.Status.PUBLISHED,
+        f'{prefix}slug': slug,
+        f'{prefix}publish__gte': bounds[0],
+        f'{prefix}publish__lt': bounds[1],
+    }
+
+
+@async_condition(etag_func=content_etag, last_modified_func=content_last_modified)
+async def post_detail(request, year, month, day, post):
+    bounds = publish_day_range(year, month, day)
+    if bounds is None:
+        raise Http404('No Post matches the given query.')
+    # the comments and the similar posts are looked up through the same URL fields,
+    # so none of the four queries has to wait for the post itself
+    post, comments, similar_posts, sidebar = await run_concurrently(
+        lambda: (
+            Post.objects.select_related('author').defer('body', 'search_vector')
+            .filter(**_published_post_lookup('', bounds, post)).first()
+        ),
+        lambda: comment_page(
+            Comment.objects.filter(active=True, **_published_post_lookup('post__', bounds, post)),
+            settings.COMMENTS_PER_PAGE,
+        ),
+        lambda: list(
+            Post.published.filter(**_published_post_lookup('similar_to__post__', bounds, post))
+            .only('title', 'slug', 'publish').order_by('similar_to__rank')
+        ),
+        _sidebar,
+    )
+    if post is None:
+        raise Http404('No Post matches the given query.')
+
+    response = render(request, 'blog/post/detail.html', {
+        'post': post,
+        'comments': comments,
+        'form': CommentForm(),
+        'similar_posts': similar_posts,
+        'sidebar': sidebar,
+    })
+    return add_surrogate_keys(response, detail_keys(post, similar_posts))
+
+
+async def post_search(request):
+    form = SearchForm()
+    query = None
+    results = []
+    page_query = ''
+
+    if 'query' in request.GET:
+        form = SearchForm(request.GET)
+        if form.is_valid():
+            query = form.cleaned_data['query']
+
+    if query is None:
+        (sidebar,) = await run_concurrently(_sidebar)
+    else:
+        mode = form.cleaned_data['mode']
+        results, sidebar = await run_concurrently(
+            lambda: search_page(query, mode, request.GET.get('page', 1)),
+            _sidebar,
+        )
+        page_query = urlencode({'query': query, 'mode': mode}) + '&'
+
+    return render(request, 'blog/post/search.html', {
+        'form': form,
+        'query': query,
+        'results': results,
+        'page_query': page_query,
+        'sidebar': sidebar,
+    })
+
+
+class LoadedPostsFeed(LatestPostsFeed):
+    """
+    LatestPostsFeed over posts that were already fetched with the async ORM.
+    """
+
+    def __init__(self, posts):
+        super().__init__()
+        self.posts = posts
+
+    def items(self):
+        return self.posts
+
+
+@async_condition(last_modified_func=posts_last_modified)
+async def post_feed(request):
+    posts = [post async for post in LatestPostsFeed().items()]
+    # get_current_site() is cached per process after its first query; make sure that
+    # query (if any) happens off the event loop before the feed is built
+    await sync_to_async(get_current_site)(request)
+    return LoadedPostsFeed(posts)(request)
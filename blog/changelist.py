@@ -0,0 +1,109 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+# Admin changelists that stay usable on big tables.
+#
+# A stock changelist runs a COUNT(*) for the paginator, another one for the "n total"
+# link, one aggregate per filter for the facet counts, and loads every column of every
+# row. Here:
+#
+# * EstimatedCountPaginator answers large counts from the planner: pg_class.reltuples
+#   for an unfiltered table, the EXPLAIN row estimate for a filtered one. Counts below
+#   ADMIN_EXACT_COUNT_LIMIT are still exact, so small result sets page correctly.
+# * The Cached*ListFilter classes keep their facet counts in the cache for
+#   ADMIN_FACET_CACHE_TIMEOUT seconds, keyed by the rest of the query string. The bulk
+#   actions call invalidate_admin_facets() so their own effect shows up at once.
+# * LeanChangeList defers the columns listed in ModelAdmin.changelist_defer.
+
+
+def _admin_facets_version_key(model):
+    return f'blog:admin:facets:{model._meta.label_lower}'
+
+
+def invalidate_admin_facets(model):
+    cache.set(_admin_facets_version_key(model), time.time_ns(), None)
+
+
+class CachedFacetsMixin:
+    def get_facet_queryset(self, changelist):
+        params = changelist.get_query_string(remove=[*self.expected_parameters(), PAGE_VAR, ORDER_VAR])
+        version = cache.get(_admin_facets_version_key(changelist.model))
+        digest = hashlib.md5(f'{self.field_path}{params}{version}'.encode()).hexdigest()
+        key = f'blog:admin:facets:{changelist.model._meta.label_lower}:{digest}'
+        counts = cache.get(key)
+        if counts is None:
+            counts = super().get_facet_queryset(changelist)
+            cache.set(key, counts, getattr(settings, 'ADMIN_FACET_CACHE_TIMEOUT', 300))
+        return counts
+
+
+class CachedChoicesFieldListFilter(CachedFacetsMixin, admin.ChoicesFieldListFilter):
+    pass
+
+
+class CachedBooleanFieldListFilter(CachedFacetsMixin, admin.BooleanFieldListFilter):
+    pass
+
+
+class CachedDateFieldListFilter(CachedFacetsMixin, admin.DateFieldListFilter):
+    pass
+
+
+class CachedRelatedFieldListFilter(CachedFacetsMixin, admin.RelatedFieldListFilter):
+    pass
+
+
+def estimate_count(queryset):
+    """
+    Return the planner's estimate of queryset.count(), or None if there is none.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    if not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # -1 until the table has been vacuumed or analyzed for the first time
+        return row[0] if row and row[0] >= 0 else None
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return plan[0]['Plan']['Plan Rows']
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < getattr(settings, 'ADMIN_EXACT_COUNT_LIMIT', 10000):
+            return super().count
+        return estimate
+
+
+class LeanChangeList(ChangeList):
+    def get_queryset(self, request, exclude_parameters=None):
+        queryset = super().get_queryset(request, exclude_parameters)
+        return queryset.defer(*self.model_admin.changelist_defer)
+
+
+class ScalableAdminMixin:
+    paginator = EstimatedCountPaginator
+    # no COUNT(*) of the whole table for the "n total" link
+    show_full_result_count = False
+    # columns the changelist does not show, e.g. large text fields
+    changelist_defer = ()
+
+    def get_changelist(self, request, **kwargs):
+        return LeanChangeList
@@ -1,6 +1,4 @@
-import markdown
 from django.contrib.syndication.views import Feed
-from django.template.defaultfilters import truncatewords_html
 from django.urls import reverse_lazy
 from .models import Post
 
@@ -15,16 +13,15 @@ class LatestPostsFeed(Feed):
 
     # The items() method retrieves the objects to be included in the feed.
     def items(self):
-        return Post.published.all()[:5]
+        return Post.published.without_bodies()[:5]
 
     def item_title(self, item):
         return item.title
 
-    # In the item_description() method, we use the markdown() function to convert Markdown content
-    # to HTML and the truncatewords_html() template filter function to cut the description of posts after
-    # 30 words, avoiding unclosed HTML tags.
+    # In the item_description() method, we return the excerpt stored by Post.save(): the Markdown body
+    # converted to HTML and cut after 30 words with truncatewords_html(), avoiding unclosed HTML tags.
     def item_description(self, item):
-        return truncatewords_html(markdown.markdown(item.body), 30)
+        return item.excerpt_html
 
     def item_pubdate(self, item):
         return item.publish
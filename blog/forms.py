@@ -19,4 +19,13 @@ class CommentForm(forms.ModelForm):
 
 
 class SearchForm(forms.Form):
-    query = forms.CharField()
\ No newline at end of file
+    query = forms.CharField()
+    # how results are ordered (see PostgresSearchBackend.search)
+    mode = forms.ChoiceField(
+        choices=[
+            ('blend', 'Best match'),
+            ('rank', 'Full-text rank'),
+            ('trigram', 'Title similarity'),
+        ],
+        required=False,
+    )
\ No newline at end of file
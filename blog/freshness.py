@@ -0,0 +1,90 @@
+from functools import wraps
+
+from django.core.cache import cache
+from django.db.models import Subquery
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .models import Post, Comment
+
+
+# Validators for conditional GET (ETag / Last-Modified / 304 Not Modified).
+#
+# Every page that extends base.html shows the sidebar (post count, latest and most
+# commented posts), so the blog pages can change whenever any post or comment changes.
+# Their validators are therefore the newest Post.updated_on and the newest
+# Comment.updated_on, which covers edits, publishing/unpublishing, new comments and
+# comments being approved or hidden. Tag changes and comment deletions touch
+# Post.updated_on too (see blog.signals). Some changes leave no newer updated_on
+# behind: a deleted post leaves no row at all, and import_blog inserts rows with the
+# timestamps of the file. Their time is recorded by record_content_change() under
+# CONTENT_CHANGE_KEY (without expiry), which is the third validator. Should the cache
+# lose it, the ETag changes (a miss, never a stale 304) and Last-Modified falls back
+# to the older changes, which the pages have not seen since either.
+#
+# Both maxima are read in one query, each answered from the '-updated_on' indexes,
+# and the result is remembered on the request because django's condition() decorator
+# asks for the ETag and the Last-Modified date separately.
+
+CONTENT_CHANGE_KEY = 'blog:freshness:changed'
+
+
+def record_content_change():
+    cache.set(CONTENT_CHANGE_KEY, timezone.now(), None)
+
+
+def _latest_changes_query():
+    return (
+        Post.objects.order_by('-updated_on')
+        .annotate(last_comment=Subquery(Comment.objects.order_by('-updated_on').values('updated_on')[:1]))
+        .values_list('updated_on', 'last_comment')
+    )
+
+
+def _latest_changes(request):
+    if not hasattr(request, '_blog_latest_changes'):
+        post_changed, comment_changed = _latest_changes_query().first() or (None, None)
+        request._blog_latest_changes = (post_changed, comment_changed, cache.get(CONTENT_CHANGE_KEY))
+    return request._blog_latest_changes
+
+
+def async_condition(etag_func=None, last_modified_func=None):
+    """
+    django's condition() for the async views of blog/async_views.py.
+
+    condition() calls the validator functions synchronously, which an async view must
+    not do with the ORM, so the query is run with the async ORM first and the
+    validators then only read the memoized result.
+    """
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view)
+
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            if not hasattr(request, '_blog_latest_changes'):
+                post_changed, comment_changed = await _latest_changes_query().afirst() or (None, None)
+                recorded = await cache.aget(CONTENT_CHANGE_KEY)
+                request._blog_latest_changes = (post_changed, comment_changed, recorded)
+            return await conditional_view(request, *args, **kwargs)
+        return inner
+    return decorator
+
+
+def content_last_modified(request, *args, **kwargs):
+    changes = [changed for changed in _latest_changes(request) if changed is not None]
+    return max(changes) if changes else None
+
+
+def content_etag(request, *args, **kwargs):
+    post_changed, comment_changed, recorded = _latest_changes(request)
+    if post_changed is None and recorded is None:
+        return None
+    stamps = [changed.timestamp() if changed else 0 for changed in (post_changed, comment_changed, recorded)]
+    return '-'.join(f'{stamp:.6f}' for stamp in stamps)
+
+
+def posts_last_modified(request, *args, **kwargs):
+    # the feed and the sitemap show no comments, the newest post change is enough
+    post_changed, _, recorded = _latest_changes(request)
+    changes = [changed for changed in (post_changed, recorded) if changed is not None]
+    return max(changes) if changes else None
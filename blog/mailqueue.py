@@ -0,0 +1,146 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+
+# Outbound mail queue
+#
+# Views never talk to the SMTP server: enqueue_mail() stores the message in the
+# OutboundEmail table and returns at once. The send_queued_mail management command
+# drains the table in batches, sending each batch over one reused EMAIL_BACKEND
+# connection, so a slow or stalled SMTP server only holds up the worker.
+#
+# * A failed message is retried after MAIL_QUEUE_RETRY_DELAY seconds, doubling on every
+#   attempt, and is marked failed after MAIL_QUEUE_MAX_ATTEMPTS attempts.
+# * One address gets at most one message per MAIL_QUEUE_RECIPIENT_INTERVAL seconds;
+#   anything beyond that waits for the next slot instead of being sent.
+# * Rows are claimed in a short transaction (SELECT ... FOR UPDATE SKIP LOCKED, then
+#   marked sending and committed), so several workers can run side by side without
+#   sending a message twice, and no row lock or transaction stays open while the SMTP
+#   server is talked to. The results are recorded in a second short transaction.
+# * A claim is a lease of MAIL_QUEUE_SENDING_TIMEOUT seconds and counts as an attempt:
+#   the messages of a worker that died while sending are claimed again once it runs
+#   out (and may then reach their recipient twice).
+#
+# Any EMAIL_BACKEND works, so the queue can be exercised with the locmem or file
+# backends, or against a local SMTP stand-in such as `python -m aiosmtpd -n`.
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue_mail(subject, message, recipient_list, from_email=None):
+    """
+    Queue one message per recipient; the signature follows django.core.mail.send_mail().
+    """
+    return OutboundEmail.objects.bulk_create([
+        OutboundEmail(subject=subject, body=message, from_email=from_email or '', to=recipient)
+        for recipient in recipient_list
+    ])
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=_setting('MAIL_QUEUE_RETRY_DELAY', 60) * 2 ** (attempts - 1))
+
+
+def send_queued_mail(batch_size=None, connection=None):
+    """
+    Send one batch of due messages. Returns (claimed, sent): the number of messages
+    taken from the queue, including those deferred to their recipient's next slot or
+    failed, and the number of them sent. No claimed messages means the queue has
+    nothing due.
+    """
+    batch_size = batch_size or _setting('MAIL_QUEUE_BATCH_SIZE', 50)
+    max_attempts = _setting('MAIL_QUEUE_MAX_ATTEMPTS', 5)
+    interval = timedelta(seconds=_setting('MAIL_QUEUE_RECIPIENT_INTERVAL', 60))
+    lease = timedelta(seconds=_setting('MAIL_QUEUE_SENDING_TIMEOUT', 600))
+    now = timezone.now()
+
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            # SENDING rows are due once their lease ran out
+            .filter(status__in=[OutboundEmail.Status.QUEUED, OutboundEmail.Status.SENDING], next_attempt_on__lte=now)
+            .order_by('next_attempt_on')[:batch_size]
+        )
+        if not batch:
+            return 0, 0
+
+        last_sent = dict(
+            OutboundEmail.objects.filter(to__in={email.to for email in batch}, sent_on__gt=now - interval)
+            .values('to')
+            .annotate(last=Max('sent_on'))
+            .values_list('to', 'last')
+        )
+        due = []
+        for email in batch:
+            if email.to in last_sent:
+                # wait for the recipient's next slot; this is not a failed attempt
+                email.status = OutboundEmail.Status.QUEUED
+                email.next_attempt_on = last_sent[email.to] + interval
+            else:
+                # the messages of this batch count against the recipient too
+                last_sent[email.to] = now
+                email.status = OutboundEmail.Status.SENDING
+                # the lease, which also tells this claim apart from a later one
+                email.next_attempt_on = now + lease
+                email.attempts += 1
+                due.append(email)
+        OutboundEmail.objects.bulk_update(batch, ['status', 'next_attempt_on', 'attempts'])
+
+    if not due:
+        # every message of the batch was throttled
+        return len(batch), 0
+    sent = 0
+    connection = connection or get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # the server is unreachable: every message of the batch failed this attempt
+        for email in due:
+            _failed(email, e, now, max_attempts)
+    else:
+        try:
+            for email in due:
+                message = EmailMessage(
+                    subject=email.subject,
+                    body=email.body,
+                    from_email=email.from_email or None,
+                    to=[email.to],
+                    connection=connection,
+                )
+                try:
+                    message.send()
+                except Exception as e:
+                    _failed(email, e, now, max_attempts)
+                else:
+                    email.status = OutboundEmail.Status.SENT
+                    email.sent_on = timezone.now()
+                    sent += 1
+        finally:
+            connection.close()
+
+    with transaction.atomic():
+        # only the rows still claimed by this call: if sending outlasted the lease,
+        # another worker owns them now
+        OutboundEmail.objects.filter(status=OutboundEmail.Status.SENDING, next_attempt_on=now + lease).bulk_update(
+            due, ['status', 'next_attempt_on', 'last_error', 'sent_on']
+        )
+    return len(batch), sent
+
+
+def _failed(email, error, now, max_attempts):
+    # the attempt was counted when the message was claimed
+    email.last_error = f'{type(error).__name__}: {error}'
+    if email.attempts >= max_attempts:
+        email.status = OutboundEmail.Status.FAILED
+    else:
+        email.status = OutboundEmail.Status.QUEUED
+        email.next_attempt_on = now + retry_delay(email.attempts)
@@ -0,0 +1,195 @@
+import json
+import random
+import time
+import tracemalloc
+from itertools import cycle
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from blog.models import Post, TagStats
+from blog.pagination import encode_cursor
+from blog.perflog import measure, percentile
+from blog.sitemaps import PostSitemap
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the public endpoints in-process against the configured database: latency '
+        'percentiles, queries and peak memory per endpoint. Results can be saved as a named '
+        'baseline (in BENCHMARK_DIR) and later runs compared with it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per endpoint first.')
+        parser.add_argument('--endpoint', action='append', dest='endpoints', help='Only run this endpoint (repeatable).')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for picking the sample posts, tags and terms.')
+        parser.add_argument('--save', metavar='NAME', help='Save the results as baseline NAME.')
+        parser.add_argument('--compare', metavar='NAME', help='Compare the results with baseline NAME.')
+        parser.add_argument(
+            '--max-regression', type=float, default=None, metavar='PERCENT',
+            help='With --compare, fail if a p95 got slower by more than PERCENT or queries went up.',
+        )
+
+    def handle(self, *args, **options):
+        baseline = self.load_baseline(options['compare']) if options['compare'] else None
+        endpoints = self.endpoints(random.Random(options['seed']))
+        if options['endpoints']:
+            unknown = set(options['endpoints']) - set(endpoints)
+            if unknown:
+                raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))} (known: {', '.join(endpoints)}).")
+            endpoints = {name: urls for name, urls in endpoints.items() if name in options['endpoints']}
+
+        # production-like request handling: no DEBUG query log, no performance log lines
+        # for the benchmark's own requests, and the test client's host allowed
+        with override_settings(
+            DEBUG=False,
+            PERF_LOG_ENABLED=False,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        ):
+            client = Client()
+            results = {
+                name: self.run_endpoint(client, urls, options['iterations'], options['warmup'])
+                for name, urls in endpoints.items()
+            }
+
+        self.report(results, baseline)
+        if options['save']:
+            path = self.baseline_path(options['save'])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps({
+                'posts': Post.published.count(),
+                'iterations': options['iterations'],
+                'results': results,
+            }, indent=2))
+            self.stdout.write(self.style.SUCCESS(f'Saved baseline {path}'))
+        if baseline is not None and options['max_regression'] is not None:
+            self.check_regressions(results, baseline, options['max_regression'])
+
+    def endpoints(self, rng):
+        """
+        Return {name: [url, ...]}; each endpoint cycles through its sample urls so the
+        benchmark does not measure a single, perfectly cached row.
+        """
+        posts = list(Post.published.only('id', 'slug', 'publish').order_by('?')[:20])
+        if not posts:
+            raise CommandError('There are no published posts, create some with `manage.py generate_data`.')
+        tags = list(
+            TagStats.objects.filter(published_posts__gt=0).order_by('-published_posts')
+            .values_list('tag__slug', flat=True)[:20]
+        )
+        words = [word for post in posts for word in post.slug.split('-')[:3] if not word.isdigit()]
+
+        listing = reverse('blog:post_list')
+        if settings.POST_LIST_PAGINATION == 'keyset':
+            middle = Post.published.order_by('-publish', '-id').only('id', 'publish')
+            middle = middle[Post.published.count() // 2]
+            deep = [f'{listing}?after={encode_cursor(middle)}']
+        else:
+            # out of range numbers are answered with the last page
+            deep = [f'{listing}?page=1000000']
+
+        sitemap_shards = [
+            reverse('sitemap_shard', kwargs={'section': 'posts', 'shard': shard})
+            for shard, lastmod in PostSitemap().shards()
+        ]
+        endpoints = {
+            'listing': [listing],
+            'listing_deep': deep,
+            'detail': [post.get_absolute_url() for post in posts],
+            'tag': [reverse('blog:post_list_by_tag', args=[slug]) for slug in tags] or [listing],
+            # far into the busiest tag (Zipf: the first tag has the most posts)
+            'tag_deep': [f"{reverse('blog:post_list_by_tag', args=[tags[0]])}?page=1000000"] if tags else [],
+            'search': [f"{reverse('blog:post_search')}?query={word}" for word in rng.sample(words, min(10, len(words)))],
+            'feed': [reverse('blog:post_feed')],
+            'sitemap_index': [reverse('django.contrib.sitemaps.views.sitemap')],
+            'sitemap_shard': sitemap_shards[:5],
+        }
+        return {name: urls for name, urls in endpoints.items() if urls}
+
+    def fetch(self, client, url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f'GET {url} answered {response.status_code}.')
+        if response.streaming:
+            # the body of a streamed response is produced while it is consumed
+            b''.join(response.streaming_content)
+        return response
+
+    def run_endpoint(self, client, urls, iterations, warmup):
+        urls = cycle(urls)
+        for _ in range(warmup):
+            self.fetch(client, next(urls))
+
+        latencies, queries, db_times = [], [], []
+        for _ in range(iterations):
+            url = next(urls)
+            with measure() as stats:
+                started = time.perf_counter()
+                self.fetch(client, url)
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(stats.db_queries)
+            db_times.append(stats.db_time * 1000)
+
+        # peak memory in a separate request: tracemalloc slows down everything it traces
+        tracemalloc.start()
+        try:
+            self.fetch(client, next(urls))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        latencies.sort()
+        return {
+            'p50_ms': round(percentile(latencies, 0.5), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'queries': round(sum(queries) / iterations, 2),
+            'db_ms': round(sum(db_times) / iterations, 2),
+            'peak_kib': round(peak / 1024, 1),
+        }
+
+    def report(self, results, baseline):
+        self.stdout.write(
+            f"{'endpoint':<16} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'db ms':>8} {'peak KiB':>9}"
+            + (f" {'p95 vs base':>12} {'queries vs base':>16}" if baseline else '')
+        )
+        for name, result in results.items():
+            line = (
+                f"{name:<16} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+                f"{result['queries']:>8.1f} {result['db_ms']:>8.1f} {result['peak_kib']:>9.1f}"
+            )
+            before = baseline['results'].get(name) if baseline else None
+            if before:
+                change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+                line += f" {change:>+11.1f}% {result['queries'] - before['queries']:>+16.1f}"
+            self.stdout.write(line)
+
+    def check_regressions(self, results, baseline, max_regression):
+        regressions = []
+        for name, result in results.items():
+            before = baseline['results'].get(name)
+            if not before:
+                continue
+            if before['p95_ms'] and result['p95_ms'] > before['p95_ms'] * (1 + max_regression / 100):
+                regressions.append(f"{name}: p95 {before['p95_ms']} -> {result['p95_ms']} ms")
+            if result['queries'] > before['queries']:
+                regressions.append(f"{name}: queries {before['queries']} -> {result['queries']}")
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n  ' + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def baseline_path(self, name):
+        return Path(getattr(settings, 'BENCHMARK_DIR', settings.BASE_DIR / 'benchmarks')) / f'{name}.json'
+
+    def load_baseline(self, name):
+        path = self.baseline_path(name)
+        try:
+            return json.loads(path.read_text())
+        except FileNotFoundError:
+            raise CommandError(f'No baseline named {name!r} ({path}).')
@@ -0,0 +1,101 @@
+import importlib.util
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare requests/sec of the async views under uvicorn (ASGI) with the sync views '
+        'under gunicorn (WSGI). Both servers are started here, against the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per path and server.')
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--workers', type=int, default=2, help='Worker processes per server.')
+        parser.add_argument('--port', type=int, default=8765, help='First of the two ports used.')
+        parser.add_argument('--path', action='append', dest='paths', help='Path to request (repeatable).')
+
+    def handle(self, *args, **options):
+        for module in ('uvicorn', 'gunicorn'):
+            if importlib.util.find_spec(module) is None:
+                raise CommandError(f'{module} is not installed (pip install {module}).')
+
+        paths = options['paths'] or self.default_paths()
+        servers = [
+            ('ASGI (uvicorn, async views)', options['port'], True, [
+                sys.executable, '-m', 'uvicorn', 'myblog.asgi:application',
+                '--port', str(options['port']), '--workers', str(options['workers']), '--log-level', 'warning',
+            ]),
+            ('WSGI (gunicorn, sync views)', options['port'] + 1, False, [
+                sys.executable, '-m', 'gunicorn', 'myblog.wsgi:application',
+                '--bind', f"127.0.0.1:{options['port'] + 1}", '--workers', str(options['workers']),
+                '--log-level', 'warning',
+            ]),
+        ]
+
+        self.stdout.write(f"{'server':<30} {'path':<40} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>6}")
+        for label, port, async_views, command in servers:
+            env = {**os.environ, 'BLOG_ASYNC_VIEWS': str(async_views)}
+            server = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+            try:
+                self.wait_for_port(port)
+                for path in paths:
+                    url = f'http://127.0.0.1:{port}{path}'
+                    # warm-up: caches, connections, lazily imported modules
+                    self.run_load(url, options['concurrency'], options['concurrency'])
+                    rate, p50, p95, errors = self.run_load(url, options['requests'], options['concurrency'])
+                    self.stdout.write(f'{label:<30} {path:<40} {rate:>8.1f} {p50:>8.1f} {p95:>8.1f} {errors:>6}')
+            finally:
+                server.terminate()
+                server.wait()
+
+    def default_paths(self):
+        paths = [reverse('blog:post_list'), reverse('blog:post_search') + '?query=django', reverse('blog:post_feed')]
+        post = Post.published.only('slug', 'publish').first()
+        if post is not None:
+            paths.insert(1, post.get_absolute_url())
+        return paths
+
+    def wait_for_port(self, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with socket.socket() as s:
+                if s.connect_ex(('127.0.0.1', port)) == 0:
+                    return
+            time.sleep(0.2)
+        raise CommandError(f'The server on port {port} did not start within {timeout}s.')
+
+    def run_load(self, url, total, concurrency):
+        def fetch(_):
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url) as response:
+                    response.read()
+                ok = True
+            except (urllib.error.URLError, OSError):
+                ok = False
+            return time.perf_counter() - started, ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(fetch, range(total)))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(duration * 1000 for duration, ok in results)
+        errors = sum(1 for duration, ok in results if not ok)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return total / elapsed, statistics.median(latencies), p95, errors
@@ -0,0 +1,70 @@
+import json
+import random
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from blog.queryplans import endpoint_plans, plan_checking
+
+from .benchmark_endpoints import Command as BenchmarkCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Request every public endpoint (the ones of benchmark_endpoints) in-process, EXPLAIN each '
+        'SELECT it ran and fail if any plan reads a table with a sequential scan. Run it against a '
+        'database filled by `manage.py generate_data`.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', action='append', dest='endpoints', help='Only check this endpoint (repeatable).')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for picking the sample posts, tags and terms.')
+        parser.add_argument(
+            '--allow', action='append', default=[], metavar='TABLE',
+            help='Accept sequential scans of TABLE, e.g. a table that only ever holds a few rows (repeatable).',
+        )
+        parser.add_argument('--save', metavar='NAME', help='Save every captured plan as NAME in BENCHMARK_DIR.')
+        parser.add_argument('--show-plans', action='store_true', help='Print the plan of every query.')
+
+    def handle(self, *args, **options):
+        endpoints = BenchmarkCommand().endpoints(random.Random(options['seed']))
+        if options['endpoints']:
+            unknown = set(options['endpoints']) - set(endpoints)
+            if unknown:
+                raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))} (known: {', '.join(endpoints)}).")
+            endpoints = {name: urls for name, urls in endpoints.items() if name in options['endpoints']}
+
+        # like benchmark_endpoints, plus no cached pages or search results: every
+        # request has to run its queries
+        with plan_checking():
+            client = Client()
+            plans = {name: self.check_endpoint(client, urls[0]) for name, urls in endpoints.items()}
+
+        allowed = set(options['allow'])
+        failures = []
+        for name, queries in plans.items():
+            for query in queries:
+                scans = [table for table in query['seq_scans'] if table not in allowed]
+                if options['show_plans'] or scans:
+                    self.stdout.write(f"{name}: {query['sql']}")
+                    self.stdout.write(json.dumps(query['plan'], indent=2))
+                if scans:
+                    failures.append(f"{name}: sequential scan of {', '.join(scans)}")
+            self.stdout.write(f'{name:<16} {len(queries):>3} queries checked')
+
+        if options['save']:
+            path = Path(getattr(settings, 'BENCHMARK_DIR', settings.BASE_DIR / 'benchmarks')) / f"plans-{options['save']}.json"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(plans, indent=2))
+            self.stdout.write(self.style.SUCCESS(f'Saved plans {path}'))
+        if failures:
+            raise CommandError('Plans with sequential scans:\n  ' + '\n  '.join(failures))
+        self.stdout.write(self.style.SUCCESS('No sequential scans.'))
+
+    def check_endpoint(self, client, url):
+        response, plans = endpoint_plans(client, url)
+        if response.status_code != 200:
+            raise CommandError(f'GET {url} answered {response.status_code}.')
+        return plans
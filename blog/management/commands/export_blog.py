@@ -0,0 +1,22 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from blog.transfer import export_records, write_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Stream the tags, posts and comments of the blog to a JSON Lines file (see blog/transfer.py).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='File to write, or - for standard output.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        records = export_records(batch_size=options['batch_size'])
+        if options['output'] == '-':
+            write_jsonl(records, sys.stdout)
+            return
+        with open(options['output'], 'w') as f:
+            written = write_jsonl(records, f)
+        self.stdout.write(self.style.SUCCESS(f"Exported {written} records to {options['output']}."))
@@ -0,0 +1,202 @@
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from django.utils.text import slugify
+from taggit.models import Tag
+
+from blog.models import Post, Comment, TaggedPost
+from blog.search.cache import bump_search_generation
+from blog.search.suggest import invalidate_suggestions
+from blog.templatetags.blog_tags import invalidate_sidebar
+from blog.transfer import comment_count_trigger_disabled
+
+
+# words the titles, bodies, tags and comments are made of
+WORDS = (
+    'django python model view template query index cache database postgres search '
+    'async request response server client page feed sitemap tag comment post author '
+    'deploy docker linux network memory latency thread process queue worker signal '
+    'form field admin migration schema table column join filter order limit offset '
+    'cursor batch stream file json markdown html css javascript api rest graphql test '
+    'debug profile benchmark scale replica shard backup restore monitor log metric '
+    'trace alert error retry timeout session cookie token auth user group permission '
+    'static media storage upload image video audio email smtp spam bot crawler robot '
+    'design pattern refactor legacy release version branch merge review commit build'
+).split()
+
+
+def zipf_weights(count, exponent):
+    # rank r gets weight 1 / r**exponent: a few very popular items and a long tail
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a synthetic blog corpus (posts, comments, tags) of a configurable size with '
+        'skewed tag and comment distributions, for benchmarking. Adds to the existing data; '
+        'the comments table is locked while comments are generated.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=100000)
+        parser.add_argument('--tags', type=int, default=500)
+        parser.add_argument('--authors', type=int, default=20)
+        parser.add_argument('--tags-per-post', type=int, default=4, help='Maximum number of tags of a post.')
+        parser.add_argument('--years', type=int, default=5, help='Spread publish dates over this many years.')
+        parser.add_argument('--draft-ratio', type=float, default=0.1)
+        parser.add_argument('--inactive-ratio', type=float, default=0.05, help='Share of hidden comments.')
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of tag and comment popularity.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=None, help='Seed for a reproducible corpus.')
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='Do not rebuild similar posts, tag statistics and the search index afterwards.',
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.options = options
+        now = timezone.now()
+
+        authors = self.create_authors(options['authors'])
+        tag_ids = self.create_tags(options['tags'])
+        post_ids = self.create_posts(options['posts'], authors, now)
+        self.tag_posts(post_ids, tag_ids)
+        self.create_comments(options['comments'], post_ids, now)
+
+        # bulk_create() sends no signals, so the derived data is rebuilt once at the end
+        if not options['skip_derived']:
+            call_command('rebuild_similar_posts', stdout=self.stdout)
+            call_command('rebuild_tag_stats', stdout=self.stdout)
+            call_command('rebuild_search_index', stdout=self.stdout)
+        invalidate_sidebar()
+        invalidate_suggestions()
+        bump_search_generation()
+
+    def text(self, words):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words))
+
+    def create_authors(self, count):
+        User = get_user_model()
+        usernames = [f'author{n}' for n in range(1, count + 1)]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        unusable = make_password(None)
+        User.objects.bulk_create([
+            User(username=username, password=unusable) for username in usernames if username not in existing
+        ])
+        return list(User.objects.filter(username__in=usernames).values_list('id', flat=True))
+
+    def create_tags(self, count):
+        names = []
+        for first in WORDS:
+            for second in WORDS:
+                names.append(f'{first}-{second}' if first != second else first)
+        self.random.shuffle(names)
+        names = names[:count]
+        Tag.objects.bulk_create(
+            [Tag(name=name, slug=slugify(name)) for name in names],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+        ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+        # the order of the list is the popularity rank of each tag
+        return [ids[name] for name in names]
+
+    def create_posts(self, count, authors, now):
+        first_number = (Post.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        span = timedelta(days=365 * self.options['years']).total_seconds()
+        post_ids = []
+        for start in range(0, count, self.batch_size):
+            batch = []
+            for number in range(first_number + start, first_number + min(count, start + self.batch_size)):
+                title = self.text(self.random.randint(3, 8)).capitalize()
+                paragraphs = [self.text(self.random.randint(40, 120)) for _ in range(self.random.randint(2, 8))]
+                if self.random.random() < 0.3:
+                    paragraphs.insert(1, '## ' + self.text(4).capitalize())
+                post = Post(
+                    title=title,
+                    slug=f'{slugify(title)}-{number}',
+                    author_id=self.random.choice(authors),
+                    body='\n\n'.join(paragraphs),
+                    publish=now - timedelta(seconds=self.random.random() * span),
+                    status=(
+                        Post.Status.DRAFT if self.random.random() < self.options['draft_ratio']
+                        else Post.Status.PUBLISHED
+                    ),
+                )
+                # what Post.save() would do; the search_vector trigger fills in the rest
+                post.render_body()
+                batch.append(post)
+            with transaction.atomic():
+                created = Post.objects.bulk_create(batch)
+                # auto_now(_add) stamped every row with the current time
+                Post.objects.filter(id__in=[post.id for post in created]).update(
+                    created_on=F('publish'), updated_on=F('publish')
+                )
+            post_ids.extend(post.id for post in created)
+            self.stdout.write(f'{len(post_ids)} / {count} posts')
+        return post_ids
+
+    def tag_posts(self, post_ids, tag_ids):
+        if not tag_ids:
+            return
+        weights = zipf_weights(len(tag_ids), self.options['skew'])
+        for start in range(0, len(post_ids), self.batch_size):
+            items = []
+            for post_id in post_ids[start:start + self.batch_size]:
+                wanted = self.random.randint(1, self.options['tags_per_post'])
+                tags = set(self.random.choices(tag_ids, cum_weights=weights, k=wanted))
+                items.extend(TaggedPost(content_object_id=post_id, tag_id=tag) for tag in tags)
+            TaggedPost.objects.bulk_create(items)
+        self.stdout.write(f'Tagged {len(post_ids)} posts')
+
+    def create_comments(self, count, post_ids, now):
+        if not post_ids or not count:
+            return
+        # the popularity order of the posts is random, not by age
+        popular = post_ids[:]
+        self.random.shuffle(popular)
+        weights = zipf_weights(len(popular), self.options['skew'])
+        first_id = None
+        with transaction.atomic():
+            # one Post.active_comment_count UPDATE per comment row would dominate the
+            # run, the counts are recomputed once below instead
+            with comment_count_trigger_disabled():
+                for start in range(0, count, self.batch_size):
+                    size = min(self.batch_size, count - start)
+                    created = Comment.objects.bulk_create([
+                        Comment(
+                            post_id=post_id,
+                            name=self.random.choice(WORDS).capitalize(),
+                            email=f'reader{self.random.randint(1, 50000)}@example.com',
+                            body=self.text(self.random.randint(5, 60)),
+                            active=self.random.random() >= self.options['inactive_ratio'],
+                        )
+                        for post_id in self.random.choices(popular, cum_weights=weights, k=size)
+                    ])
+                    if first_id is None:
+                        first_id = created[0].id
+                    self.stdout.write(f'{start + size} / {count} comments')
+            with connection.cursor() as cursor:
+                # spread the comments between the publish date of their post and now
+                cursor.execute(
+                    f'UPDATE {Comment._meta.db_table} AS c '
+                    'SET created_on = p.publish + random() * (%s - p.publish) '
+                    f'FROM {Post._meta.db_table} AS p WHERE c.post_id = p.id AND c.id >= %s',
+                    [now, first_id],
+                )
+                cursor.execute(
+                    f'UPDATE {Comment._meta.db_table} SET updated_on = created_on WHERE id >= %s',
+                    [first_id],
+                )
+        call_command('repair_comment_counts', stdout=self.stdout)
@@ -0,0 +1,50 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from blog.freshness import record_content_change
+from blog.pagecache import post_key, purge
+from blog.search.cache import bump_search_generation
+from blog.search.suggest import invalidate_suggestions
+from blog.templatetags.blog_tags import invalidate_sidebar
+from blog.transfer import Importer
+
+
+class Command(BaseCommand):
+    help = (
+        'Import tags, posts and comments from a JSON Lines file written by export_blog, in '
+        'batched transactions. Rebuilds the derived data once at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='JSON Lines file to read.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Continue an interrupted import after its last committed batch.',
+        )
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='Do not rebuild comment counts, similar posts, tag statistics and the search index afterwards.',
+        )
+
+    def handle(self, *args, **options):
+        importer = Importer(options['input'], batch_size=options['batch_size'], log=self.stdout.write)
+        counts = importer.run(resume=options['resume'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {counts['tag']} tags, {counts['post']} posts and {counts['comment']} comments."
+        ))
+        if importer.skipped:
+            self.stdout.write(self.style.WARNING(f'Skipped {importer.skipped} comments whose post is missing.'))
+
+        if not options['skip_derived']:
+            call_command('repair_comment_counts', stdout=self.stdout)
+            call_command('rebuild_similar_posts', stdout=self.stdout)
+            call_command('rebuild_tag_stats', stdout=self.stdout)
+            call_command('rebuild_search_index', stdout=self.stdout)
+        invalidate_sidebar()
+        invalidate_suggestions()
+        bump_search_generation()
+        # the imported rows carry their old updated_on, which moves no validator
+        record_content_change()
+        # the listings show the new posts; existing posts may have new comments
+        purge(['listing', 'sidebar', *map(post_key, importer.commented_posts)])
@@ -0,0 +1,68 @@
+import json
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.perflog import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Summarize the per-request performance log (PERF_LOG_PATH and its rotated files): '
+        'latency percentiles, queries, database and template time per view.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Log file to read (defaults to PERF_LOG_PATH).')
+        parser.add_argument('--view', help='Only report this view name, e.g. blog:post_detail.')
+        parser.add_argument('--slowest', type=int, default=0, help='Also list the N slowest requests.')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'] or settings.PERF_LOG_PATH)
+        # the rotated files first (the oldest has the highest number), then the live one
+        rotated = [f for f in path.parent.glob(path.name + '.*') if f.suffix[1:].isdigit()]
+        files = sorted(rotated, key=lambda f: -int(f.suffix[1:])) + [path]
+        files = [f for f in files if f.exists()]
+        if not files:
+            raise CommandError(f'No performance log at {path}.')
+
+        entries = defaultdict(list)
+        for log_file in files:
+            with open(log_file) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    view = entry.get('view') or '(unresolved)'
+                    if options['view'] and view != options['view']:
+                        continue
+                    entries[view].append(entry)
+
+        self.stdout.write(
+            f"{'view':<32} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'queries':>8} {'db ms':>8} {'tpl ms':>8} {'cache hit':>9}"
+        )
+        for view, rows in sorted(entries.items(), key=lambda item: -len(item[1])):
+            latencies = sorted(row['ms'] for row in rows)
+            count = len(rows)
+            hits = sum(row.get('cache_hits', 0) for row in rows)
+            lookups = hits + sum(row.get('cache_misses', 0) for row in rows)
+            hit_rate = f'{hits / lookups:.0%}' if lookups else '-'
+            self.stdout.write(
+                f'{view:<32} {count:>7} {percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.95):>8.1f} '
+                f'{percentile(latencies, 0.99):>8.1f} {sum(row["db_queries"] for row in rows) / count:>8.1f} '
+                f'{sum(row["db_ms"] for row in rows) / count:>8.1f} '
+                f'{sum(row["template_ms"] for row in rows) / count:>8.1f} {hit_rate:>9}'
+            )
+
+        if options['slowest']:
+            self.stdout.write('\nSlowest requests:')
+            every = [row for rows in entries.values() for row in rows]
+            for row in sorted(every, key=lambda row: -row['ms'])[:options['slowest']]:
+                self.stdout.write(
+                    f"{row['ms']:>9.1f} ms  {row.get('view')}  {row['method']} {row['status']}  "
+                    f"{row['db_queries']} queries / {row['db_ms']} ms db"
+                )
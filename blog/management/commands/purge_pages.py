@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from blog.pagecache import get_purge_worker, purge
+
+
+class Command(BaseCommand):
+    help = (
+        'Purge the cached pages tagged with the given surrogate keys (e.g. post-12, '
+        'tag-django, listing, sidebar), locally and through PAGE_CACHE_PURGE_HOOK.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('keys', nargs='+', metavar='KEY')
+
+    def handle(self, *args, **options):
+        purge(options['keys'])
+        # the hook runs on a background thread: wait for it before reporting
+        get_purge_worker().flush()
+        self.stdout.write(self.style.SUCCESS(f"Purged {' '.join(options['keys'])}."))
@@ -0,0 +1,52 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class PurgeHandler(BaseHTTPRequestHandler):
+    def do_PURGE(self):
+        self.server.received(self.path, self.headers.get('Surrogate-Key', '').split())
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PurgeStandIn(HTTPServer):
+    """
+    Answers PURGE requests and keeps their (path, keys); also used by blog.tests.
+    """
+
+    def __init__(self, address, on_purge=None):
+        super().__init__(address, PurgeHandler)
+        self.purges = []
+        self.on_purge = on_purge
+
+    def received(self, path, keys):
+        self.purges.append((path, keys))
+        if self.on_purge:
+            self.on_purge(path, keys)
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a local HTTP server that answers the PURGE requests of blog.pagecache.http_purge '
+        'and prints their surrogate keys, in place of a real reverse proxy.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=6081)
+
+    def handle(self, *args, **options):
+        server = PurgeStandIn(
+            ('127.0.0.1', options['port']),
+            on_purge=lambda path, keys: self.stdout.write(f"PURGE {path} {' '.join(keys)}"),
+        )
+        self.stdout.write(f"Answering PURGE on http://127.0.0.1:{options['port']}/ (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from blog.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index of published posts for the configured SEARCH_BACKEND.'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        indexed = backend.rebuild()
+        if indexed is None:
+            self.stdout.write(f'{type(backend).__name__} keeps no separate index, nothing to do.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} published posts.'))
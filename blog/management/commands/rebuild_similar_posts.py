@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from blog.similarity import rebuild_similar_posts
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed similar posts of every published post.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        stored = rebuild_similar_posts(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Stored {stored} similar post links.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from blog.tagstats import rebuild_tag_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the published post count and dates of every tag.'
+
+    def handle(self, *args, **options):
+        changed = rebuild_tag_stats()
+        self.stdout.write(self.style.SUCCESS(f'Updated the statistics of {changed} tags.'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from blog.models import Post, Comment
+from blog.templatetags.blog_tags import invalidate_sidebar
+
+
+class Command(BaseCommand):
+    help = 'Recompute Post.active_comment_count from the comments table, in batches of posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        active_comments = (
+            Comment.objects.filter(post=OuterRef('pk'), active=True)
+            .order_by()
+            .values('post')
+            .annotate(total=Count('id'))
+            .values('total')
+        )
+        post_ids = Post.objects.order_by('id').values_list('id', flat=True)
+        last_id = 0
+        repaired = 0
+        # walk the posts by primary key so every batch is one short UPDATE
+        while True:
+            batch = list(post_ids.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1]
+            new_count = Coalesce(Subquery(active_comments), 0)
+            repaired += (
+                Post.objects.filter(id__in=batch)
+                .exclude(active_comment_count=new_count)
+                .update(active_comment_count=new_count)
+            )
+        if repaired:
+            # the "most commented posts" sidebar was built from the wrong counts
+            invalidate_sidebar()
+        self.stdout.write(self.style.SUCCESS(f'Repaired the comment count of {repaired} posts.'))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.mailqueue import send_queued_mail
+
+
+class Command(BaseCommand):
+    help = 'Send the e-mails queued by the blog (e.g. post_share), in batches over one connection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep draining the queue instead of exiting once it is empty.',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='Seconds to wait when the queue is empty (with --loop).',
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            claimed, sent = send_queued_mail(batch_size=options['batch_size'])
+            total += sent
+            if claimed:
+                # a batch that was all throttled or failed is not the end of the queue:
+                # those rows are due later, the next batch may be sendable now
+                self.stdout.write(f'Sent {sent} of {claimed} e-mails.')
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Sent {total} e-mails in total.'))
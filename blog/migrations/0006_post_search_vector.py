@@ -0,0 +1,62 @@
+# Generated by Django 5.1.15 on 2026-10-18 08:37
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+# The tsvector is maintained by the database itself: a BEFORE trigger recomputes it
+# whenever title or body are written, which covers Model.save(), bulk_create(),
+# QuerySet.update() and raw SQL edits without any Python-side hooks.
+SEARCH_VECTOR_TRIGGER_SQL = """
+CREATE FUNCTION blog_post_search_vector_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('spanish', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('spanish', coalesce(NEW.body, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER blog_post_search_vector_update
+    BEFORE INSERT OR UPDATE OF title, body ON blog_post
+    FOR EACH ROW EXECUTE FUNCTION blog_post_search_vector_trigger();
+
+-- backfill the rows that existed before the trigger
+UPDATE blog_post SET search_vector =
+    setweight(to_tsvector('spanish', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('spanish', coalesce(body, '')), 'B');
+"""
+
+DROP_SEARCH_VECTOR_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS blog_post_search_vector_update ON blog_post;
+DROP FUNCTION IF EXISTS blog_post_search_vector_trigger();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_trigram_ext'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_TRIGGER_SQL, DROP_SEARCH_VECTOR_TRIGGER_SQL),
+        # indexes are built after the backfill so they are created in one pass
+        migrations.AddIndex(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='blog_post_search_vector_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='blog_post_title_trgm_gin', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.15 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+from blog.rendering import render_markdown, make_excerpt
+
+
+def render_existing_posts(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    batch = []
+    for post in Post.objects.only('id', 'body').iterator(chunk_size=500):
+        post.body_html = render_markdown(post.body)
+        post.excerpt_html = make_excerpt(post.body_html)
+        batch.append(post)
+        if len(batch) == 500:
+            Post.objects.bulk_update(batch, ['body_html', 'excerpt_html'])
+            batch = []
+    Post.objects.bulk_update(batch, ['body_html', 'excerpt_html'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_post_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(render_existing_posts, migrations.RunPython.noop),
+    ]
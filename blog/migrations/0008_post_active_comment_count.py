@@ -0,0 +1,66 @@
+# Generated by Django 5.1.15 on 2026-10-18 08:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Post.active_comment_count is maintained by the database: row triggers on blog_comment
+# adjust the counter of the affected post(s) for every insert, delete and every update
+# that flips `active` or moves a comment to another post, including bulk updates.
+COMMENT_COUNT_TRIGGER_SQL = """
+CREATE FUNCTION blog_comment_active_count_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.active THEN
+        UPDATE blog_post SET active_comment_count = active_comment_count - 1 WHERE id = OLD.post_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.active THEN
+        UPDATE blog_post SET active_comment_count = active_comment_count + 1 WHERE id = NEW.post_id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER blog_comment_active_count_insert_delete
+    AFTER INSERT OR DELETE ON blog_comment
+    FOR EACH ROW EXECUTE FUNCTION blog_comment_active_count_trigger();
+
+CREATE TRIGGER blog_comment_active_count_update
+    AFTER UPDATE OF active, post_id ON blog_comment
+    FOR EACH ROW
+    WHEN (OLD.active IS DISTINCT FROM NEW.active OR OLD.post_id IS DISTINCT FROM NEW.post_id)
+    EXECUTE FUNCTION blog_comment_active_count_trigger();
+
+-- backfill the counters for the comments that already exist
+UPDATE blog_post SET active_comment_count = (
+    SELECT count(*) FROM blog_comment
+    WHERE blog_comment.post_id = blog_post.id AND blog_comment.active
+);
+"""
+
+DROP_COMMENT_COUNT_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS blog_comment_active_count_update ON blog_comment;
+DROP TRIGGER IF EXISTS blog_comment_active_count_insert_delete ON blog_comment;
+DROP FUNCTION IF EXISTS blog_comment_active_count_trigger();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_post_body_html'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='active_comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(COMMENT_COUNT_TRIGGER_SQL, DROP_COMMENT_COUNT_TRIGGER_SQL),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', '-active_comment_count'], name='blog_post_status_f8a84f_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'active', 'created_on', 'id'], name='blog_commen_post_id_0d1665_idx'),
+        ),
+    ]
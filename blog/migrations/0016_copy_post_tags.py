@@ -0,0 +1,51 @@
+from django.db import migrations, transaction
+
+
+BATCH_SIZE = 5000
+
+
+def copy_post_tags(apps, schema_editor):
+    # Copy the posts' rows of taggit's generic TaggedItem into TaggedPost, in batches
+    # of BATCH_SIZE that are each committed on their own (the migration is not atomic),
+    # so no lock is held on either table for longer than one batch.
+    # The old rows are left in place. The copy skips rows it already made, so if old
+    # processes kept tagging posts during the rollout, run it again with
+    # `manage.py migrate blog 0015 && manage.py migrate blog` (the reverse does nothing).
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TaggedPost = apps.get_model('blog', 'TaggedPost')
+    Post = apps.get_model('blog', 'Post')
+    db = schema_editor.connection.alias
+
+    content_type = ContentType.objects.using(db).filter(app_label='blog', model='post').first()
+    if content_type is None:
+        return
+    # a generic relation does not cascade: skip the rows of posts deleted since
+    items = TaggedItem.objects.using(db).filter(
+        content_type=content_type, object_id__in=Post.objects.using(db).values('id'),
+    ).order_by('id')
+    last_id = 0
+    while True:
+        batch = list(items.filter(id__gt=last_id).values_list('id', 'object_id', 'tag_id')[:BATCH_SIZE])
+        if not batch:
+            break
+        with transaction.atomic(using=db):
+            TaggedPost.objects.using(db).bulk_create(
+                [TaggedPost(content_object_id=post_id, tag_id=tag_id) for _, post_id, tag_id in batch],
+                ignore_conflicts=True,
+            )
+        last_id = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('blog', '0015_taggedpost'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_post_tags, migrations.RunPython.noop),
+    ]
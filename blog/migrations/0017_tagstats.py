@@ -0,0 +1,60 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def fill_tag_stats(apps, schema_editor):
+    # the initial statistics; from here on blog.tagstats keeps them up to date
+    Tag = apps.get_model('taggit', 'Tag')
+    TaggedPost = apps.get_model('blog', 'TaggedPost')
+    TagStats = apps.get_model('blog', 'TagStats')
+    db = schema_editor.connection.alias
+
+    totals = {
+        tag_id: (count, latest_publish, last_modified)
+        for tag_id, count, latest_publish, last_modified in TaggedPost.objects.using(db)
+        .filter(content_object__status='Pb')
+        .values('tag')
+        .annotate(
+            count=Count('id'),
+            latest_publish=Max('content_object__publish'),
+            last_modified=Max('content_object__updated_on'),
+        )
+        .order_by()
+        .values_list('tag', 'count', 'latest_publish', 'last_modified')
+    }
+    stats = []
+    for tag_id in Tag.objects.using(db).values_list('id', flat=True).iterator():
+        count, latest_publish, last_modified = totals.get(tag_id, (0, None, None))
+        stats.append(TagStats(
+            tag_id=tag_id, published_posts=count, latest_publish=latest_publish, last_modified=last_modified,
+        ))
+    TagStats.objects.using(db).bulk_create(stats, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0016_copy_post_tags'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagStats',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='taggit.tag')),
+                ('published_posts', models.PositiveIntegerField(default=0)),
+                ('latest_publish', models.DateTimeField(blank=True, null=True)),
+                ('last_modified', models.DateTimeField(blank=True, null=True)),
+                ('updated_on', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('published_posts__gt', 0)), fields=['-published_posts'], name='blog_tagstats_used_idx')],
+            },
+        ),
+        migrations.RunPython(fill_tag_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0017_tagstats'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='post',
+            name='blog_post_pub_id_updated_idx',
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['id'], include=('updated_on', 'status'), name='blog_post_sitemap_shard_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagstats',
+            index=models.Index(fields=['tag'], include=('updated_on', 'published_posts'), name='blog_tagstats_sitemap_idx'),
+        ),
+    ]
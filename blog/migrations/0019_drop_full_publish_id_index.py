@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:23
+
+from django.db import migrations
+
+
+# The keyset listings filter on status = 'Pb', so they walk the partial
+# blog_post_pub_publish_id_idx from 0014; the full (-publish, -id) index from 0009 is
+# used by no query any more.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0018_sitemap_shard_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='post',
+            name='blog_post_publish_595161_idx',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0019_drop_full_publish_id_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboundemail',
+            name='status',
+            field=models.CharField(choices=[('QU', 'Queued'), ('SN', 'Sending'), ('ST', 'Sent'), ('FL', 'Failed')], default='QU', max_length=2),
+        ),
+    ]
@@ -1,11 +1,56 @@
+from datetime import date, datetime, timedelta
+
 from django.db import models
 from django.utils import timezone
 from django.conf import settings
 from django.urls import reverse
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItemBase
+
+from .rendering import render_markdown, make_excerpt
+
+
+def publish_day_range(year, month, day):
+    """
+    Return the (start, end) datetimes of the day year-month-day in the current time
+    zone, or None when there is no such day.
+    """
+    try:
+        first = date(year, month, day)
+        following = first + timedelta(days=1)
+    except (ValueError, OverflowError):
+        return None
+    return (
+        timezone.make_aware(datetime.combine(first, datetime.min.time())),
+        timezone.make_aware(datetime.combine(following, datetime.min.time())),
+    )
+
+
+class PostQuerySet(models.QuerySet):
+    # columns that only the detail page (or nothing at all) displays
+    large_fields = ('body', 'body_html', 'search_vector')
 
+    def without_bodies(self):
+        return self.defer(*self.large_fields)
 
-class PublishedManager(models.Manager):
+    def for_listing(self):
+        # list.html shows the author and the tags of every post: load the authors with a
+        # JOIN and all the tags of the page in one extra query instead of 2 queries per post
+        return self.without_bodies().select_related('author').prefetch_related('tags')
+
+    def published_on(self, year, month, day):
+        # the day of a detail URL as a range of publish, so the lookup can use the
+        # (slug, publish) index; publish__year/__month/__day would extract the date
+        # parts of every row with that slug instead
+        bounds = publish_day_range(year, month, day)
+        if bounds is None:
+            return self.none()
+        return self.filter(publish__gte=bounds[0], publish__lt=bounds[1])
+
+
+class PublishedManager(models.Manager.from_queryset(PostQuerySet)):
     def get_queryset(self):
         return (
             super().get_queryset().filter(status=Post.Status.PUBLISHED)
@@ -29,6 +74,10 @@ class Post(models.Model):
     # meaning that each post is written by a user, and a user can write any number of posts.
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='blog_posts')
     body = models.TextField()
+    # HTML rendered from the Markdown body and its list/feed excerpt, both computed in save()
+    # so templates never run markdown at request time (see render_body()).
+    body_html = models.TextField(blank=True, editable=False)
+    excerpt_html = models.TextField(blank=True, editable=False)
     publish = models.DateTimeField(default=timezone.now)
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
@@ -38,8 +87,17 @@ class Post(models.Model):
         choices=Status,
         default=Status.DRAFT
     )
+    # Weighted full-text document (title 'A', body 'B') for post_search.
+    # It is filled in by the blog_post_search_vector_update trigger installed in
+    # migration 0006, so it stays current on save(), bulk_create() and queryset
+    # update() alike, and it never has to be computed while searching.
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Number of active comments, kept up to date by the blog_comment_active_count triggers
+    # from migration 0008 (so it also follows bulk QuerySet.update() calls on comments).
+    # `python manage.py repair_comment_counts` recomputes it.
+    active_comment_count = models.PositiveIntegerField(default=0, editable=False)
 
-    objects = models.Manager()  # The default manager.
+    objects = PostQuerySet.as_manager()  # The default manager.
     published = PublishedManager()  # Our custom manager
 
     class Meta:
@@ -47,24 +105,149 @@ class Post(models.Model):
         # also this?
         indexes = [
             models.Index(fields=['-publish']),
+            # newest change, for the ETag / Last-Modified validators (blog/freshness.py)
+            models.Index(fields=['-updated_on']),
+            # Partial indexes over the published posts only: every public query filters
+            # status = 'Pb' first, and drafts never take space in these.
+            # listings, the feed and the published post count; keyset pagination walks
+            # the listings in ('-publish', '-id') order
+            models.Index(
+                fields=['-publish', '-id'], condition=models.Q(status='Pb'),
+                name='blog_post_pub_publish_id_idx',
+            ),
+            # post_detail: slug, then the publish range of the URL's day
+            models.Index(
+                fields=['slug', 'publish'], condition=models.Q(status='Pb'),
+                name='blog_post_pub_slug_publish_idx',
+            ),
+            # for the "most commented posts" sidebar query
+            models.Index(
+                fields=['-active_comment_count'], condition=models.Q(status='Pb'),
+                name='blog_post_pub_comments_idx',
+            ),
+            # the sitemap shards (id ranges), their lastmod and whether they list any
+            # published post, without visiting the table; over every row, since a draft
+            # still moves the lastmod of its shard
+            models.Index(
+                fields=['id'], include=['updated_on', 'status'],
+                name='blog_post_sitemap_shard_idx',
+            ),
+            # GIN index over the stored tsvector for the @@ full-text match
+            GinIndex(fields=['search_vector'], name='blog_post_search_vector_gin'),
+            # pg_trgm index (extension from migration 0005) for the title % query match
+            GinIndex(fields=['title'], name='blog_post_title_trgm_gin', opclasses=['gin_trgm_ops']),
         ]
 
     # initializing tags
-    tags = TaggableManager()
+    # through our own TaggedPost table instead of taggit's generic TaggedItem
+    tags = TaggableManager(through='TaggedPost')
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the status the row had in the database, so signal receivers can
+        # tell publish/unpublish transitions apart without querying for the old row
+        if 'status' in field_names:
+            instance._loaded_status = values[field_names.index('status')]
+        return instance
+
+    @property
+    def was_published(self):
+        return getattr(self, '_loaded_status', None) == self.Status.PUBLISHED
+
+    def render_body(self):
+        self.body_html = render_markdown(self.body)
+        self.excerpt_html = make_excerpt(self.body_html)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            # Never write active_comment_count back: the triggers own it, and this
+            # instance's copy may predate the comments added since it was loaded.
+            # (Deferred fields stay out, as in a plain save() of a deferred instance.)
+            deferred = self.get_deferred_fields()
+            update_fields = kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'active_comment_count'
+                and field.attname not in deferred
+            ]
+        if update_fields is None or 'body' in update_fields:
+            self.render_body()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'body_html', 'excerpt_html'}
+        super().save(*args, **kwargs)
+        self._loaded_status = self.status
+
     def get_absolute_url(self):
+        # the day in the current time zone, as post_detail looks it up (publish_day_range)
+        publish = timezone.localtime(self.publish)
         return reverse('blog:post_detail', args=[
-            self.publish.year,
-            self.publish.month,
-            self.publish.day,
+            publish.year,
+            publish.month,
+            publish.day,
             self.slug
         ]
                        )
 
 
+class TaggedPost(TaggedItemBase):
+    """
+    The tags of a post. taggit's default TaggedItem is shared by every tagged model and
+    joins on (content_type_id, object_id); this one has a real foreign key to Post.
+    """
+    # both foreign keys are covered by the two indexes below, which lead with them
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='%(app_label)s_%(class)s_items', db_index=False)
+    content_object = models.ForeignKey('Post', on_delete=models.CASCADE, related_name='tagged_items', db_index=False)
+
+    class Meta:
+        constraints = [
+            # a tag's posts (the tag pages); also one row per post and tag
+            models.UniqueConstraint(fields=['tag', 'content_object'], name='blog_taggedpost_tag_post_uniq'),
+        ]
+        indexes = [
+            # a post's tags (listings, similar posts)
+            models.Index(fields=['content_object', 'tag'], name='blog_taggedpost_post_tag_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.content_object_id} tagged {self.tag_id}'
+
+
+class TagStats(models.Model):
+    """
+    Published post count and dates of a tag, kept up to date by blog/tagstats.py.
+    """
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    published_posts = models.PositiveIntegerField(default=0)
+    # newest publish date of its published posts
+    latest_publish = models.DateTimeField(null=True, blank=True)
+    # newest updated_on of its published posts: the lastmod of the tag page
+    last_modified = models.DateTimeField(null=True, blank=True)
+    # when this row last changed (the lastmod of a tag sitemap shard, which also
+    # changes when a tag stops being listed)
+    updated_on = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # the tag cloud: most used tags first
+            models.Index(
+                fields=['-published_posts'], condition=models.Q(published_posts__gt=0),
+                name='blog_tagstats_used_idx',
+            ),
+            # the sitemap shards (tag id ranges), as for Post
+            models.Index(
+                fields=['tag'], include=['updated_on', 'published_posts'],
+                name='blog_tagstats_sitemap_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.tag_id}: {self.published_posts} posts'
+
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     name = models.CharField(max_length=80)
@@ -76,7 +259,71 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['created_on']
-        indexes = [models.Index(fields=['created_on'])]
+        indexes = [
+            models.Index(fields=['created_on']),
+            # one post's thread, page by page: WHERE post = ? AND active ORDER BY created_on, id
+            models.Index(fields=['post', 'active', 'created_on', 'id']),
+            # newest change, for the ETag / Last-Modified validators (blog/freshness.py)
+            models.Index(fields=['-updated_on']),
+        ]
 
     def __str__(self):
         return f"Comment by {self.name} on {self.post}"
+
+
+class SimilarPost(models.Model):
+    """
+    Precomputed "similar posts" of a published post (see blog/similarity.py).
+    """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='similar_entries')
+    similar = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='similar_to')
+    # number of tags both posts share
+    same_tags = models.PositiveIntegerField()
+    # 0 is the most similar post
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['post', 'rank']
+        constraints = [
+            # also the index post_detail uses to read the neighbours of a post in one lookup
+            models.UniqueConstraint(fields=['post', 'rank'], name='blog_similarpost_post_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.similar} is similar to {self.post}"
+
+
+class OutboundEmail(models.Model):
+    """
+    An e-mail waiting to be sent by the send_queued_mail worker (see blog/mailqueue.py).
+    """
+    class Status(models.TextChoices):
+        QUEUED = 'QU', 'Queued'
+        # claimed by a send_queued_mail worker, until next_attempt_on
+        SENDING = 'SN', 'Sending'
+        SENT = 'ST', 'Sent'
+        FAILED = 'FL', 'Failed'
+
+    subject = models.CharField(max_length=1000)
+    body = models.TextField()
+    # empty means settings.DEFAULT_FROM_EMAIL
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.EmailField()
+    status = models.CharField(max_length=2, choices=Status, default=Status.QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_on = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    sent_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['next_attempt_on']
+        indexes = [
+            # the worker's "what is due" query
+            models.Index(fields=['status', 'next_attempt_on']),
+            # per-recipient throttling looks at what was sent to an address lately
+            models.Index(fields=['to', '-sent_on']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_status_display()} e-mail to {self.to}: {self.subject}"
@@ -0,0 +1,322 @@
+import atexit
+import hashlib
+import logging
+import queue
+import re
+import threading
+import time
+import urllib.request
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response
+from django.utils.module_loading import import_string
+from taggit.models import Tag
+
+from .models import TaggedPost
+from .perflog import count_cache
+from .routers import read_from_primary
+from .templatetags.blog_tags import SIDEBAR_VERSION_KEY, invalidate_sidebar, sidebar_cache, stale_sidebar_served
+
+
+# Full-page cache
+#
+# With PAGE_CACHE_ENABLED, PageCacheMiddleware keeps the complete HTML of the
+# PAGE_CACHE_VIEWS (listings, tag pages, post detail) for anonymous GET requests in the
+# PAGE_CACHE_ALIAS cache, so a hit costs two cache reads and no rendering or queries.
+#
+# Surrogate keys: each of these views tags its response with the keys of what it shows
+# (a Surrogate-Key header, e.g. "listing post-12 post-15 sidebar tag-django"):
+#
+#   post-<id>     the post itself (detail page, listing entries, similar posts)
+#   tag-<slug>    a tag page
+#   listing       the post listings (a newly published post appears there)
+#   sidebar       the sidebar, which is on every page
+#
+# Every key has a version in the cache: the time of its last purge. A cached page
+# remembers the versions of its keys and is only served while they are unchanged.
+# The version of 'sidebar' is the sidebar cache's own version token
+# (blog/templatetags/blog_tags.py): whatever invalidates the cached sidebar also makes
+# the pages showing it stale, and purging 'sidebar' invalidates the sidebar. Neither
+# renders anything on the write path.
+#
+# A miss reads from a replica like any other request, unless the stale copy it replaces
+# was purged less than REPLICA_PIN_SECONDS ago: the replica may not have the change yet,
+# and the page would be stored for everybody, so that one render reads from the primary.
+# blog.signals calls purge() with exactly the keys a change affects, which bumps those
+# versions here and hands the keys to the PAGE_CACHE_PURGE_HOOK (a dotted path to a
+# callable taking the keys), e.g. http_purge() below for a reverse proxy in front. The
+# hook runs on a background thread (PurgeWorker), so a slow or unreachable proxy never
+# holds up the request that made the change; keys queued while it runs are sent
+# together in its next call.
+#
+# CSRF: the comment form carries a per-visitor token. Pages are stored with a
+# placeholder instead of the token, and every hit gets a fresh token of its own (and the
+# csrftoken cookie, from CsrfViewMiddleware). The middleware must therefore come after
+# CsrfViewMiddleware and AuthenticationMiddleware.
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'blog:page:key:{}'
+CSRF_INPUT_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = b'\x00csrf-token\x00'
+# response headers kept with a cached page
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Surrogate-Key')
+
+
+def post_key(post_id):
+    return f'post-{post_id}'
+
+
+def tag_key(slug):
+    return f'tag-{slug}'
+
+
+def add_surrogate_keys(response, keys):
+    response['Surrogate-Key'] = ' '.join(sorted(set(keys)))
+    return response
+
+
+def page_cache():
+    return caches[getattr(settings, 'PAGE_CACHE_ALIAS', 'default')]
+
+
+def purge(keys):
+    """
+    Drop every cached page tagged with any of keys, here and upstream.
+    """
+    keys = sorted(set(keys))
+    if not keys or not getattr(settings, 'PAGE_CACHE_ENABLED', False):
+        return
+    now = time.time_ns()
+    if 'sidebar' in keys:
+        invalidate_sidebar()
+    page_cache().set_many({VERSION_KEY.format(key): now for key in keys if key != 'sidebar'}, None)
+    hook = getattr(settings, 'PAGE_CACHE_PURGE_HOOK', None)
+    if hook:
+        get_purge_worker().submit(hook, keys)
+
+
+class PurgeWorker:
+    """
+    Calls purge hooks on a daemon thread, in order, merging the keys that queue up
+    for the same hook while a call is running.
+    """
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name='blog-page-purge', daemon=True)
+        self.thread.start()
+
+    def submit(self, hook, keys):
+        self.queue.put((hook, keys))
+
+    def flush(self, timeout=None):
+        """
+        Wait until everything submitted so far has been handed to its hook.
+        """
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            pending = {}
+            flushed = []
+            while True:
+                if isinstance(item, threading.Event):
+                    flushed.append(item)
+                else:
+                    hook, keys = item
+                    pending.setdefault(hook, set()).update(keys)
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            for hook, keys in pending.items():
+                self.call(hook, sorted(keys))
+            for done in flushed:
+                done.set()
+
+    def call(self, hook, keys):
+        try:
+            import_string(hook)(keys)
+        except Exception:
+            # the local cache is purged either way; an upstream copy expires on its own
+            logger.exception('Upstream purge of %s failed', ' '.join(keys))
+
+
+_purge_worker = None
+_purge_worker_lock = threading.Lock()
+
+
+def get_purge_worker():
+    global _purge_worker
+    with _purge_worker_lock:
+        if _purge_worker is None:
+            _purge_worker = PurgeWorker()
+            # let the purges of a short-lived process (a management command) go out
+            atexit.register(_purge_worker.flush, getattr(settings, 'PAGE_CACHE_PURGE_TIMEOUT', 2) * 2)
+    return _purge_worker
+
+
+def key_versions(keys):
+    """
+    Return {key: version} of the keys that have one.
+    """
+    versions = page_cache().get_many([VERSION_KEY.format(key) for key in keys if key != 'sidebar'])
+    versions = {key: versions[VERSION_KEY.format(key)] for key in keys if VERSION_KEY.format(key) in versions}
+    if 'sidebar' in keys:
+        sidebar = sidebar_cache().get(SIDEBAR_VERSION_KEY)
+        if sidebar is not None:
+            versions['sidebar'] = sidebar
+    return versions
+
+
+def purge_posts(post_ids, tag_ids=()):
+    """
+    Purge the pages that show post_ids: their own, the listings, the sidebar and the
+    pages of their tags and of tag_ids (e.g. tags just removed from them).
+    """
+    if not getattr(settings, 'PAGE_CACHE_ENABLED', False):
+        return
+    tag_ids = set(tag_ids) | set(
+        TaggedPost.objects.filter(content_object_id__in=post_ids).values_list('tag_id', flat=True)
+    )
+    slugs = Tag.objects.filter(id__in=tag_ids).values_list('slug', flat=True)
+    purge(['listing', 'sidebar', *map(post_key, post_ids), *map(tag_key, slugs)])
+
+
+def http_purge(keys):
+    """
+    PAGE_CACHE_PURGE_HOOK for a reverse proxy that purges by surrogate key (Varnish
+    with xkey, Fastly, ...): a PURGE request to PAGE_CACHE_PURGE_URL with the keys in
+    a Surrogate-Key header. Point the URL at any local HTTP server to watch the
+    purges (see `manage.py purge_stand_in`).
+    """
+    request = urllib.request.Request(
+        settings.PAGE_CACHE_PURGE_URL,
+        method='PURGE',
+        headers={'Surrogate-Key': ' '.join(keys)},
+    )
+    with urllib.request.urlopen(request, timeout=getattr(settings, 'PAGE_CACHE_PURGE_TIMEOUT', 2)):
+        pass
+
+
+class PageCacheMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'PAGE_CACHE_ENABLED', False)
+        self.views = set(getattr(settings, 'PAGE_CACHE_VIEWS', []))
+        self.timeout = getattr(settings, 'PAGE_CACHE_TIMEOUT', 600)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        started = time.time_ns()
+        response = self.get_response(request)
+        self.store(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        started = time.time_ns()
+        response = await self.get_response(request)
+        await sync_to_async(self.store)(request, response, started)
+        return response
+
+    def cacheable(self, request):
+        return (
+            request.method == 'GET'
+            and request.resolver_match is not None
+            and request.resolver_match.view_name in self.views
+            # without a session cookie there is nobody logged in, nor anything to load
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES
+            and not request.user.is_authenticated
+        )
+
+    def cache_key(self, request):
+        url = request.build_absolute_uri().encode()
+        return f'blog:page:{hashlib.md5(url, usedforsecurity=False).hexdigest()}'
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.enabled or not self.cacheable(request):
+            return None
+        entry = page_cache().get(self.cache_key(request))
+        if entry is not None:
+            versions = key_versions(entry['versions'])
+            # a version missing from the cache (evicted) never matches
+            if all(versions.get(key) == version for key, version in entry['versions'].items()):
+                count_cache(hit=True)
+                return self.cached_response(request, entry)
+            recently = time.time_ns() - getattr(settings, 'REPLICA_PIN_SECONDS', 10) * 10**9
+            if any(version > recently for version in versions.values()):
+                # purged just now: the replica may still show the old data, and the page
+                # is stored for everybody (see blog/routers.py)
+                read_from_primary()
+        count_cache(hit=False)
+        request._page_cache_miss = True
+        request._stale_sidebars = []
+        stale_sidebar_served.set(request._stale_sidebars)
+        return None
+
+    def cached_response(self, request, entry):
+        headers = entry['headers']
+        response = get_conditional_response(request, etag=headers.get('ETag'))
+        if response is not None:
+            # 304 Not Modified
+            for name in ('ETag', 'Last-Modified'):
+                if name in headers:
+                    response[name] = headers[name]
+            return response
+        content = entry['content']
+        if CSRF_PLACEHOLDER in content:
+            content = content.replace(CSRF_PLACEHOLDER, get_token(request).encode())
+        response = HttpResponse(content)
+        for name, value in headers.items():
+            response[name] = value
+        response['X-Page-Cache'] = 'hit'
+        return response
+
+    def store(self, request, response, started):
+        if not getattr(request, '_page_cache_miss', False):
+            return
+        if (
+            response.status_code != 200
+            or response.streaming
+            or 'Surrogate-Key' not in response
+            or set(response.cookies) - {settings.CSRF_COOKIE_NAME}
+        ):
+            return
+        keys = set(response['Surrogate-Key'].split())
+        cache = page_cache()
+        versions = key_versions(keys)
+        # a key purged while the page was being rendered may have been purged after
+        # its data was read: keep this copy out of the cache
+        if any(version > started for version in versions.values()):
+            return
+        if 'sidebar' in keys and ('sidebar' not in versions or request._stale_sidebars):
+            # the page shows an older sidebar than the token says (another worker was
+            # re-rendering it), or the token is gone: nothing to compare a hit against
+            return
+        for key in keys - versions.keys():
+            # never purged so far (if a purge wins the race, the page simply misses)
+            cache.add(VERSION_KEY.format(key), 0, None)
+            versions[key] = 0
+        cache.set(self.cache_key(request), {
+            'versions': versions,
+            'content': CSRF_INPUT_RE.sub(rb'\1' + CSRF_PLACEHOLDER + rb'\2', response.content),
+            'headers': {name: response[name] for name in STORED_HEADERS if name in response},
+        }, self.timeout)
@@ -0,0 +1,116 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+
+# Keyset (cursor) pagination for the post listings.
+#
+# Django's Paginator needs a COUNT(*) and an OFFSET for every page, and both get slower
+# the deeper into the archive you go. Here a page is instead "the next per_page posts
+# after/before this (publish, id) pair", which the ('-publish', '-id') index answers
+# directly whatever the page depth. The price is that there is no page count and no
+# jumping to page N, only next/previous links. Select it with
+# POST_LIST_PAGINATION = 'keyset' (see settings.py).
+
+
+def encode_cursor(obj, field='publish'):
+    raw = f'{getattr(obj, field).isoformat()}|{obj.pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Return the (publish, id) pair of a cursor, or None if token is not a valid cursor.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        publish, pk = raw.split('|')
+        return datetime.fromisoformat(publish), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+class KeysetPage:
+    # lets pagination.html tell this apart from a django.core.paginator.Page
+    is_keyset = True
+
+    def __init__(self, object_list, has_next, has_previous, cursor_field='publish'):
+        self.object_list = object_list
+        self.cursor_field = cursor_field
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1], self.cursor_field) if self._has_next else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0], self.cursor_field) if self._has_previous else None
+
+
+def keyset_paginate(queryset, per_page, params):
+    """
+    Return the KeysetPage of queryset selected by the ?after= / ?before= cursor in params.
+
+    Posts are listed newest first, ordered by ('-publish', '-id'). An invalid or
+    missing cursor gives the first page.
+    """
+    after = decode_cursor(params.get('after', ''))
+    before = decode_cursor(params.get('before', '')) if after is None else None
+
+    if before is not None:
+        # walk backwards from the cursor, then put the page back in display order
+        publish, pk = before
+        rows = list(
+            queryset.filter(Q(publish__gt=publish) | Q(publish=publish, id__gt=pk))
+            .order_by('publish', 'id')[:per_page + 1]
+        )
+        if rows:
+            has_previous = len(rows) > per_page
+            return KeysetPage(rows[:per_page][::-1], has_next=True, has_previous=has_previous)
+        # nothing newer than the cursor any more: show the first page
+
+    queryset = queryset.order_by('-publish', '-id')
+    if after is not None:
+        publish, pk = after
+        queryset = queryset.filter(Q(publish__lt=publish) | Q(publish=publish, id__lt=pk))
+    # one extra row tells us whether there is a next page, no COUNT needed
+    rows = list(queryset[:per_page + 1])
+    return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_previous=after is not None)
+
+
+def comment_page(queryset, per_page, after=None):
+    """
+    Return the KeysetPage of the comments in queryset that follow the after cursor.
+
+    Comments are read oldest first, ordered by ('created_on', 'id'), which the
+    (post, active, created_on, id) index of Comment answers for one post's thread.
+    There are only "more" links, so has_previous just says whether a cursor was given.
+    """
+    queryset = queryset.order_by('created_on', 'id')
+    position = decode_cursor(after or '')
+    if position is not None:
+        created_on, pk = position
+        queryset = queryset.filter(Q(created_on__gt=created_on) | Q(created_on=created_on, id__gt=pk))
+    rows = list(queryset[:per_page + 1])
+    return KeysetPage(
+        rows[:per_page], has_next=len(rows) > per_page, has_previous=position is not None, cursor_field='created_on'
+    )
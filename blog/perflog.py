@@ -0,0 +1,233 @@
+import atexit
+import json
+import logging
+import math
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates
+
+
+# Per-request performance log
+#
+# With PERF_LOG_ENABLED, PerformanceLogMiddleware writes one JSON line per request to
+# PERF_LOG_PATH:
+#
+#   {"ts": ..., "view": "blog:post_detail", "method": "GET", "status": 200,
+#    "ms": 41.2, "db_queries": 4, "db_ms": 12.9, "template_ms": 8.1,
+#    "cache_hits": 1, "cache_misses": 0}
+#
+# Every request is measured (queries are timed by an execute wrapper installed on each
+# connection, so it does not need DEBUG), but only a PERF_LOG_SAMPLE_RATE fraction of
+# them is written, plus every request slower than PERF_LOG_SLOW_MS. Lines are handed
+# to a background thread through a queue, so the request never waits for the file,
+# which is rotated at PERF_LOG_MAX_BYTES. Template times need the TimedDjangoTemplates
+# backend below.
+# `python manage.py perf_report` summarizes the log.
+
+
+class RequestStats:
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.rendering = False
+        self.lock = threading.Lock()
+
+
+_current = ContextVar('blog_request_stats', default=None)
+
+
+def count_cache(hit):
+    """
+    Record a cache lookup of the current request (called by the blog's own caches).
+    """
+    stats = _current.get()
+    if stats is not None:
+        with stats.lock:
+            if hit:
+                stats.cache_hits += 1
+            else:
+                stats.cache_misses += 1
+
+
+def _time_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        with stats.lock:
+            stats.db_queries += 1
+            stats.db_time += elapsed
+
+
+def install_query_timer(connection, **kwargs):
+    # connected to connection_created: every connection, in every thread (the async
+    # ORM's executor and the worker threads of blog.async_views included), reports
+    # its queries to the request whose context it runs in
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def install_query_timers():
+    connection_created.connect(install_query_timer, dispatch_uid='blog.perflog')
+    for connection in connections.all(initialized_only=True):
+        install_query_timer(connection)
+
+
+@contextmanager
+def measure():
+    """
+    Collect the RequestStats of the code run inside the block (used by the benchmarks).
+    """
+    install_query_timers()
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        # templates rendered from inside another one (e.g. the sidebar) are already counted
+        if stats is None or stats.rendering:
+            return self.template.render(context, request)
+        stats.rendering = True
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - started
+            stats.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The DjangoTemplates backend, timing template rendering for the performance log.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def get_perf_logger():
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            path = Path(settings.PERF_LOG_PATH)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(
+                path,
+                maxBytes=getattr(settings, 'PERF_LOG_MAX_BYTES', 10 * 1024 * 1024),
+                backupCount=getattr(settings, 'PERF_LOG_BACKUP_COUNT', 5),
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            records = queue.SimpleQueue()
+            listener = QueueListener(records, handler)
+            listener.start()
+            atexit.register(listener.stop)
+
+            logger = logging.getLogger('blog.perf')
+            logger.addHandler(QueueHandler(records))
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            _logger = logger
+    return _logger
+
+
+def percentile(values, fraction):
+    # nearest-rank percentile of an already sorted list
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class PerformanceLogMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'PERF_LOG_ENABLED', False)
+        self.sample_rate = getattr(settings, 'PERF_LOG_SAMPLE_RATE', 1.0)
+        self.slow_ms = getattr(settings, 'PERF_LOG_SLOW_MS', 500)
+        if self.enabled:
+            install_query_timers()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.log(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.log(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def log(self, request, response, stats, elapsed):
+        ms = elapsed * 1000
+        if ms < self.slow_ms and random.random() >= self.sample_rate:
+            return
+        match = request.resolver_match
+        get_perf_logger().info(json.dumps({
+            'ts': round(time.time(), 3),
+            'view': match.view_name if match else None,
+            'method': request.method,
+            'status': response.status_code,
+            'ms': round(ms, 2),
+            'db_queries': stats.db_queries,
+            'db_ms': round(stats.db_time * 1000, 2),
+            'template_ms': round(stats.template_time * 1000, 2),
+            'cache_hits': stats.cache_hits,
+            'cache_misses': stats.cache_misses,
+        }))
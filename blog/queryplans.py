@@ -0,0 +1,101 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+
+# Query plan checks
+#
+# endpoint_plans() requests a URL in-process, captures every query it runs (with an
+# execute wrapper on each connection) and EXPLAINs the SELECTs. Sequential scans are
+# disabled while explaining: the planner still uses one when no index can answer the
+# query, so a Seq Scan in a plan means a missing (or unusable) index however small the
+# table is, and the result does not depend on the size of the dataset the way the
+# planner's own choices would.
+#
+# Used by blog.tests.QueryPlanTests and `python manage.py check_query_plans`.
+
+# the queries of the request being checked: [(alias, sql, params), ...]
+_captured = ContextVar('blog_captured_queries', default=None)
+
+
+def _capture_query(execute, sql, params, many, context):
+    queries = _captured.get()
+    if queries is not None and not many:
+        queries.append((context['connection'].alias, sql, params))
+    return execute(sql, params, many, context)
+
+
+def install_query_capture(connection, **kwargs):
+    if _capture_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_capture_query)
+
+
+@contextmanager
+def plan_checking():
+    """
+    Capture queries on every connection, and make every request of the block run its
+    queries: no cached pages or search results.
+    """
+    connection_created.connect(install_query_capture, dispatch_uid='blog.queryplans')
+    for connection in connections.all(initialized_only=True):
+        install_query_capture(connection)
+    with override_settings(
+        DEBUG=False,
+        PERF_LOG_ENABLED=False,
+        PAGE_CACHE_ENABLED=False,
+        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+        SEARCH_CACHE_SIZE=0,
+    ):
+        yield
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(alias, sql, params):
+    with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0][0]['Plan']
+        # undoes the SET, also when this is a savepoint inside a test's transaction
+        transaction.set_rollback(True, using=alias)
+    return plan
+
+
+def endpoint_plans(client, url):
+    """
+    GET url (inside plan_checking()) and return (response, plans), plans being a
+    [{'sql': ..., 'plan': ..., 'seq_scans': [table, ...]}, ...] of its SELECTs.
+    """
+    queries = []
+    token = _captured.set(queries)
+    try:
+        response = client.get(url)
+        if response.streaming:
+            # the body of a streamed response is produced while it is consumed
+            b''.join(response.streaming_content)
+    finally:
+        _captured.reset(token)
+
+    plans = []
+    for alias, sql, params in queries:
+        if not sql.lstrip().upper().startswith('SELECT'):
+            continue
+        plan = explain(alias, sql, params)
+        plans.append({
+            'sql': sql,
+            'plan': plan,
+            'seq_scans': sorted({
+                node['Relation Name'] for node in plan_nodes(plan)
+                if node['Node Type'] == 'Seq Scan'
+            }),
+        })
+    return response, plans
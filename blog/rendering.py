@@ -0,0 +1,18 @@
+import markdown
+from django.conf import settings
+from django.template.defaultfilters import truncatewords_html
+
+
+# number of words kept in the excerpt shown by list.html and the RSS feed
+EXCERPT_WORDS = 30
+
+
+def render_markdown(text):
+    # MARKDOWN_EXTENSIONS lets the site enable extras such as 'fenced_code';
+    # run `python manage.py rerender_posts` after changing it.
+    return markdown.markdown(text, extensions=getattr(settings, 'MARKDOWN_EXTENSIONS', []))
+
+
+def make_excerpt(html):
+    # truncatewords_html cuts after N words while closing any open HTML tags
+    return truncatewords_html(html, EXCERPT_WORDS)
@@ -0,0 +1,144 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections, transaction
+
+
+# Read replicas
+#
+# DATABASE_REPLICAS lists database aliases (see DB_REPLICA_HOSTS in settings.py) that
+# replicate 'default'. ReplicaRoutingMiddleware marks the requests of the public read
+# views (REPLICA_VIEWS: listing, detail, search, feed, sitemaps) and PrimaryReplicaRouter
+# sends their reads to one replica, picked at random per request. Everything else -
+# writes, post_comment / post_share, the admin, management commands, reads inside a
+# transaction - uses the primary.
+#
+# Replicas lag behind the primary a little, so:
+#   - after a request that wrote something (e.g. a comment) the browser gets a
+#     REPLICA_PIN_COOKIE for REPLICA_PIN_SECONDS, and its requests read from the primary
+#     meanwhile, so the writer sees what they just wrote. blog.signals calls
+#     record_write() on every save, delete and bulk update; a request that wrote
+#     nothing (e.g. a comment form sent back with errors) pins nothing;
+#   - the long-lived caches (sidebar, search results, autocomplete index, full pages)
+#     are filled from the primary, otherwise a refill right after an invalidation could store the
+#     replica's old rows until the next one.
+# Streamed bodies (the sitemap shards) are generated after the middleware has returned,
+# so they read from the primary.
+
+
+class RequestRouting:
+    def __init__(self, request, pinned):
+        self.request = request
+        self.pinned = pinned
+        self.replica = None
+
+
+_current = ContextVar('blog_db_routing', default=None)
+
+
+@contextmanager
+def primary():
+    """
+    Read from the primary inside the block, even in a request served by a replica.
+    """
+    routing = _current.get()
+    if routing is None:
+        yield
+        return
+    # a new object, not a change to the request's: the worker threads of
+    # blog.async_views share that one while they run next to each other
+    token = _current.set(RequestRouting(routing.request, pinned=routing.pinned))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def read_from_primary():
+    """
+    Send the remaining reads of the current request to the primary.
+    """
+    routing = _current.get()
+    if routing is not None:
+        routing.replica = None
+
+
+def record_write():
+    """
+    Pin the browser of the current request to the primary once the write commits.
+    """
+    routing = _current.get()
+    if routing is not None:
+        request = routing.request
+        transaction.on_commit(lambda: setattr(request, '_db_write', True))
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _current.get()
+        if routing is None or routing.replica is None:
+            return 'default'
+        if connections['default'].in_atomic_block:
+            # the transaction may read its own uncommitted writes
+            return 'default'
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.replicas = list(getattr(settings, 'DATABASE_REPLICAS', []))
+        self.views = set(getattr(settings, 'REPLICA_VIEWS', []))
+        self.cookie = getattr(settings, 'REPLICA_PIN_COOKIE', 'pin_primary')
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _current.set(RequestRouting(request, pinned=self.cookie in request.COOKIES))
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = _current.set(RequestRouting(request, pinned=self.cookie in request.COOKIES))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.pin(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routing = _current.get()
+        if (
+            self.replicas and routing is not None and not routing.pinned
+            and request.method in ('GET', 'HEAD')
+            and request.resolver_match.view_name in self.views
+        ):
+            routing.replica = random.choice(self.replicas)
+        return None
+
+    def pin(self, request, response):
+        if self.replicas and getattr(request, '_db_write', False):
+            response.set_cookie(self.cookie, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+# Short names accepted by the SEARCH_BACKEND setting. Any other value is
+# treated as a dotted path to a BaseSearchBackend subclass.
+BACKENDS = {
+    'postgres': 'blog.search.postgres.PostgresSearchBackend',
+    'bm25': 'blog.search.bm25.BM25SearchBackend',
+}
+
+_backend = None
+
+
+def get_search_backend():
+    """
+    Return the (per process) search backend selected by settings.SEARCH_BACKEND.
+    """
+    global _backend
+    if _backend is None:
+        name = getattr(settings, 'SEARCH_BACKEND', 'postgres')
+        _backend = import_string(BACKENDS.get(name, name))()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_search_backend(setting, **kwargs):
+    # lets override_settings(SEARCH_BACKEND=...) switch engines
+    global _backend
+    if setting in ('SEARCH_BACKEND', 'SEARCH_INDEX_PATH', 'SEARCH_INDEX_MERGE_DOCS'):
+        _backend = None
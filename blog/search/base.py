@@ -0,0 +1,56 @@
+from ..models import Post
+from .snippets import text_snippet
+
+
+class BaseSearchBackend:
+    """
+    Interface shared by the search engines used by the post_search view.
+    """
+
+    # ranking modes search() understands; the first one is the default
+    modes = ('blend',)
+
+    def search(self, query, mode=None):
+        """
+        Return the published posts matching query, best match first by mode.
+        """
+        raise NotImplementedError('subclasses of BaseSearchBackend must provide a search() method')
+
+    def search_ids(self, query, mode=None):
+        """
+        Return the ids of the posts search() would return, in the same order.
+        """
+        return [post.pk for post in self.search(query, mode)]
+
+    def snippets(self, post_ids, query):
+        """
+        Load the published posts post_ids, in that order, each with a `snippet`: HTML of
+        a piece of its body around the words of query, highlighted with <mark>.
+
+        Only call this for the posts that are displayed. Posts unpublished since the
+        ids were found are left out.
+        """
+        posts = Post.published.defer('body_html', 'search_vector').in_bulk(post_ids)
+        results = [posts[post_id] for post_id in post_ids if post_id in posts]
+        for post in results:
+            post.snippet = text_snippet(post.body, query)
+        return results
+
+    # The hooks below are called from blog.signals once a Post change is committed.
+    # Backends whose data lives in the database itself can keep the no-op versions.
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def index_posts(self, post_ids):
+        """
+        Bring the index up to date for a bulk change (e.g. a QuerySet.update() from the
+        admin) of post_ids, which sends no post_save signals.
+        """
+        pass
+
+    def rebuild(self):
+        pass
@@ -0,0 +1,365 @@
+"""
+In-process BM25 search backend.
+
+The inverted index is written to immutable files which every worker maps with mmap,
+so all gunicorn workers share one copy of it through the page cache. Writers never
+modify a file in place: they build a new one next to it and swap it in with
+os.replace(), and readers notice the new inode on their next search.
+
+There are two files. The main segment (SEARCH_INDEX_PATH) is written by
+rebuild_search_index and by merges. Saving or deleting posts only rewrites the small
+delta segment next to it (<path>.delta): the current documents of the changed posts,
+plus a list of tombstoned post ids whose documents in the main segment no longer
+count. A search scores both segments together. Once the delta holds
+SEARCH_INDEX_MERGE_DOCS documents or tombstones, the next change merges it into a new
+main segment. Every main segment has a new generation number and a delta only applies
+to the main segment with its generation, so a reader that sees a new main segment and
+an old delta (between the two swaps of a merge) ignores the delta.
+
+File layout (all sections padded to 8 bytes, arrays in native byte order):
+
+    header          magic, version, n_docs, n_terms, n_postings, avgdl, generation, n_deleted
+    doc_ids         int64[n_docs]       Post ids, ascending
+    doc_lens        uint32[n_docs]      weighted token count per document
+    term_offsets    uint32[n_terms+1]   term i is terms[term_offsets[i]:term_offsets[i+1]]
+    post_offsets    uint32[n_terms+1]   postings of term i are [post_offsets[i]:post_offsets[i+1]]
+    post_docs       uint32[n_postings]  document index of each posting
+    post_tfs        uint32[n_postings]  term frequency of each posting
+    deleted         int64[n_deleted]    tombstoned post ids, ascending (delta only)
+    terms           utf-8 terms, sorted bytewise so they can be binary searched
+"""
+import fcntl
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from heapq import nlargest
+from operator import itemgetter
+from pathlib import Path
+
+from django.conf import settings
+
+from ..models import Post
+from .base import BaseSearchBackend
+from .text import tokenize
+
+
+MAGIC = b'BLOGBM25'
+VERSION = 2
+HEADER = struct.Struct('<8sIIIQdQQ')
+
+# standard BM25 parameters
+K1 = 1.2
+B = 0.75
+# a title token counts as much as this many body tokens
+TITLE_WEIGHT = 2
+
+
+def document_terms(title, body):
+    terms = Counter(tokenize(body))
+    for token in tokenize(title):
+        terms[token] += TITLE_WEIGHT
+    return terms
+
+
+def _padding(size):
+    return -size % 8
+
+
+def write_index(path, documents, generation, deleted=()):
+    """
+    Atomically write a segment for documents, a {post_id: Counter(term: tf)} dict.
+    """
+    post_ids = sorted(documents)
+    inverted = {}
+    for doc, post_id in enumerate(post_ids):
+        for term, tf in documents[post_id].items():
+            inverted.setdefault(term.encode(), []).append((doc, tf))
+
+    doc_ids = array('q', post_ids)
+    doc_lens = array('I', (sum(documents[post_id].values()) for post_id in post_ids))
+    term_offsets = array('I', [0])
+    post_offsets = array('I', [0])
+    post_docs = array('I')
+    post_tfs = array('I')
+    terms = bytearray()
+    for term in sorted(inverted):
+        terms += term
+        term_offsets.append(len(terms))
+        for doc, tf in inverted[term]:
+            post_docs.append(doc)
+            post_tfs.append(tf)
+        post_offsets.append(len(post_docs))
+
+    avgdl = sum(doc_lens) / len(doc_lens) if doc_lens else 0.0
+    deleted = array('q', sorted(deleted))
+    header = HEADER.pack(
+        MAGIC, VERSION, len(doc_ids), len(inverted), len(post_docs), avgdl, generation, len(deleted),
+    )
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name, delete=False) as f:
+        for section in (header, doc_ids, doc_lens, term_offsets, post_offsets, post_docs, post_tfs, deleted, terms):
+            data = bytes(section)
+            f.write(data)
+            f.write(b'\0' * _padding(len(data)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+
+
+class MappedIndex:
+    """
+    Read-only view over a segment file mapped into memory.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.stamp = (stat.st_ino, stat.st_mtime_ns)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (
+            magic, version, self.n_docs, self.n_terms, n_postings, self.avgdl, self.generation, n_deleted,
+        ) = HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} blog search index')
+
+        view = memoryview(self._mm)
+        offset = HEADER.size + _padding(HEADER.size)
+
+        def section(count, typecode):
+            nonlocal offset
+            size = count * array(typecode).itemsize
+            values = view[offset:offset + size].cast(typecode)
+            offset += size + _padding(size)
+            return values
+
+        self.doc_ids = section(self.n_docs, 'q')
+        self.doc_lens = section(self.n_docs, 'I')
+        self.term_offsets = section(self.n_terms + 1, 'I')
+        self.post_offsets = section(self.n_terms + 1, 'I')
+        self.post_docs = section(n_postings, 'I')
+        self.post_tfs = section(n_postings, 'I')
+        self.deleted = section(n_deleted, 'q')
+        self._terms_start = offset
+
+    def term(self, i):
+        start = self._terms_start
+        return self._mm[start + self.term_offsets[i]:start + self.term_offsets[i + 1]]
+
+    def find(self, term):
+        # binary search over the sorted term table, straight from the mapping
+        term = term.encode()
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_terms and self.term(lo) == term:
+            return lo
+        return None
+
+    def postings(self, term):
+        i = self.find(term)
+        if i is None:
+            return 0, range(0)
+        start, end = self.post_offsets[i], self.post_offsets[i + 1]
+        return end - start, range(start, end)
+
+    def __contains__(self, post_id):
+        i = bisect_left(self.doc_ids, post_id)
+        return i < self.n_docs and self.doc_ids[i] == post_id
+
+    def documents(self):
+        """
+        Rebuild the forward {post_id: Counter(term: tf)} mapping from the postings.
+        """
+        documents = {post_id: Counter() for post_id in self.doc_ids}
+        for i in range(self.n_terms):
+            term = self.term(i).decode()
+            for p in range(self.post_offsets[i], self.post_offsets[i + 1]):
+                documents[self.doc_ids[self.post_docs[p]]][term] = self.post_tfs[p]
+        return documents
+
+
+def score(segments, deleted, terms, limit):
+    """
+    Return up to limit (post_id, score) pairs for terms over segments (main first),
+    best first, leaving out the main segment's documents of the post ids in deleted.
+    """
+    # collection statistics over both segments; like other segmented indexes, the
+    # document frequencies still count tombstoned documents until the next merge
+    n_docs = sum(segment.n_docs for segment in segments)
+    if not n_docs:
+        return []
+    avgdl = sum(segment.avgdl * segment.n_docs for segment in segments) / n_docs
+    scores = {}
+    for term in set(terms):
+        found = [(segment, *segment.postings(term)) for segment in segments]
+        df = sum(count for segment, count, postings in found)
+        if not df:
+            continue
+        idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        for n, (segment, count, postings) in enumerate(found):
+            for p in postings:
+                doc = segment.post_docs[p]
+                post_id = segment.doc_ids[doc]
+                if n == 0 and post_id in deleted:
+                    continue
+                tf = segment.post_tfs[p]
+                norm = K1 * (1 - B + B * segment.doc_lens[doc] / avgdl)
+                scores[post_id] = scores.get(post_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+    return nlargest(limit, scores.items(), key=itemgetter(1))
+
+
+class BM25SearchBackend(BaseSearchBackend):
+    """
+    Database independent search over an mmap-shared BM25 index of Post.published.
+
+    Build the index with ``python manage.py rebuild_search_index``; after that,
+    blog.signals keeps it current as posts are saved and deleted.
+    """
+    def __init__(self, path=None):
+        self.path = Path(path or getattr(settings, 'SEARCH_INDEX_PATH', settings.BASE_DIR / 'search_index.bin'))
+        self.delta_path = self.path.with_name(self.path.name + '.delta')
+        self._main = None
+        self._delta = None
+        # the ranked list is cut to this many posts, like the postgres backend's candidates
+        self.limit = getattr(settings, 'SEARCH_MAX_CANDIDATES', 500)
+        self.merge_docs = getattr(settings, 'SEARCH_INDEX_MERGE_DOCS', 1000)
+
+    def _mapped(self, path, current):
+        # one stat() per search tells us whether another process swapped the file
+        try:
+            stat = os.stat(path)
+            if current is None or current.stamp != (stat.st_ino, stat.st_mtime_ns):
+                return MappedIndex(path)
+        except FileNotFoundError:
+            return None
+        return current
+
+    def segments(self):
+        """
+        Return the (main, delta) segments to search; delta may be None, and both
+        are None before rebuild_search_index has run.
+        """
+        self._main = self._mapped(self.path, self._main)
+        if self._main is None:
+            return None, None
+        self._delta = self._mapped(self.delta_path, self._delta)
+        if self._delta is None or self._delta.generation != self._main.generation:
+            return self._main, None
+        return self._main, self._delta
+
+    # BM25 has one ranking of its own
+    modes = ('bm25',)
+
+    def _hits(self, query):
+        main, delta = self.segments()
+        if main is None:
+            return []
+        if delta is None:
+            return score([main], (), tokenize(query), self.limit)
+        return score([main, delta], set(delta.deleted), tokenize(query), self.limit)
+
+    def search_ids(self, query, mode=None):
+        return [post_id for post_id, score in self._hits(query)]
+
+    def search(self, query, mode=None):
+        hits = self._hits(query)
+        posts = Post.published.without_bodies().in_bulk([post_id for post_id, score in hits])
+        results = []
+        for post_id, score in hits:
+            # the index may briefly lag behind an unpublish
+            if post_id in posts:
+                post = posts[post_id]
+                post.rank = score
+                results.append(post)
+        return results
+
+    @contextmanager
+    def _write_lock(self):
+        # serializes writers across processes; readers never take it
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(self.path.name + '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_main(self, documents):
+        # a new generation: the old delta no longer applies, even before it is removed
+        write_index(self.path, documents, time.time_ns())
+        self.delta_path.unlink(missing_ok=True)
+
+    def rebuild(self):
+        documents = {
+            post_id: document_terms(title, body)
+            for post_id, title, body in Post.published.values_list('id', 'title', 'body').iterator()
+        }
+        with self._write_lock():
+            self._write_main(documents)
+        return len(documents)
+
+    def _update(self, post_ids, documents):
+        # replace whatever the index holds for post_ids with documents, the
+        # {post_id: terms} of those of them that are published
+        with self._write_lock():
+            if not self.path.exists():
+                # nothing to update until rebuild_search_index has been run
+                return
+            main = MappedIndex(self.path)
+            delta_documents, deleted = {}, set()
+            if self.delta_path.exists():
+                delta = MappedIndex(self.delta_path)
+                if delta.generation == main.generation:
+                    delta_documents, deleted = delta.documents(), set(delta.deleted)
+            changed = bool(documents)
+            for post_id in post_ids:
+                if delta_documents.pop(post_id, None) is not None:
+                    changed = True
+                if post_id in main and post_id not in deleted:
+                    deleted.add(post_id)
+                    changed = True
+            if not changed:
+                return
+            delta_documents.update(documents)
+
+            if len(delta_documents) + len(deleted) < self.merge_docs:
+                # the usual case: only the small delta file is rewritten
+                write_index(self.delta_path, delta_documents, main.generation, deleted)
+                return
+            merged = main.documents()
+            for post_id in deleted:
+                del merged[post_id]
+            merged.update(delta_documents)
+            self._write_main(merged)
+
+    def index_post(self, post):
+        if post.status != Post.Status.PUBLISHED:
+            self.remove_post(post.pk)
+            return
+        # only the changed post is tokenized
+        self._update([post.pk], {post.pk: document_terms(post.title, post.body)})
+
+    def index_posts(self, post_ids):
+        published = Post.published.filter(id__in=post_ids).values_list('id', 'title', 'body')
+        # one rewrite of the delta for the whole batch
+        self._update(post_ids, {
+            post_id: document_terms(title, body) for post_id, title, body in published.iterator()
+        })
+
+    def remove_post(self, post_id):
+        self._update([post_id], {})
@@ -0,0 +1,105 @@
+"""
+Per-process cache of search results.
+
+Popular searches repeat constantly, so post_search asks cached_search_ids() instead of
+the backend. A result is stored as the ranked tuple of post ids only, keyed on the
+normalized query (case-folded, whitespace collapsed) together with the backend and
+its text search configuration (e.g. 'spanish'), so 'Django  ORM' and 'django orm'
+share one entry. The view then loads only the posts of the page it shows, with a
+single id__in query.
+
+Entries live in a bounded LRU (SEARCH_CACHE_SIZE entries per process). Results go
+stale when a post is published, edited, unpublished or deleted: blog.signals then
+calls bump_search_generation(), which stores a new generation number in the shared
+cache. Every process compares it on each search and drops its entries when it changed.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from ..routers import primary
+from . import get_search_backend
+
+
+GENERATION_KEY = 'blog:search:generation'
+
+
+def normalize_query(query):
+    return ' '.join(query.casefold().split())
+
+
+def bump_search_generation():
+    cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+class SearchResultCache:
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.generation = None
+        self.lock = threading.Lock()
+
+    def get(self, key, generation):
+        with self.lock:
+            if generation != self.generation:
+                self.entries.clear()
+                self.generation = generation
+                return None
+            ids = self.entries.get(key)
+            if ids is not None:
+                self.entries.move_to_end(key)
+            return ids
+
+    def set(self, key, generation, ids):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = ids
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                # least recently used first
+                self.entries.popitem(last=False)
+
+
+_results = None
+
+
+def _result_cache():
+    global _results
+    if _results is None:
+        _results = SearchResultCache(getattr(settings, 'SEARCH_CACHE_SIZE', 1000))
+    return _results
+
+
+@receiver(setting_changed)
+def reset_result_cache(setting, **kwargs):
+    # lets override_settings(SEARCH_CACHE_SIZE=...) resize it, e.g. to 0 while
+    # blog.queryplans checks the search queries
+    global _results
+    if setting == 'SEARCH_CACHE_SIZE':
+        _results = None
+
+
+def cached_search_ids(query, mode=None):
+    """
+    Return the ids of the published posts matching query, best match first by mode
+    (one of the backend's modes, its default if mode is not one of them).
+    """
+    backend = get_search_backend()
+    if mode not in backend.modes:
+        mode = backend.modes[0]
+    key = (type(backend).__name__, getattr(backend, 'config', ''), mode, normalize_query(query))
+    generation = cache.get(GENERATION_KEY)
+    results = _result_cache()
+
+    ids = results.get(key, generation)
+    if ids is None:
+        with primary():
+            ids = tuple(backend.search_ids(query, mode))
+        results.set(key, generation, ids)
+    return ids
@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, Q, Value
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from ..models import Post
+from .base import BaseSearchBackend
+
+
+# ts_headline marks the matched words with these; they cannot occur in a post body
+# typed by a person, so the rest of the snippet can be HTML-escaped safely before
+# they are turned into <mark> tags
+START_SEL = '\x02'
+STOP_SEL = '\x03'
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Full-text + trigram search running inside PostgreSQL.
+    """
+    config = 'spanish'
+    modes = ('blend', 'rank', 'trigram')
+
+    def search(self, query, mode='blend'):
+        query_terms = query.strip().split()  # Handles spaces and splitting
+        if not query_terms:
+            return Post.published.none()
+
+        # The first term initializes the query
+        # config="spanish" >> executes stemming and removes stop words in Spanish
+        search_query = SearchQuery(query_terms[0], config=self.config)
+        # The loop iterates over the remaining terms (terms[1:]), adding each one
+        # to the search_query with the AND operator (&), OR operator(|)
+        for term in query_terms[1:]:
+            search_query &= SearchQuery(term, config=self.config)
+
+        # Both predicates below only touch indexed columns: the stored, trigger-maintained
+        # search_vector (GIN) and the pg_trgm GIN index on title. Nothing is computed
+        # over the post bodies at request time any more (the old per-request
+        # SearchVector('title', 'body', config='spanish') scanned every published body).
+        #
+        # Scoring is capped: at most SEARCH_MAX_CANDIDATES matches are ever given to
+        # ts_rank / similarity(). The candidates are the newest matches, picked by a
+        # LIMITed subquery that only reads the GIN bitmap and publish (a top-n sort, no
+        # tsvector is detoasted), and only they are ranked. A very common term therefore
+        # costs the same as a rare one; the price is that a strong but old match beyond
+        # the newest SEARCH_MAX_CANDIDATES is not ranked at all.
+        candidates = Post.published.filter(
+            # @@ uses blog_post_search_vector_gin, % uses blog_post_title_trgm_gin
+            Q(search_vector=search_query) | Q(title__trigram_similar=query)
+        ).order_by('-publish').values('id')[:getattr(settings, 'SEARCH_MAX_CANDIDATES', 500)]
+        results = Post.published.without_bodies().filter(id__in=candidates).annotate(
+            # title 'A' / body 'B' weights are baked into the stored vector
+            rank=SearchRank(F('search_vector'), search_query),
+            similarity=TrigramSimilarity('title', query),
+        )
+        # the ranking the user picked: full-text rank, title similarity, or both
+        if mode == 'rank':
+            results = results.order_by('-rank', '-similarity', '-publish')
+        elif mode == 'trigram':
+            results = results.order_by('-similarity', '-rank', '-publish')
+        else:
+            weight = getattr(settings, 'SEARCH_BLEND_RANK_WEIGHT', 0.7)
+            results = results.annotate(
+                score=F('rank') * Value(weight) + F('similarity') * Value(1 - weight)
+            ).order_by('-score', '-publish')
+        return results
+
+    def search_ids(self, query, mode='blend'):
+        return list(self.search(query, mode).values_list('id', flat=True))
+
+    def snippets(self, post_ids, query):
+        # ts_headline re-parses the whole body of every row it is given: only ever
+        # for the posts of one page
+        headline = SearchHeadline(
+            'body',
+            SearchQuery(query, config=self.config),
+            config=self.config,
+            start_sel=START_SEL,
+            stop_sel=STOP_SEL,
+            min_words=15,
+            max_words=35,
+            max_fragments=2,
+        )
+        posts = Post.published.without_bodies().annotate(headline=headline).in_bulk(post_ids)
+        results = [posts[post_id] for post_id in post_ids if post_id in posts]
+        for post in results:
+            post.snippet = mark_safe(
+                escape(post.headline).replace(START_SEL, '<mark>').replace(STOP_SEL, '</mark>')
+            )
+        return results
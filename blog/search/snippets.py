@@ -0,0 +1,49 @@
+from bisect import bisect_left
+
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .text import TOKEN_RE, fold, tokenize
+
+
+# Plain-text result snippets, the default of BaseSearchBackend.snippets(): the window of
+# SNIPPET_WORDS words of the body holding the most words of the query, with those in
+# <mark>. It needs nothing but the body, so it works with every backend; the postgres
+# backend has ts_headline make its snippets instead (stemmed, like its matching).
+
+SNIPPET_WORDS = 35
+# words of context kept in front of the first match of the window
+LEAD_WORDS = 5
+
+
+def text_snippet(body, query):
+    """
+    Return the HTML snippet of body for query.
+    """
+    terms = set(tokenize(query))
+    words = list(TOKEN_RE.finditer(body))
+    if not words:
+        return ''
+    hits = [i for i, word in enumerate(words) if fold(word.group()) in terms]
+    start = 0
+    if hits:
+        # the window starting LEAD_WORDS before hit h holds the hits up to the one
+        # SNIPPET_WORDS later: take the window with the most of them
+        best = max(
+            range(len(hits)),
+            key=lambda h: bisect_left(hits, hits[h] - LEAD_WORDS + SNIPPET_WORDS) - h,
+        )
+        start = max(0, min(hits[best] - LEAD_WORDS, len(words) - SNIPPET_WORDS))
+    end = min(start + SNIPPET_WORDS, len(words))
+
+    parts = ['… '] if start else []
+    position = words[start].start()
+    for i in hits:
+        if start <= i < end:
+            word = words[i]
+            parts += [escape(body[position:word.start()]), '<mark>', escape(word.group()), '</mark>']
+            position = word.end()
+    parts.append(escape(body[position:words[end - 1].end()]))
+    if end < len(words):
+        parts.append(' …')
+    return mark_safe(''.join(parts))
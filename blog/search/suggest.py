@@ -0,0 +1,285 @@
+"""
+In-memory prefix index behind the search/suggest/ autocomplete endpoint.
+
+Every process keeps a compact index of the published posts' titles and of the tags:
+
+    words       sorted list of the distinct title words (the vocabulary)
+    postings    word -> array('q') of post keys, ascending
+    tags        sorted list of (folded name, name, slug, published post count)
+
+A post key packs the publish date and the id into one int64 so that ascending key
+order is newest first; merging the postings of every word that starts with the typed
+prefix (a bisect into the vocabulary) therefore yields the matching posts best first,
+and a lookup stops after `limit` of them.
+
+Changes are shared through a log in the cache. The process that publishes, edits or
+unpublishes a post records the changed post ids under the next number of a version
+counter (refresh_posts() from blog.signals) and updates its own index in place. Any
+other process sees the counter move on its next lookup and re-reads just the posts
+logged since its own version; only when that part of the log is gone (expired, or
+more than MAX_LOGGED_CHANGES behind) or marked by invalidate_suggestions() does it
+rebuild its index from the database. Every indexed post remembers its tags, so
+re-reading a post moves the tag counts both ways, and a tag whose count drops to zero
+leaves the index.
+
+Updates change the structures in place, so lookups read them under the same lock.
+"""
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from heapq import merge
+
+from django.core.cache import cache
+
+from ..models import Post
+from ..routers import primary
+from .text import TOKEN_RE, fold, tokenize
+
+
+VERSION_KEY = 'blog:suggest:version'
+# the post ids changed by version n (or REBUILD_ALL)
+CHANGE_KEY = 'blog:suggest:change:{}'
+CHANGE_LOG_TIMEOUT = 60 * 60
+REBUILD_ALL = 'all'
+# a process further behind than this rebuilds instead of reading the log
+MAX_LOGGED_CHANGES = 100
+# ids and publish timestamps (seconds) both have to fit in 31 bits
+ID_BITS = 31
+MAX_TIMESTAMP = 2 ** 32
+# bound the work of very short prefixes ('a' may start thousands of words)
+MAX_PREFIX_WORDS = 1000
+
+
+def post_key(post_id, publish):
+    return (MAX_TIMESTAMP - int(publish.timestamp())) << ID_BITS | post_id
+
+
+def key_post_id(key):
+    return key & (2 ** ID_BITS - 1)
+
+
+def _prefix_range(keys, prefix, wrap=lambda key: key):
+    # keys[start:end] are the sorted keys that start with prefix
+    start = bisect_left(keys, wrap(prefix))
+    return start, bisect_left(keys, wrap(prefix + '\U0010ffff'), start)
+
+
+class SuggestionIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.loaded = False
+        self.words = []
+        self.postings = {}
+        # post id -> (title, slug, publish, key, words, tags), tags as (name, slug) pairs
+        self.posts = {}
+        self.tags = []
+
+    # building and updating
+
+    def _add_post(self, post_id, title, slug, publish, tags):
+        key = post_key(post_id, publish)
+        words = frozenset(tokenize(title))
+        self.posts[post_id] = (title, slug, publish, key, words, tags)
+        for name, tag_slug in tags:
+            self._count_tag(name, tag_slug, 1)
+        for word in words:
+            postings = self.postings.get(word)
+            if postings is None:
+                self.postings[word] = array('q', [key])
+                insort(self.words, word)
+            else:
+                insort(postings, key)
+
+    def _remove_post(self, post_id):
+        entry = self.posts.pop(post_id, None)
+        if entry is None:
+            return
+        key, words, tags = entry[3:]
+        for name, tag_slug in tags:
+            self._count_tag(name, tag_slug, -1)
+        for word in words:
+            postings = self.postings[word]
+            del postings[bisect_left(postings, key)]
+            if not postings:
+                del self.postings[word]
+                del self.words[bisect_left(self.words, word)]
+
+    def _count_tag(self, name, slug, change):
+        # add change to the tag's post count; a tag without posts is dropped
+        tag = (fold(name), name, slug)
+        position = bisect_left(self.tags, tag)
+        if position < len(self.tags) and self.tags[position][:3] == tag:
+            count = self.tags[position][3] + change
+            if count > 0:
+                self.tags[position] = (*tag, count)
+            else:
+                del self.tags[position]
+        elif change > 0:
+            self.tags.insert(position, (*tag, change))
+
+    def rebuild(self):
+        with self.lock:
+            self._rebuild(cache.get(VERSION_KEY))
+
+    def _rebuild(self, version):
+        with primary():
+            post_tags = {}
+            tagged = Post.published.exclude(tags=None).values_list('id', 'tags__name', 'tags__slug')
+            for post_id, name, slug in tagged.iterator():
+                post_tags.setdefault(post_id, []).append((name, slug))
+            postings, posts, tag_counts = {}, {}, Counter()
+            for post_id, title, slug, publish in Post.published.values_list('id', 'title', 'slug', 'publish').iterator():
+                key = post_key(post_id, publish)
+                words = frozenset(tokenize(title))
+                tags = frozenset(post_tags.get(post_id, ()))
+                posts[post_id] = (title, slug, publish, key, words, tags)
+                tag_counts.update(tags)
+                for word in words:
+                    postings.setdefault(word, []).append(key)
+        self.posts = posts
+        self.postings = {word: array('q', sorted(keys)) for word, keys in postings.items()}
+        self.words = sorted(self.postings)
+        self.tags = sorted((fold(name), name, slug, count) for (name, slug), count in tag_counts.items())
+        self.version = version
+        self.loaded = True
+
+    def _apply(self, post_ids):
+        # re-read post_ids; the caller holds self.lock
+        rows = (
+            Post.published.filter(id__in=post_ids)
+            .values_list('id', 'title', 'slug', 'publish', 'tags__name', 'tags__slug')
+        )
+        with primary():
+            rows = list(rows)
+        posts = {}
+        for post_id, title, slug, publish, tag_name, tag_slug in rows:
+            tags = posts.setdefault(post_id, (title, slug, publish, set()))[3]
+            if tag_name is not None:
+                tags.add((tag_name, tag_slug))
+        for post_id in post_ids:
+            self._remove_post(post_id)
+        for post_id, (title, slug, publish, tags) in posts.items():
+            self._add_post(post_id, title, slug, publish, frozenset(tags))
+
+    def refresh_posts(self, post_ids):
+        """
+        Re-read post_ids from the database after they were saved, (un)published,
+        retagged or deleted, here and (through the change log) in every other process.
+        """
+        post_ids = list(post_ids)
+        # logged even when this process has no index yet: the others may have one
+        version = _log_change(post_ids)
+        if not self.loaded:
+            # nothing to update, the first lookup builds the index
+            return
+        with self.lock:
+            caught_up = (self.version or 0) == version - 1
+            self._apply(post_ids)
+            if caught_up:
+                # otherwise the next lookup also reads the changes logged by others
+                self.version = version
+
+    # lookups
+
+    def _logged_changes(self, version):
+        # the post ids changed after self.version up to version, or None when the
+        # log cannot tell
+        # (no version in the cache yet is version 0, the first change is logged as 1)
+        current = self.version or 0
+        if not isinstance(version, int) or not 0 < version - current <= MAX_LOGGED_CHANGES:
+            return None
+        keys = [CHANGE_KEY.format(n) for n in range(current + 1, version + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys) or REBUILD_ALL in changes.values():
+            return None
+        return {post_id for post_ids in changes.values() for post_id in post_ids}
+
+    def ensure_current(self):
+        if self.loaded and cache.get(VERSION_KEY) == self.version:
+            return
+        with self.lock:
+            # another thread may have caught up while this one waited for the lock
+            version = cache.get(VERSION_KEY)
+            if self.loaded and version == self.version:
+                return
+            post_ids = self._logged_changes(version) if self.loaded else None
+            if post_ids is None:
+                self._rebuild(version)
+            else:
+                self._apply(post_ids)
+                self.version = version
+
+    def suggest(self, query, limit=8):
+        """
+        Return ([(title, slug, publish), ...], [(name, slug), ...]) for query: the newest
+        posts whose title has every word of query, the last one as a prefix, and the tags
+        starting with query, most used first.
+        """
+        self.ensure_current()
+        folded = fold(query).strip()
+        tokens = TOKEN_RE.findall(folded)
+        if not tokens:
+            return [], []
+        with self.lock:
+            return self._lookup(folded, tokens, limit)
+
+    def _lookup(self, folded, tokens, limit):
+        # the caller holds self.lock, so no update runs halfway through
+        *complete, prefix = tokens
+        # titles are indexed without one letter words
+        complete = [token for token in complete if len(token) > 1]
+
+        posts = []
+        start, end = _prefix_range(self.words, prefix)
+        candidates = [self.postings[word] for word in self.words[start:min(end, start + MAX_PREFIX_WORDS)]]
+        seen = set()
+        for key in merge(*candidates):
+            post_id = key_post_id(key)
+            if post_id in seen:
+                continue
+            seen.add(post_id)
+            entry = self.posts.get(post_id)
+            if entry is None or not entry[4].issuperset(complete):
+                continue
+            posts.append(entry[:3])
+            if len(posts) >= limit:
+                break
+
+        start, end = _prefix_range(self.tags, folded, wrap=lambda key: (key,))
+        matches = sorted(self.tags[start:end], key=lambda tag: -tag[3])[:limit]
+        return posts, [(name, slug) for folded_name, name, slug, count in matches]
+
+
+def _log_change(change):
+    # the next version, for the post ids in change (or REBUILD_ALL)
+    cache.add(VERSION_KEY, 0, None)
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        # evicted right after add(): whoever reads this version rebuilds
+        version = 1
+        cache.set(VERSION_KEY, version, None)
+        change = REBUILD_ALL
+    cache.set(CHANGE_KEY.format(version), change, CHANGE_LOG_TIMEOUT)
+    return version
+
+
+def invalidate_suggestions():
+    # after changes that sent no signals (imports, generated data): every process
+    # rebuilds its index on its next lookup
+    _log_change(REBUILD_ALL)
+
+
+_index = None
+
+
+def get_suggestion_index():
+    """
+    Return the (per process) autocomplete index.
+    """
+    global _index
+    if _index is None:
+        _index = SuggestionIndex()
+    return _index
@@ -0,0 +1,18 @@
+import re
+import unicodedata
+
+
+# Word splitting shared by the BM25 index, the autocomplete index and the plain-text
+# result snippets, so all of them agree on what a term is.
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def fold(text):
+    # case-fold and strip accents so 'Canción' and 'cancion' are the same term
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(fold(text)) if len(token) > 1]
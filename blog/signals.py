@@ -0,0 +1,334 @@
+from django.db import transaction
+from django.utils import timezone
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from taggit.models import Tag
+
+from .changelist import invalidate_admin_facets
+from .freshness import record_content_change
+from .models import Post, Comment, SimilarPost, TaggedPost
+from .pagecache import post_key, purge, purge_posts, tag_key
+from .routers import record_write
+from .search import get_search_backend
+from .search.cache import bump_search_generation
+from .search.suggest import get_suggestion_index
+from .similarity import recompute_similar_posts, refresh_similar_posts
+from .tagstats import refresh_tag_stats, refresh_tag_stats_for_posts
+from .templatetags.blog_tags import invalidate_sidebar
+
+
+# QuerySet.update() sends no post_save, so code that changes rows in bulk (the admin
+# actions) sends one of these afterwards, with the ids of the affected posts, and the
+# receivers below do their work once for the whole batch.
+posts_bulk_updated = Signal()
+comments_bulk_updated = Signal()
+# only the stored HTML of the posts changed (rerender_posts): nothing derived from
+# their title, tags or status needs refreshing
+posts_rerendered = Signal()
+
+
+# Keep the search backend in step with the posts table. The work is deferred with
+# on_commit so the index never contains a post whose transaction rolled back.
+# raw saves (loaddata) are skipped; run rebuild_search_index after loading fixtures.
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    transaction.on_commit(lambda: get_search_backend().index_post(instance))
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    post_id = instance.pk
+    transaction.on_commit(lambda: get_search_backend().remove_post(post_id))
+
+
+# Cached search results (blog/search/cache.py) are dropped when a post that is or
+# was published changes: published, edited, unpublished or deleted.
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_search_results(sender, instance, raw=False, **kwargs):
+    if instance.status == Post.Status.PUBLISHED or instance.was_published:
+        transaction.on_commit(bump_search_generation)
+
+
+# The autocomplete index holds published titles and tags; update it in place when a
+# post that is or was published changes (see blog/search/suggest.py).
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def refresh_suggestions_for_post(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if instance.status == Post.Status.PUBLISHED or instance.was_published:
+        post_id = instance.pk
+        transaction.on_commit(lambda: get_suggestion_index().refresh_posts([post_id]))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def refresh_suggestions_for_tags(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Post):
+        post_id = instance.pk
+        transaction.on_commit(lambda: get_suggestion_index().refresh_posts([post_id]))
+
+
+# The cached sidebar (post count, latest posts, most commented posts) only shows
+# published posts, so drafts that stay drafts never invalidate it.
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_sidebar_for_post(sender, instance, **kwargs):
+    if instance.status == Post.Status.PUBLISHED or instance.was_published:
+        transaction.on_commit(invalidate_sidebar)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_sidebar_for_comment(sender, instance, **kwargs):
+    # only look at the post when it is already loaded (post_comment sets it), so a
+    # cascade of comment deletions does not cost one query per comment
+    if Comment.post.is_cached(instance) and instance.post.status != Post.Status.PUBLISHED:
+        return
+    transaction.on_commit(invalidate_sidebar)
+
+
+# Precomputed similar posts: recompute only the posts affected by a tag change, a
+# publish/unpublish or a deletion (see blog/similarity.py).
+@receiver(m2m_changed, sender=Post.tags.through)
+def refresh_similar_posts_for_tags(sender, instance, action, **kwargs):
+    # instance is the post only for changes made through post.tags
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Post):
+        post_id = instance.pk
+        transaction.on_commit(lambda: refresh_similar_posts([post_id]))
+
+
+@receiver(post_save, sender=Post)
+def refresh_similar_posts_for_status(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if (instance.status == Post.Status.PUBLISHED) != instance.was_published:
+        post_id = instance.pk
+        transaction.on_commit(lambda: refresh_similar_posts([post_id]))
+
+
+@receiver(pre_delete, sender=Post)
+def remember_posts_listing_deleted_post(sender, instance, **kwargs):
+    # the SimilarPost rows pointing at the post are about to be deleted by the cascade
+    instance._listed_by = list(SimilarPost.objects.filter(similar=instance).values_list('post_id', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def refresh_similar_posts_for_deleted_post(sender, instance, **kwargs):
+    listed_by = getattr(instance, '_listed_by', [])
+    if listed_by:
+        # their rows lost a neighbour to the cascade: refill them
+        transaction.on_commit(lambda: recompute_similar_posts(listed_by))
+
+
+# Tag statistics (blog/tagstats.py): recompute the tags of a post that is or was
+# published whenever it changes (its updated_on is their pages' lastmod), plus the
+# tags removed from it. The sidebar shows the tag cloud, so it is invalidated when
+# a count changed.
+def _refresh_tag_stats(refresh):
+    def run():
+        if refresh():
+            invalidate_sidebar()
+    transaction.on_commit(run)
+
+
+@receiver(post_save, sender=Post)
+def refresh_tag_stats_for_post(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if instance.status == Post.Status.PUBLISHED or instance.was_published:
+        post_id = instance.pk
+        _refresh_tag_stats(lambda: refresh_tag_stats_for_posts([post_id]))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def remember_cleared_tags(sender, instance, action, **kwargs):
+    # after a clear the rows saying which tags the post had are gone
+    if action == 'pre_clear' and isinstance(instance, Post):
+        instance._cleared_tags = list(instance.tags.values_list('id', flat=True))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def refresh_tag_stats_for_tags(sender, instance, action, pk_set=None, **kwargs):
+    if not isinstance(instance, Post) or instance.status != Post.Status.PUBLISHED:
+        return
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        post_id = instance.pk
+        changed = set(pk_set or ()) | set(getattr(instance, '_cleared_tags', ()))
+        _refresh_tag_stats(lambda: refresh_tag_stats_for_posts([post_id], changed))
+
+
+@receiver(pre_delete, sender=Post)
+def remember_tags_of_deleted_post(sender, instance, **kwargs):
+    # the post's TaggedPost rows are about to be deleted by the cascade
+    if instance.status == Post.Status.PUBLISHED:
+        instance._deleted_tags = list(instance.tags.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def refresh_tag_stats_for_deleted_post(sender, instance, **kwargs):
+    deleted_tags = getattr(instance, '_deleted_tags', [])
+    if deleted_tags:
+        _refresh_tag_stats(lambda: refresh_tag_stats(deleted_tags))
+
+
+# Full-page cache (blog/pagecache.py): purge exactly the surrogate keys of the pages a
+# change shows up on, locally and upstream.
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def purge_pages_for_post(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if instance.status == Post.Status.PUBLISHED or instance.was_published:
+        post_id = instance.pk
+        # a deleted post no longer has its tags (remember_tags_of_deleted_post)
+        deleted_tags = getattr(instance, '_deleted_tags', [])
+        transaction.on_commit(lambda: purge_posts([post_id], deleted_tags))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def purge_pages_for_tags(sender, instance, action, pk_set=None, **kwargs):
+    if not isinstance(instance, Post) or instance.status != Post.Status.PUBLISHED:
+        return
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        post_id = instance.pk
+        changed = set(pk_set or ()) | set(getattr(instance, '_cleared_tags', ()))
+        transaction.on_commit(lambda: purge_posts([post_id], changed))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def purge_pages_for_comment(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # the post's page shows its comments, the sidebar the most commented posts
+    keys = [post_key(instance.post_id), 'sidebar']
+    transaction.on_commit(lambda: purge(keys))
+
+
+# A renamed or deleted tag changes its own page (under the old and the new slug), the
+# pages of the posts carrying it (their tag links) and the sidebar's tag cloud.
+@receiver(pre_save, sender=Tag)
+def remember_old_tag_slug(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    instance._old_slug = Tag.objects.filter(pk=instance.pk).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Tag)
+def purge_pages_for_renamed_tag(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    tag_id = instance.pk
+    slugs = {instance.slug, getattr(instance, '_old_slug', None) or instance.slug}
+
+    def run():
+        invalidate_sidebar()
+        post_ids = list(TaggedPost.objects.filter(tag_id=tag_id).values_list('content_object_id', flat=True))
+        if post_ids:
+            purge_posts(post_ids)
+        purge(['sidebar', *map(tag_key, slugs)])
+    transaction.on_commit(run)
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_posts_of_deleted_tag(sender, instance, **kwargs):
+    # the tag's TaggedPost rows are about to be deleted by the cascade
+    instance._tagged_posts = list(
+        TaggedPost.objects.filter(tag=instance).values_list('content_object_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+def purge_pages_for_deleted_tag(sender, instance, **kwargs):
+    post_ids = getattr(instance, '_tagged_posts', [])
+    slug = instance.slug
+
+    def run():
+        invalidate_sidebar()
+        if post_ids:
+            purge_posts(post_ids)
+        purge(['sidebar', tag_key(slug)])
+    transaction.on_commit(run)
+
+
+# Tags are not columns of Post, so changing them would not touch updated_on. Do it
+# here so the ETag / Last-Modified validators (blog/freshness.py) and the sitemap's
+# lastmod see the change. update() leaves the other Post signals alone.
+@receiver(m2m_changed, sender=Post.tags.through)
+def touch_post_on_tag_change(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Post):
+        Post.objects.filter(pk=instance.pk).update(updated_on=timezone.now())
+
+
+# Likewise a deleted comment leaves no updated_on behind to compare against.
+@receiver(post_delete, sender=Comment)
+def touch_post_on_comment_delete(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id).update(updated_on=timezone.now())
+
+
+# A deleted post leaves no row at all: record when it went (blog/freshness.py).
+@receiver(post_delete, sender=Post)
+def record_post_deletion(sender, instance, **kwargs):
+    if instance.status == Post.Status.PUBLISHED or instance.was_published:
+        transaction.on_commit(record_content_change)
+
+
+# Bulk changes: everything the per-row receivers above would have done, once.
+@receiver(posts_bulk_updated)
+def refresh_after_bulk_post_update(sender, post_ids, **kwargs):
+    post_ids = list(post_ids)
+
+    def refresh():
+        get_search_backend().index_posts(post_ids)
+        get_suggestion_index().refresh_posts(post_ids)
+        bump_search_generation()
+        refresh_similar_posts(post_ids)
+        refresh_tag_stats_for_posts(post_ids)
+        invalidate_sidebar()
+        invalidate_admin_facets(Post)
+        purge_posts(post_ids)
+    transaction.on_commit(refresh)
+
+
+@receiver(posts_rerendered)
+def purge_pages_after_rerender(sender, post_ids, **kwargs):
+    # rerender_posts touched updated_on, which is what the validators compare
+    post_ids = list(post_ids)
+    transaction.on_commit(lambda: purge_posts(post_ids))
+
+
+@receiver(comments_bulk_updated)
+def refresh_after_bulk_comment_update(sender, post_ids, **kwargs):
+    post_ids = list(post_ids)
+
+    # the comment counts themselves are kept by the database trigger
+    def refresh():
+        invalidate_sidebar()
+        invalidate_admin_facets(Comment)
+        purge(['sidebar', *map(post_key, post_ids)])
+    transaction.on_commit(refresh)
+
+
+# Read replicas (blog/routers.py): a request that saved or deleted anything reads its
+# own writes from the primary for a while. Every model counts, the sessions included.
+@receiver(post_save)
+@receiver(post_delete)
+def pin_writer_to_primary(sender, raw=False, **kwargs):
+    if not raw:
+        record_write()
+
+
+@receiver(m2m_changed)
+def pin_writer_to_primary_for_m2m(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        record_write()
+
+
+@receiver(posts_bulk_updated)
+@receiver(comments_bulk_updated)
+@receiver(posts_rerendered)
+def pin_writer_to_primary_for_bulk_update(sender, **kwargs):
+    record_write()
@@ -0,0 +1,158 @@
+from collections import Counter
+from heapq import nlargest
+
+from django.db import transaction
+
+from .models import Post, SimilarPost, TaggedPost
+
+
+# Similar posts, precomputed.
+#
+# Two published posts are similar when they share tags; the more tags they share the
+# more similar they are, and among equally similar posts the most recent one wins
+# (the order post_detail used to compute with annotate(Count('tags')) on every request).
+#
+# Think of a sparse post x tag matrix M. The shared tag counts of a post p are row p of
+# M * M^T, and that row only touches the posting lists of the tags p has, so every post
+# is scored from its own tags' postings instead of the whole table. The best
+# SIMILAR_POSTS of each post are stored in SimilarPost; when tags change only the
+# rows that can change are rewritten (see _refresh_post()).
+SIMILAR_POSTS = 4
+
+
+def load_postings(queryset):
+    """
+    Return the sparse matrix of the posts in queryset as
+    ({post_id: {tag_id, ...}}, {tag_id: {post_id, ...}}, {post_id: publish}).
+    """
+    post_tags, tag_posts, publish = {}, {}, {}
+    for post_id, published_on, tag_id in queryset.values_list('id', 'publish', 'tags').iterator():
+        publish[post_id] = published_on
+        post_tags.setdefault(post_id, set())
+        if tag_id is not None:
+            post_tags[post_id].add(tag_id)
+            tag_posts.setdefault(tag_id, set()).add(post_id)
+    return post_tags, tag_posts, publish
+
+
+def top_neighbours(post_id, post_tags, tag_posts, publish, count=SIMILAR_POSTS):
+    """
+    Return up to count (similar_post_id, same_tags) pairs for post_id, best first.
+    """
+    same_tags = Counter()
+    for tag_id in post_tags.get(post_id, ()):
+        same_tags.update(tag_posts[tag_id])
+    same_tags.pop(post_id, None)
+    return nlargest(count, same_tags.items(), key=lambda item: (item[1], publish[item[0]]))
+
+
+def _similar_rows(post_ids, post_tags, tag_posts, publish):
+    for post_id in post_ids:
+        neighbours = top_neighbours(post_id, post_tags, tag_posts, publish)
+        for rank, (similar_id, same_tags) in enumerate(neighbours):
+            yield SimilarPost(post_id=post_id, similar_id=similar_id, same_tags=same_tags, rank=rank)
+
+
+def rebuild_similar_posts(batch_size=1000):
+    """
+    Recompute the similar posts of every published post. Returns the number of rows stored.
+    """
+    post_tags, tag_posts, publish = load_postings(Post.published.all())
+    rows = list(_similar_rows(post_tags, post_tags, tag_posts, publish))
+    with transaction.atomic():
+        SimilarPost.objects.all().delete()
+        SimilarPost.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def recompute_similar_posts(post_ids):
+    """
+    Recompute the similar posts of exactly post_ids from the current tags.
+    """
+    post_ids = set(post_ids)
+    published = Post.published.all()
+    # the part of the matrix these rows need: every published post that carries one
+    # of their tags
+    tags = set(Post.objects.filter(id__in=post_ids).values_list('tags', flat=True)) - {None}
+    post_tags, tag_posts, publish = load_postings(published.filter(tags__in=tags))
+    # posts that are not published (any more) simply end up with no rows
+    _store(post_ids, list(_similar_rows(post_ids & post_tags.keys(), post_tags, tag_posts, publish)))
+
+
+def _store(post_ids, rows):
+    with transaction.atomic():
+        SimilarPost.objects.filter(post_id__in=post_ids).delete()
+        SimilarPost.objects.bulk_create(rows)
+
+
+def refresh_similar_posts(post_ids):
+    """
+    Update the similar posts after a change of post_ids' tags or status.
+    """
+    for post_id in set(post_ids):
+        _refresh_post(post_id)
+
+
+def _refresh_post(changed_id):
+    # Only the rows that can change are rewritten. With s(p) the number of tags post p
+    # shares with the changed post c now (0 if c is not published):
+    #   - c's own row is recomputed from its tags' postings;
+    #   - a post that lists c keeps its other neighbours. If s(p) did not drop, c only
+    #     moves within the stored row; if it dropped, another post may take c's place,
+    #     so the row is recomputed;
+    #   - any other post changes only if c now beats its k-th neighbour (or it has
+    #     fewer than k), and then c is merged into its stored row.
+    # The rest keep their rows: a popular tag costs one pass over its posting list and
+    # one query for the k-th neighbours, not a top-k for every post that carries it.
+    published = Post.published.all()
+    publish = published.filter(id=changed_id).values_list('publish', flat=True).first()
+    tags, scores, own_rows = set(), Counter(), []
+    if publish is not None:
+        tags = set(Post.objects.filter(id=changed_id).values_list('tags', flat=True)) - {None}
+        post_tags, tag_posts, publishes = load_postings(published.filter(tags__in=tags))
+        for tag_id in tags:
+            scores.update(tag_posts.get(tag_id, ()))
+        scores.pop(changed_id, None)
+        own_rows = list(_similar_rows([changed_id], post_tags, tag_posts, publishes))
+
+    merge, recompute = set(), set()
+    listed_by = SimilarPost.objects.filter(similar_id=changed_id).values_list('post_id', 'same_tags')
+    for post_id, same_tags in listed_by:
+        (merge if scores[post_id] >= same_tags else recompute).add(post_id)
+    if scores:
+        kth = {
+            post_id: (same_tags, published_on)
+            for post_id, same_tags, published_on in SimilarPost.objects.filter(
+                rank=SIMILAR_POSTS - 1,
+                post_id__in=TaggedPost.objects.filter(tag_id__in=tags).values('content_object_id'),
+            ).values_list('post_id', 'same_tags', 'similar__publish')
+        }
+        for post_id, same_tags in scores.items():
+            if post_id not in merge and post_id not in recompute and (
+                post_id not in kth or (same_tags, publish) > kth[post_id]
+            ):
+                merge.add(post_id)
+
+    rows = own_rows + _merged_rows(merge, changed_id, scores, publish)
+    _store(merge | {changed_id}, rows)
+    if recompute:
+        recompute_similar_posts(recompute)
+
+
+def _merged_rows(post_ids, changed_id, scores, publish):
+    # the stored rows of post_ids with changed_id put in at its new score
+    neighbours = {post_id: {} for post_id in post_ids}
+    stored = SimilarPost.objects.filter(post_id__in=post_ids).exclude(similar_id=changed_id)
+    for post_id, similar_id, same_tags, published_on in stored.values_list(
+        'post_id', 'similar_id', 'same_tags', 'similar__publish',
+    ):
+        neighbours[post_id][similar_id] = (same_tags, published_on)
+    rows = []
+    for post_id, row in neighbours.items():
+        row[changed_id] = (scores[post_id], publish)
+        best = nlargest(SIMILAR_POSTS, row.items(), key=lambda item: item[1])
+        rows += [
+            SimilarPost(post_id=post_id, similar_id=similar_id, same_tags=same_tags, rank=rank)
+            for rank, (similar_id, (same_tags, _)) in enumerate(best)
+        ]
+    return rows
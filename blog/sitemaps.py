@@ -1,39 +1,251 @@
-from django.contrib.sitemaps import Sitemap
-from .models import Post
-from taggit.models import Tag
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
+from django.db.models import Count, F, Max, Q
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.urls import reverse
+from django.views.decorators.http import last_modified
 
+from .freshness import CONTENT_CHANGE_KEY
+from .models import Post, TagStats
+from .perflog import count_cache
 
-# To include URLs for tag-filtered views in your sitemap
-class TagSitemap(Sitemap):
-    changefreq = 'weekly'
-    priority = 0.8
 
-    def items(self):
-        # get all tags used in the blog
-        return Tag.objects.all()
+# Sharded sitemaps
+#
+# A single sitemap document may hold at most 50,000 URLs, and building it from full
+# model instances keeps every row in memory at once. Instead, /sitemap.xml is a sitemap
+# index pointing at fixed-size shards, /sitemap-<section>-<n>.xml. Shard n of a section
+# holds the objects whose id is in [n * shard_size, (n + 1) * shard_size). Because the
+# boundaries are id ranges, publishing a new post never shifts the content of older
+# shards, so their lastmod stays put.
+#
+# Shards are streamed: rows come from .iterator() with only the columns the <url>
+# entries need. Each shard has its own lastmod, which answers If-Modified-Since with a
+# 304 and keys the cached copy of the rendered shard.
+# The index's Last-Modified is the newest lastmod of its shards.
 
-    # In a Django Sitemap class, the location() method is responsible for generating
-    # the URL for each item returned by the items() method.
-    def location(self, obj):
-        # generate the URL for a tag-filtered view
-        return reverse('blog:post_list_by_tag', args=[obj.slug])
 
+class ShardedSitemap:
+    changefreq = None
+    priority = None
+    # the integer column the shards are ranges of
+    shard_field = 'id'
+
+    @property
+    def shard_size(self):
+        return getattr(settings, 'SITEMAP_SHARD_SIZE', 10000)
+
+    def tracked(self):
+        """
+        Queryset whose newest updated_on is the lastmod of a shard. It includes rows
+        that are not listed (e.g. drafts) so that unpublishing also changes lastmod.
+        """
+        raise NotImplementedError
+
+    def listed(self):
+        """
+        Q() of the tracked rows that are listed; shards without any are left out.
+        """
+        raise NotImplementedError
+
+    def rows(self, shard):
+        """
+        Iterate over the rows listed in shard, as tuples accepted by location()/lastmod().
+        """
+        raise NotImplementedError
+
+    def location(self, row):
+        raise NotImplementedError
+
+    def lastmod(self, row):
+        return None
+
+    def _in_shard(self, queryset, shard):
+        return queryset.filter(**{
+            f'{self.shard_field}__gte': shard * self.shard_size,
+            f'{self.shard_field}__lt': (shard + 1) * self.shard_size,
+        })
 
-class PostSitemap(Sitemap):
+    def _stats(self):
+        # lastmod over every tracked row, and how many of them are listed
+        return {'lastmod': Max('updated_on'), 'listed': Count(self.shard_field, filter=self.listed())}
+
+    def shards(self):
+        """
+        Return [(shard, lastmod), ...] for the shards that list something, with one
+        GROUP BY query.
+        """
+        return list(
+            self.tracked()
+            .annotate(shard=F(self.shard_field) / self.shard_size)
+            .values('shard')
+            .annotate(**self._stats())
+            .filter(listed__gt=0)
+            .order_by('shard')
+            .values_list('shard', 'lastmod')
+        )
+
+    def shard_lastmod(self, shard):
+        """
+        Return the lastmod of shard, or None when it lists nothing.
+        """
+        stats = self._in_shard(self.tracked(), shard).aggregate(**self._stats())
+        return stats['lastmod'] if stats['listed'] else None
+
+
+class PostSitemap(ShardedSitemap):
     changefreq = 'weekly'       # How often posts change
     priority = 0.9              # Importance (0.0 to 1.0)
 
+    def tracked(self):
+        return Post.objects.all()
+
+    def listed(self):
+        return Q(status=Post.Status.PUBLISHED)
+
     # method for including which objects to include
-    def items(self):
-        return Post.published.all()
+    def rows(self, shard):
+        return (
+            self._in_shard(Post.published.all(), shard)
+            .order_by('id')
+            .values_list('slug', 'publish', 'updated_on')
+            .iterator(chunk_size=2000)
+        )
 
-    # Last modified date
-    def lastmod(self, obj):
-        return obj.updated_on
-        # return obj.author
+    def location(self, row):
+        slug, publish, updated_on = row
+        # an unsaved instance reuses Post.get_absolute_url without loading the full row
+        return Post(slug=slug, publish=publish).get_absolute_url()
 
+    # Last modified date
+    def lastmod(self, row):
+        return row[2]
         # if used the: return obj.author, it causes error.
         # The error occurs because the lastmod method must return a date/timestamp, not an author object.
         # The sitemap needs dates to show when content was last modified.
 
+
+# To include URLs for tag-filtered views in your sitemap
+# Read from the tag statistics (blog/tagstats.py): tags without published posts are
+# left out, and each tag's lastmod is the newest change among its published posts.
+class TagSitemap(ShardedSitemap):
+    changefreq = 'weekly'
+    priority = 0.8
+    shard_field = 'tag_id'
+
+    def tracked(self):
+        # every row, so a tag that stops being listed still changes its shard's lastmod
+        return TagStats.objects.all()
+
+    def listed(self):
+        return Q(published_posts__gt=0)
+
+    def rows(self, shard):
+        return (
+            self._in_shard(TagStats.objects.filter(published_posts__gt=0), shard)
+            .order_by('tag_id')
+            .values_list('tag__slug', 'last_modified')
+            .iterator(chunk_size=2000)
+        )
+
+    # In a Django Sitemap class, the location() method is responsible for generating
+    # the URL for each item returned by the items() method.
+    def location(self, row):
+        # generate the URL for a tag-filtered view
+        return reverse('blog:post_list_by_tag', args=[row[0]])
+
+    def lastmod(self, row):
+        return row[1]
+
+
+def _w3c_datetime(value):
+    return value.isoformat(timespec='seconds')
+
+
+def _site_root(request):
+    return f'{request.scheme}://{get_current_site(request).domain}'
+
+
+def _index_last_modified(request, sitemaps):
+    # memoized for the view body, which lists the same shards
+    request._sitemap_shards = {section: sitemap_class().shards() for section, sitemap_class in sitemaps.items()}
+    # a deleted post leaves its shard's lastmod alone, but may empty the shard
+    changes = [cache.get(CONTENT_CHANGE_KEY)]
+    changes += [lastmod for shards in request._sitemap_shards.values() for _, lastmod in shards]
+    changes = [changed for changed in changes if changed is not None]
+    return max(changes) if changes else None
+
+
+@last_modified(_index_last_modified)
+def sitemap_index(request, sitemaps):
+    root = _site_root(request)
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n',
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n',
+    ]
+    for section, shards in request._sitemap_shards.items():
+        for shard, lastmod in shards:
+            location = reverse('sitemap_shard', kwargs={'section': section, 'shard': shard})
+            lines.append(f'<sitemap><loc>{escape(root + location)}</loc>')
+            if lastmod:
+                lines.append(f'<lastmod>{_w3c_datetime(lastmod)}</lastmod>')
+            lines.append('</sitemap>\n')
+    lines.append('</sitemapindex>\n')
+    return HttpResponse(''.join(lines), content_type='application/xml')
+
+
+def _get_sitemap(sitemaps, section):
+    try:
+        return sitemaps[section]()
+    except KeyError:
+        raise Http404(f'No sitemap available for section: {section!r}')
+
+
+def _shard_last_modified(request, sitemaps, section, shard):
+    # memoized for the view body, which keys the cached copy on the same value
+    request._sitemap_lastmod = _get_sitemap(sitemaps, section).shard_lastmod(shard)
+    return request._sitemap_lastmod
+
+
+@last_modified(_shard_last_modified)
+def sitemap_shard(request, sitemaps, section, shard):
+    sitemap = _get_sitemap(sitemaps, section)
+    lastmod = request._sitemap_lastmod
+    if lastmod is None:
+        raise Http404('Empty sitemap shard')
+
+    root = _site_root(request)
+    cache_key = f'blog:sitemap:{root}:{section}:{shard}:{lastmod.timestamp()}'
+    cached = cache.get(cache_key)
+    count_cache(hit=cached is not None)
+    if cached is not None:
+        return HttpResponse(cached, content_type='application/xml')
+
+    def render():
+        chunks = []
+        for chunk in _render_shard(sitemap, shard, root):
+            chunks.append(chunk)
+            yield chunk
+        # only a completely streamed shard is worth keeping
+        cache.set(cache_key, ''.join(chunks), getattr(settings, 'SITEMAP_CACHE_TIMEOUT', 60 * 60 * 24))
+
+    return StreamingHttpResponse(render(), content_type='application/xml')
+
+
+def _render_shard(sitemap, shard, root):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for row in sitemap.rows(shard):
+        entry = f'<url><loc>{escape(root + sitemap.location(row))}</loc>'
+        lastmod = sitemap.lastmod(row)
+        if lastmod:
+            entry += f'<lastmod>{_w3c_datetime(lastmod)}</lastmod>'
+        if sitemap.changefreq:
+            entry += f'<changefreq>{sitemap.changefreq}</changefreq>'
+        if sitemap.priority is not None:
+            entry += f'<priority>{sitemap.priority}</priority>'
+        yield entry + '</url>\n'
+    yield '</urlset>\n'
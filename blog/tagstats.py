@@ -0,0 +1,85 @@
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+from taggit.models import Tag
+
+from .models import Post, TagStats
+
+
+# Tag statistics, materialized.
+#
+# TagStats holds, per tag, the number of published posts with that tag and the newest
+# publish / updated_on among them, so the tag pages, the tag sitemap and the tag cloud
+# never have to count through the tagging table. blog.signals calls refresh_tag_stats()
+# with the tags a change can affect (the tags of a post that is published, edited,
+# unpublished or deleted, and tags added to or removed from a post); each refresh
+# recomputes those tags' rows exactly, with one GROUP BY over their published posts,
+# so there are no running +1/-1 counters that could drift.
+
+
+def _aggregate(tag_ids=None):
+    published = Post.published.all()
+    if tag_ids is not None:
+        published = published.filter(tags__in=tag_ids)
+    return {
+        tag_id: (count, latest_publish, last_modified)
+        for tag_id, count, latest_publish, last_modified in published
+        .values('tags')
+        .annotate(count=Count('id'), latest_publish=Max('publish'), last_modified=Max('updated_on'))
+        .order_by()
+        .values_list('tags', 'count', 'latest_publish', 'last_modified')
+        if tag_id is not None
+    }
+
+
+def _store(tag_ids, totals):
+    # write only the rows whose values changed, so updated_on only moves for them
+    now = timezone.now()
+    current = TagStats.objects.in_bulk(tag_ids)
+    changed = []
+    for tag_id in tag_ids:
+        values = totals.get(tag_id, (0, None, None))
+        stats = current.get(tag_id)
+        if stats is not None and (stats.published_posts, stats.latest_publish, stats.last_modified) == values:
+            continue
+        changed.append(TagStats(
+            tag_id=tag_id, published_posts=values[0], latest_publish=values[1],
+            last_modified=values[2], updated_on=now,
+        ))
+    TagStats.objects.bulk_create(
+        changed,
+        update_conflicts=True,
+        unique_fields=['tag'],
+        update_fields=['published_posts', 'latest_publish', 'last_modified', 'updated_on'],
+    )
+    return len(changed)
+
+
+def refresh_tag_stats(tag_ids):
+    """
+    Recompute the statistics of tag_ids. Returns the number of rows that changed.
+    """
+    tag_ids = set(tag_ids) - {None}
+    if not tag_ids:
+        return 0
+    with transaction.atomic():
+        # tags deleted in the meantime have no row to write
+        tag_ids = set(Tag.objects.filter(id__in=tag_ids).values_list('id', flat=True))
+        return _store(tag_ids, _aggregate(tag_ids))
+
+
+def refresh_tag_stats_for_posts(post_ids, other_tag_ids=()):
+    """
+    Recompute the statistics of every tag of post_ids, and of other_tag_ids (e.g. tags
+    just removed from them).
+    """
+    tag_ids = set(Post.tags.through.objects.filter(content_object_id__in=post_ids).values_list('tag_id', flat=True))
+    return refresh_tag_stats(tag_ids | set(other_tag_ids))
+
+
+def rebuild_tag_stats():
+    """
+    Recompute the statistics of every tag. Returns the number of rows that changed.
+    """
+    with transaction.atomic():
+        return _store(set(Tag.objects.values_list('id', flat=True)), _aggregate())
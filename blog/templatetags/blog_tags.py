@@ -1,9 +1,17 @@
+import math
+import time
+from contextvars import ContextVar
+
 from django import template
-from django.db.models import Count
-import markdown
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
 from django.utils.safestring import mark_safe
 
-from ..models import Post
+from ..models import Post, TagStats
+from ..perflog import count_cache
+from ..rendering import render_markdown
+from ..routers import primary
 
 
 # Each module that contains template tags needs to define a variable called register to be a valid tag
@@ -25,7 +33,7 @@ def total_posts():
 # a new template tag, and when I use it, please use this HTML file (latest_posts.html) to display the results."
 @register.inclusion_tag('blog/post/latest_posts.html')
 def show_latest_posts(count=5):
-    latest_posts = Post.published.order_by('-publish')[:count]
+    latest_posts = Post.published.only('title', 'slug', 'publish').order_by('-publish')[:count]
     # [:count] takes only the number of posts you specified (like saying "give me the first 5")
     return {'latest_posts': latest_posts}
 
@@ -37,22 +45,114 @@ def show_latest_posts(count=5):
 
 @register.simple_tag
 def get_most_commented_posts(count=5):
-    return Post.published.annotate(
-        total_comments=Count('comments')
-    ).order_by('-total_comments')[:count]
+    return Post.published.only('title', 'slug', 'publish').order_by('-active_comment_count')[:count]
     # This query is doing several things in sequence:
     #
     # Post.published starts with all your published posts
-    # .annotate(total_comments=Count('comments')) adds a new calculated field to each post that counts how many
-    # comments it has. Think of it like adding a sticky note to each post with its comment count.
-    # .order_by('-total_comments') sorts the posts by their comment count, with the minus sign meaning
+    # active_comment_count is a counter stored on each post (kept current by a database trigger),
+    # so there is no need to count the comments table on every page.
+    # .order_by('-active_comment_count') sorts the posts by their comment count, with the minus sign meaning
     # "highest to lowest" (like arranging posts from most commented to least commented)
     # [:count] takes just the top few posts based on the count parameter we specified
 
 
+# {% tag_cloud %}: the most used tags, from the tag statistics (blog/tagstats.py), each
+# with a size class from 1 to `sizes` by how many published posts it has (logarithmic,
+# so one huge tag does not shrink all the others to the smallest size).
+@register.inclusion_tag('blog/post/tag_cloud.html')
+def tag_cloud(count=20, sizes=5):
+    stats = list(
+        TagStats.objects.filter(published_posts__gt=0)
+        .select_related('tag')
+        .order_by('-published_posts')[:count]
+    )
+    if stats:
+        smallest = math.log(stats[-1].published_posts)
+        spread = math.log(stats[0].published_posts) - smallest or 1
+        for entry in stats:
+            entry.size = 1 + round((math.log(entry.published_posts) - smallest) / spread * (sizes - 1))
+    # alphabetical, like most tag clouds
+    return {'tags': sorted(stats, key=lambda entry: entry.tag.name.casefold())}
+
+
+# Cached sidebar
+#
+# {% cached_sidebar %} renders blog/post/sidebar.html (post count, latest posts and most
+# commented posts) once and serves the HTML from the cache named by SIDEBAR_CACHE_ALIAS,
+# so a warm sidebar costs no queries at all. Use a cache shared by all workers
+# (memcached, redis, database) in production, otherwise invalidation only reaches
+# the process that handled the write.
+#
+# Invalidation does not delete the HTML: blog.signals calls invalidate_sidebar(), which
+# stores a new version token. A cached copy whose version differs is stale. The first
+# worker to see it takes a short lock with cache.add() and re-renders, while every other
+# worker keeps serving the stale copy meanwhile, so a miss never turns into a stampede
+# of identical GROUP BY queries. The token is also the version of the full-page cache's
+# 'sidebar' surrogate key (blog/pagecache.py), so invalidating the sidebar makes the
+# cached pages showing it stale too.
+SIDEBAR_VERSION_KEY = 'blog:sidebar:version'
+SIDEBAR_LOCK_TIMEOUT = 30
+# set to a list by the page cache for the page it renders: a stale copy served here
+# is noted in it, so that page is not stored under the current token
+stale_sidebar_served = ContextVar('blog_stale_sidebar_served', default=None)
+
+
+def sidebar_cache():
+    return caches[getattr(settings, 'SIDEBAR_CACHE_ALIAS', 'default')]
+
+
+def invalidate_sidebar():
+    sidebar_cache().set(SIDEBAR_VERSION_KEY, time.time_ns(), None)
+
+
+@register.simple_tag
+def cached_sidebar(latest=3, most_commented=3):
+    cache = sidebar_cache()
+    key = f'blog:sidebar:{latest}:{most_commented}'
+    lock_key = f'{key}:lock'
+    cached = cache.get_many([key, SIDEBAR_VERSION_KEY])
+    version = cached.get(SIDEBAR_VERSION_KEY)
+    stale = cached.get(key)
+    if stale is not None and version is not None and stale[0] == version:
+        count_cache(hit=True)
+        return mark_safe(stale[1])
+    count_cache(hit=False)
+
+    if version is None:
+        # first use (or the cache was flushed): start a version everybody agrees on;
+        # 0 like a surrogate key never purged (a page rendered meanwhile may be kept)
+        cache.add(SIDEBAR_VERSION_KEY, 0, None)
+        version = cache.get(SIDEBAR_VERSION_KEY)
+
+    if not cache.add(lock_key, 1, SIDEBAR_LOCK_TIMEOUT):
+        # somebody else is already re-rendering it
+        if stale is not None:
+            served = stale_sidebar_served.get()
+            if served is not None:
+                served.append(stale[0])
+            return mark_safe(stale[1])
+        # nothing to fall back on: render for this request without storing it
+        return mark_safe(render_sidebar(latest, most_commented))
+    try:
+        # stored for everybody: read it from the primary (see blog/routers.py)
+        with primary():
+            html = render_sidebar(latest, most_commented)
+        cache.set(key, (version, html), getattr(settings, 'SIDEBAR_CACHE_TIMEOUT', 3600))
+    finally:
+        cache.delete(lock_key)
+    return mark_safe(html)
+
+
+def render_sidebar(latest, most_commented):
+    return render_to_string('blog/post/sidebar.html', {
+        'latest': latest,
+        'most_commented': most_commented,
+    })
+
+
 @register.filter(name='markdown')
 def markdown_format(text):
-    return mark_safe(markdown.markdown(text))
+    return mark_safe(render_markdown(text))
 
 # The function markdown_format(text) takes the raw text (containing Markdown syntax) and:
 #
@@ -62,6 +162,8 @@ def markdown_format(text):
 #
 # This lets you write blog posts in Markdown and automatically convert them to properly
 # formatted HTML in your templates using {{ post.body|markdown }}.
+# Post bodies no longer go through this filter: they are rendered once in Post.save()
+# and read from post.body_html / post.excerpt_html.
 
 # NOTE
 # In Django, HTML content is escaped by default for security. Use mark_safe cautiously,
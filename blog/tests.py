@@ -1,3 +1,1086 @@
-from django.test import TestCase
+import random
+import tempfile
+import threading
+import json
+import time
+import unittest
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection, connections
+from django.db.migrations.loader import MigrationLoader
+from django.template import Context, Template
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from taggit.models import Tag, TaggedItem
+
+from .async_views import run_concurrently
+from .changelist import EstimatedCountPaginator, estimate_count
+from .freshness import CONTENT_CHANGE_KEY
+from .management.commands.benchmark_endpoints import Command as BenchmarkCommand
+from .management.commands.purge_stand_in import PurgeStandIn
+from .mailqueue import enqueue_mail, send_queued_mail
+from .models import Comment, OutboundEmail, Post, SimilarPost, TaggedPost, TagStats
+from .pagination import encode_cursor
+from .pagecache import get_purge_worker, post_key, purge
+from .queryplans import endpoint_plans, plan_checking
+from .search import get_search_backend
+from .search.bm25 import BM25SearchBackend, MappedIndex
+from .search.cache import bump_search_generation, cached_search_ids
+from .search.snippets import text_snippet
+from .signals import posts_bulk_updated, posts_rerendered
+from .similarity import rebuild_similar_posts
+from .search.suggest import CHANGE_KEY, SuggestionIndex, _log_change, invalidate_suggestions
+from .sitemaps import PostSitemap, TagSitemap
+from .tagstats import refresh_tag_stats_for_posts
+from .templatetags.blog_tags import cached_sidebar, invalidate_sidebar, tag_cloud
+from .transfer import Importer
+from .views import PostListView
+
+
+def make_post(author, slug='a-post', **kwargs):
+    kwargs.setdefault('status', Post.Status.PUBLISHED)
+    kwargs.setdefault('body', 'Some *text*.')
+    kwargs.setdefault('title', slug.replace('-', ' ').title())
+    return Post.objects.create(author=author, slug=slug, **kwargs)
+
+
+def comment(post):
+    return Comment.objects.create(post=post, name='Reader', email='reader@example.com', body='Nice.')
+
+
+class ActiveCommentCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def test_full_save_keeps_comments_added_since_load(self):
+        post = make_post(self.author)
+        # the trigger counts it in the database; `post` still holds 0
+        Comment.objects.create(post=post, name='Reader', email='reader@example.com', body='Nice.')
+        post.title = 'Edited'
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.title, 'Edited')
+        self.assertEqual(post.active_comment_count, 1)
+
+    def test_save_of_deferred_instance(self):
+        post = make_post(self.author)
+        Comment.objects.create(post=post, name='Reader', email='reader@example.com', body='Nice.')
+        post = Post.objects.only('id', 'title', 'body').get(id=post.id)
+        post.body = 'Other *text*.'
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.body_html, '<p>Other <em>text</em>.</p>')
+        self.assertEqual(post.active_comment_count, 1)
+
+
+class RerenderPostsTests(TestCase):
+    def test_rerender_touches_posts_and_signals_them(self):
+        post = make_post(User.objects.create_user('author'))
+        Post.objects.update(updated_on=timezone.now() - timedelta(days=1))
+        received = []
+
+        def receiver(sender, post_ids, **kwargs):
+            received.extend(post_ids)
+        posts_rerendered.connect(receiver)
+        self.addCleanup(posts_rerendered.disconnect, receiver)
+        # nothing but the HTML changed: no reindexing and recomputing
+        bulk_updates = []
+
+        def bulk_receiver(sender, post_ids, **kwargs):
+            bulk_updates.extend(post_ids)
+        posts_bulk_updated.connect(bulk_receiver)
+        self.addCleanup(posts_bulk_updated.disconnect, bulk_receiver)
+        call_command('rerender_posts', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertGreater(post.updated_on, timezone.now() - timedelta(minutes=1))
+        self.assertEqual(received, [post.id])
+        self.assertEqual(bulk_updates, [])
+
+
+class RunConcurrentlyTests(TransactionTestCase):
+    def backends(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()')
+            return cursor.fetchone()[0]
+
+    def test_each_function_runs_on_its_own_connection(self):
+        make_post(User.objects.create_user('author'))
+        before = self.backends()
+
+        def count():
+            # the process id of the database backend serving the query
+            return Post.objects.count(), connection.connection.info.backend_pid
+
+        results = async_to_sync(run_concurrently)(*[count] * 4)
+        self.assertEqual({posts for posts, backend in results}, {1})
+        self.assertGreater(len({backend for posts, backend in results}), 1)
+        self.assertNotIn(connection.connection.info.backend_pid, {backend for posts, backend in results})
+        # the worker threads closed their connections again
+        self.assertEqual(self.backends(), before)
+
+
+class ImporterTests(TestCase):
+    stamp = '2020-01-02T03:04:05+00:00'
+
+    def write_records(self, *records):
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'blog.jsonl'
+        path.write_text(''.join(
+            record if isinstance(record, str) else json.dumps(record) + '\n' for record in records
+        ))
+        return str(path)
+
+    def import_records(self, *records):
+        importer = Importer(self.write_records(*records), log=lambda message: None)
+        importer.run()
+        return importer
+
+    def post_record(self, post_id, **fields):
+        return {
+            'type': 'post', 'id': post_id, 'title': 'Vieja', 'slug': f'vieja-{post_id}', 'body': 'Texto',
+            'publish': self.stamp, 'status': 'Pb', 'author': 'autora', 'tags': ['django'],
+            'created_on': self.stamp, 'updated_on': self.stamp, **fields,
+        }
+
+    def comment_record(self, comment_id, post_id):
+        return {
+            'type': 'comment', 'id': comment_id, 'post': post_id, 'name': 'Ana', 'email': 'ana@example.com',
+            'body': 'Hola', 'active': True, 'created_on': self.stamp, 'updated_on': self.stamp,
+        }
+
+    def test_keeps_timestamps_and_skips_comments_of_missing_posts(self):
+        with CaptureQueriesContext(connection) as queries:
+            importer = self.import_records(
+                self.post_record(7), self.post_record(9), self.comment_record(1, 7), self.comment_record(2, 8),
+            )
+        # one UPDATE ... FROM (VALUES ...) per batch, the model's auto_now left alone
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "blog_')]
+        self.assertEqual(len(updates), 2)
+        self.assertTrue(all('FROM (VALUES' in sql for sql in updates))
+        self.assertTrue(Post._meta.get_field('updated_on').auto_now)
+        self.assertEqual(importer.skipped, 1)
+        self.assertEqual(
+            [(post.created_on.isoformat(), post.updated_on.isoformat()) for post in Post.objects.order_by('id')],
+            [(self.stamp, self.stamp)] * 2,
+        )
+        self.assertEqual(
+            list(Comment.objects.values_list('id', 'created_on')), [(1, Post.objects.get(id=7).created_on)],
+        )
+
+    def test_command_invalidates_the_validators_and_the_pages(self):
+        existing = make_post(User.objects.create_user('author'))
+        cache.delete(CONTENT_CHANGE_KEY)
+        path = self.write_records(self.post_record(existing.id + 1), self.comment_record(1, existing.id))
+        with mock.patch('blog.management.commands.import_blog.purge') as purge_pages:
+            call_command('import_blog', path, '--skip-derived', stdout=StringIO())
+        self.assertIsNotNone(cache.get(CONTENT_CHANGE_KEY))
+        purge_pages.assert_called_once_with(['listing', 'sidebar', post_key(existing.id)])
+
+    def test_bad_line_stops_with_its_number(self):
+        with self.assertRaisesMessage(CommandError, 'Line 2'):
+            self.import_records({'type': 'tag', 'name': 'django', 'slug': 'django'}, {'type': 'user'})
+
+
+class SimilarPostsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        now = timezone.now()
+        cls.plain = [make_post(author, f'django-{n}', publish=now - timedelta(days=n)) for n in range(6)]
+        cls.orm = [make_post(author, f'orm-{n}', publish=now - timedelta(days=10 + n)) for n in range(2)]
+        # the oldest: nobody lists it while it only shares 'django'
+        cls.changed = make_post(author, 'cambiada', publish=now - timedelta(days=30))
+        for post in cls.plain + [cls.changed]:
+            post.tags.add('django')
+        for post in cls.orm:
+            post.tags.add('django', 'orm')
+        rebuild_similar_posts()
+
+    def rows(self):
+        return set(SimilarPost.objects.values_list('post_id', 'similar_id', 'same_tags', 'rank'))
+
+    def test_tag_change_rewrites_only_the_rows_it_changes(self):
+        before = dict(SimilarPost.objects.values_list('id', 'post_id'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.changed.tags.add('orm')
+        kept = set(SimilarPost.objects.filter(id__in=before).values_list('post_id', flat=True))
+        rewritten = set(before.values()) - kept
+        self.assertEqual(rewritten, {self.changed.id, *(post.id for post in self.orm)})
+        # and they are what a full rebuild computes
+        incremental = self.rows()
+        rebuild_similar_posts()
+        self.assertEqual(incremental, self.rows())
+
+    def test_unpublishing_refills_the_rows_that_listed_it(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plain[0].status = Post.Status.DRAFT
+            self.plain[0].save()
+        self.assertFalse(SimilarPost.objects.filter(similar=self.plain[0]).exists())
+        incremental = self.rows()
+        rebuild_similar_posts()
+        self.assertEqual(incremental, self.rows())
+
+
+@override_settings(SEARCH_BACKEND='postgres')
+class SearchVectorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.in_title = make_post(author, 'en-titulo', title='Guía de índices', body='Nada que ver.')
+        cls.in_body = make_post(author, 'en-cuerpo', title='Otra cosa', body='Hablamos de índices parciales.')
+
+    def test_trigger_fills_the_vector_on_save_and_update(self):
+        self.assertTrue(Post.objects.filter(id=self.in_title.id, search_vector__isnull=False).exists())
+        # queryset update() bypasses save(): the trigger still follows it
+        Post.objects.filter(id=self.in_body.id).update(body='Ahora trata de vacunas.')
+        self.assertEqual(get_search_backend().search_ids('vacunas'), [self.in_body.id])
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(get_search_backend().search_ids('índices', mode='rank'), [self.in_title.id, self.in_body.id])
+
+    def test_search_reads_no_body(self):
+        with CaptureQueriesContext(connection) as queries:
+            get_search_backend().search_ids('índices')
+        self.assertNotIn('to_tsvector', queries[-1]['sql'])
+
+
+class SidebarCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        make_post(cls.author, 'primera')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_warm_sidebar_costs_no_queries(self):
+        cached_sidebar(3, 3)
+        with self.assertNumQueries(0):
+            html = cached_sidebar(3, 3)
+        self.assertIn('Primera', html)
+
+    def test_publishing_a_post_invalidates_it(self):
+        cached_sidebar(3, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_post(self.author, 'segunda')
+        self.assertIn('Segunda', cached_sidebar(3, 3))
+
+    def test_draft_leaves_it_alone(self):
+        cached_sidebar(3, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_post(self.author, 'borrador', status=Post.Status.DRAFT)
+        with self.assertNumQueries(0):
+            cached_sidebar(3, 3)
+
+
+class ListingQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def make_posts(self, count):
+        start = Post.objects.count()
+        for n in range(start, start + count):
+            post = make_post(User.objects.create_user(f'author-{n}'), f'entrada-{n}')
+            post.tags.add(f'tag-{n}', 'comun')
+
+    def listing_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('blog:post_list')).status_code, 200)
+        return len(queries)
+
+    def test_authors_and_tags_in_two_queries(self):
+        self.make_posts(3)
+        with self.assertNumQueries(2):
+            rows = [
+                (post.author.username, [tag.name for tag in post.tags.all()]) for post in Post.published.for_listing()
+            ]
+        self.assertEqual(len(rows), 3)
+
+    def test_listing_queries_do_not_grow_with_the_page(self):
+        self.make_posts(1)
+        self.listing_queries()
+        one = self.listing_queries()
+        self.make_posts(3)
+        cache.clear()
+        self.listing_queries()
+        self.assertEqual(self.listing_queries(), one)
+
+
+@override_settings(POST_LIST_PAGINATION='keyset')
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        now = timezone.now()
+        # two posts share a publish time so the id has to break the tie
+        cls.posts = [
+            make_post(author, f'entrada-{n}', publish=now - timedelta(days=min(n, 5)))
+            for n in range(7)
+        ]
+        # newest first, ties by the higher id
+        cls.order = [post.id for post in sorted(cls.posts, key=lambda post: (post.publish, post.id), reverse=True)]
+
+    def get_page(self, **params):
+        request = RequestFactory().get('/', params)
+        response = PostListView.as_view()(request)
+        return response.context_data['page_obj']
+
+    def test_next_cursors_walk_every_post_once(self):
+        seen = []
+        page = self.get_page()
+        self.assertFalse(page.has_previous())
+        while True:
+            seen += [post.id for post in page]
+            if not page.has_next():
+                break
+            page = self.get_page(after=page.next_cursor)
+        self.assertEqual(seen, self.order)
+
+    def test_previous_cursor_goes_back_a_page(self):
+        first = self.get_page()
+        second = self.get_page(after=first.next_cursor)
+        back = self.get_page(before=second.previous_cursor)
+        self.assertEqual([post.id for post in back], [post.id for post in first])
+        self.assertFalse(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_no_count_and_no_offset(self):
+        first = self.get_page()
+        with CaptureQueriesContext(connection) as queries:
+            self.get_page(after=first.next_cursor)
+        sql = ' '.join(query['sql'] for query in queries).upper()
+        self.assertNotIn('COUNT(', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_invalid_cursor_gives_the_first_page(self):
+        page = self.get_page(after='not-a-cursor')
+        self.assertEqual([post.id for post in page], self.order[:3])
+
+
+@override_settings(COMMENTS_PER_PAGE=2)
+class CommentPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = make_post(User.objects.create_user('author'))
+        cls.comments = [comment(cls.post) for _ in range(5)]
+        # a tie on created_on, broken by the id
+        Comment.objects.filter(id__in=[c.id for c in cls.comments[1:3]]).update(created_on=cls.comments[1].created_on)
+        hidden = comment(cls.post)
+        hidden.active = False
+        hidden.save()
+
+    def test_next_links_walk_the_active_thread_once(self):
+        url = reverse('blog:post_comments', args=[self.post.id]) + '?format=json'
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data['comments']), 2)
+            seen += [row['id'] for row in data['comments']]
+            url = data['next']
+        self.assertEqual(seen, [c.id for c in self.comments])
+
+    def test_last_page_has_no_next_link(self):
+        url = reverse('blog:post_comments', args=[self.post.id])
+        first = self.client.get(url, {'format': 'json'}).json()
+        self.assertIsNotNone(first['next'])
+        third = self.client.get(url, {'format': 'json', 'after': encode_cursor(self.comments[3], 'created_on')}).json()
+        self.assertEqual([row['id'] for row in third['comments']], [self.comments[4].id])
+        self.assertIsNone(third['next'])
+
+    def test_draft_posts_show_no_comments(self):
+        Post.objects.filter(id=self.post.id).update(status=Post.Status.DRAFT)
+        data = self.client.get(reverse('blog:post_comments', args=[self.post.id]), {'format': 'json'}).json()
+        self.assertEqual(data, {'comments': [], 'next': None})
+
+
+class TagStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+
+    def tagged_post(self, slug, *tags, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = make_post(self.author, slug, **kwargs)
+            post.tags.add(*tags)
+        return post
+
+    def stats(self, name):
+        return TagStats.objects.get(tag__name=name).published_posts
+
+    def test_signals_keep_the_counts(self):
+        post = self.tagged_post('primera', 'django', 'orm')
+        self.tagged_post('segunda', 'django')
+        self.tagged_post('borrador', 'django', status=Post.Status.DRAFT)
+        self.assertEqual((self.stats('django'), self.stats('orm')), (2, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            post.tags.remove('orm')
+        self.assertEqual(self.stats('orm'), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertEqual(self.stats('django'), 1)
+
+    def test_refresh_writes_only_changed_rows(self):
+        post = self.tagged_post('primera', 'django', 'orm')
+        self.assertEqual(refresh_tag_stats_for_posts([post.id]), 0)
+        # behind the signals' back
+        Post.objects.filter(id=post.id).update(status=Post.Status.DRAFT)
+        self.assertEqual(refresh_tag_stats_for_posts([post.id]), 2)
+        self.assertEqual(self.stats('django'), 0)
+
+    def test_tag_cloud_sizes_by_post_count(self):
+        for n, tags in enumerate([('grande', 'mediana', 'pequena'), ('grande', 'mediana'), ('grande',), ('grande',)]):
+            self.tagged_post(f'entrada-{n}', *tags)
+        self.tagged_post('borrador', 'oculta', status=Post.Status.DRAFT)
+        self.assertEqual((self.stats('grande'), self.stats('mediana'), self.stats('pequena')), (4, 2, 1))
+        context = tag_cloud(sizes=3)
+        self.assertEqual([(entry.tag.name, entry.size) for entry in context['tags']],
+                         [('grande', 3), ('mediana', 2), ('pequena', 1)])
+        html = Template('{% load blog_tags %}{% tag_cloud 20 3 %}').render(Context())
+        self.assertIn('class="tag-size-3"', html)
+        self.assertNotIn('oculta', html)
+
+
+class AdminChangeListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        cls.drafts = [make_post(cls.admin, f'borrador-{n}', status=Post.Status.DRAFT) for n in range(3)]
+        make_post(cls.admin, 'publicada')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def changelist_sql(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:blog_post_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries]
+
+    def facet_queries(self):
+        # the facet counts are aggregates with a FILTER clause per choice
+        return [sql for sql in self.changelist_sql() if 'FILTER (WHERE' in sql]
+
+    def test_facet_counts_are_cached_until_a_bulk_action(self):
+        self.assertTrue(self.facet_queries())
+        self.assertEqual(self.facet_queries(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:blog_post_changelist'), {
+                'action': 'publish_posts', '_selected_action': [post.id for post in self.drafts],
+            })
+        self.assertTrue(self.facet_queries())
+
+    def test_large_counts_come_from_the_planner(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE blog_post')
+        with override_settings(ADMIN_EXACT_COUNT_LIMIT=1):
+            sql = self.changelist_sql()
+        self.assertTrue(any('reltuples' in query for query in sql))
+        self.assertFalse(any('COUNT(*)' in query for query in sql))
+        queryset = Post.objects.filter(status=Post.Status.DRAFT)
+        with override_settings(ADMIN_EXACT_COUNT_LIMIT=1):
+            self.assertEqual(EstimatedCountPaginator(queryset, 10).count, estimate_count(queryset))
+
+    def test_small_counts_stay_exact(self):
+        self.assertTrue(any('COUNT(*)' in query for query in self.changelist_sql()))
+        self.assertEqual(EstimatedCountPaginator(Post.objects.all(), 10).count, 4)
+
+
+class CopyPostTagsMigrationTests(TestCase):
+    migration = import_module('blog.migrations.0016_copy_post_tags')
+
+    def test_copies_the_posts_tagged_items_in_batches(self):
+        author = User.objects.create_user('author')
+        first, second, gone = (make_post(author, slug) for slug in ['primera', 'segunda', 'borrada'])
+        django, orm = Tag.objects.create(name='django', slug='django'), Tag.objects.create(name='orm', slug='orm')
+        post_type = ContentType.objects.get_for_model(Post)
+        for post, tag in [(first, django), (first, orm), (second, django), (gone, orm)]:
+            TaggedItem.objects.create(content_type=post_type, object_id=post.id, tag=tag)
+        # another model's tags, and a row copied by an earlier run
+        TaggedItem.objects.create(content_type=ContentType.objects.get_for_model(User), object_id=author.id, tag=orm)
+        TaggedPost.objects.create(content_object=second, tag=django)
+        gone.delete()
+
+        state = MigrationLoader(connection).project_state(('blog', '0016_copy_post_tags'))
+        with mock.patch.object(self.migration, 'BATCH_SIZE', 2), connection.schema_editor() as editor:
+            self.migration.copy_post_tags(state.apps, editor)
+
+        self.assertCountEqual(
+            TaggedPost.objects.values_list('content_object_id', 'tag__name'),
+            [(first.id, 'django'), (first.id, 'orm'), (second.id, 'django')],
+        )
+
+
+@override_settings(PERF_LOG_ENABLED=True, PERF_LOG_SAMPLE_RATE=1.0)
+class PerformanceLogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = make_post(User.objects.create_user('author'))
+
+    def setUp(self):
+        cache.clear()
+
+    def logged(self, url):
+        with mock.patch('blog.perflog.get_perf_logger') as get_logger:
+            self.assertEqual(Client().get(url).status_code, 200)
+        return [json.loads(call.args[0]) for call in get_logger.return_value.info.call_args_list]
+
+    def test_one_record_per_request(self):
+        [record] = self.logged(self.post.get_absolute_url())
+        self.assertEqual(set(record), {
+            'ts', 'view', 'method', 'status', 'ms', 'db_queries', 'db_ms', 'template_ms', 'cache_hits', 'cache_misses',
+        })
+        self.assertEqual((record['view'], record['method'], record['status']), ('blog:post_detail', 'GET', 200))
+        self.assertGreater(record['db_queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertGreaterEqual(record['ms'], record['db_ms'])
+
+    @override_settings(PERF_LOG_SAMPLE_RATE=0.0, PERF_LOG_SLOW_MS=60000)
+    def test_fast_requests_are_sampled(self):
+        self.assertEqual(self.logged(self.post.get_absolute_url()), [])
+
+    @override_settings(PERF_LOG_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual(self.logged(self.post.get_absolute_url()), [])
+
+
+class SearchSnippetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.post = make_post(author, 'canciones', body='Una <canción> nueva, ' + 'y más ' * 40 + 'otra canción.')
+
+    def test_text_snippet(self):
+        snippet = text_snippet(self.post.body, 'Cancion')
+        self.assertTrue(snippet.startswith('Una &lt;<mark>canción</mark>&gt; nueva'))
+        self.assertTrue(snippet.endswith(' …'))
+
+    def test_bm25_backend_snippets_without_postgres_functions(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            SEARCH_BACKEND='bm25', SEARCH_INDEX_PATH=Path(directory) / 'index.bin',
+        ):
+            backend = get_search_backend()
+            backend.rebuild()
+            post_ids = backend.search_ids('cancion')
+            with CaptureQueriesContext(connection) as queries:
+                posts = backend.snippets(post_ids, 'cancion')
+        self.assertEqual([post.id for post in posts], [self.post.id])
+        self.assertIn('<mark>canción</mark>', posts[0].snippet)
+        self.assertNotIn('ts_headline', queries[0]['sql'])
+
+    def test_postgres_backend_snippets(self):
+        with override_settings(SEARCH_BACKEND='postgres'):
+            posts = get_search_backend().snippets([self.post.id, 0], 'canción')
+        self.assertEqual([post.id for post in posts], [self.post.id])
+        self.assertIn('<mark>canción</mark>', posts[0].snippet)
+
+
+class PostgresSearchTests(TestCase):
+    def test_only_the_capped_candidates_are_scored(self):
+        author = User.objects.create_user('author')
+        now = timezone.now()
+        # the best match, but older than the cap reaches
+        make_post(author, 'trigramas-en-postgres', publish=now - timedelta(days=30), body='Trigramas y más trigramas.')
+        newest = [
+            make_post(author, f'otra-entrada-{day}', publish=now - timedelta(days=day), body=body)
+            for day, body in enumerate([
+                'Hoy hablamos de bases de datos, índices y también de trigramas.',
+                'Trigramas, trigramas: índices de trigramas.',
+            ])
+        ]
+        with override_settings(SEARCH_BACKEND='postgres', SEARCH_MAX_CANDIDATES=2):
+            backend = get_search_backend()
+            with CaptureQueriesContext(connection) as queries:
+                post_ids = backend.search_ids('trigramas', mode='rank')
+        # ranked among the candidates, not by recency
+        self.assertEqual(post_ids, [newest[1].id, newest[0].id])
+        self.assertIn('LIMIT 2', queries[0]['sql'])
+
+
+@override_settings(SEARCH_BACKEND='postgres')
+class SearchCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        cls.post = make_post(cls.author, 'indices-parciales', body='Sobre índices parciales.')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_repeated_search_is_a_hit(self):
+        ids = cached_search_ids('Índices  parciales')
+        self.assertEqual(ids, (self.post.id,))
+        # same query after normalization: no database query at all
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_search_ids('  índices parciales'), ids)
+
+    def test_generation_bump_drops_the_results(self):
+        cached_search_ids('parciales')
+        bump_search_generation()
+        with CaptureQueriesContext(connection) as queries:
+            cached_search_ids('parciales')
+        self.assertTrue(queries)
+
+    def test_publishing_a_post_changes_the_results(self):
+        self.assertEqual(cached_search_ids('parciales'), (self.post.id,))
+        with self.captureOnCommitCallbacks(execute=True):
+            newer = make_post(self.author, 'mas-indices', body='Más índices parciales.')
+        self.assertCountEqual(cached_search_ids('parciales'), [self.post.id, newer.id])
+
+
+class SuggestionIndexTests(TestCase):
+    # two SuggestionIndex objects sharing the cache stand for two worker processes
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = make_post(User.objects.create_user('author'), 'primera-entrada')
+
+    def setUp(self):
+        cache.clear()
+        self.reader = SuggestionIndex()
+        self.reader.rebuild()
+
+    def rename(self, title):
+        Post.objects.filter(id=self.post.id).update(title=title)
+
+    def tag_counts(self):
+        self.reader.ensure_current()
+        return [(name, count) for folded, name, slug, count in self.reader.tags]
+
+    def test_change_from_a_process_without_index_reaches_the_others(self):
+        self.rename('Segunda entrada')
+        writer = SuggestionIndex()
+        writer.refresh_posts([self.post.id])
+        self.assertFalse(writer.loaded)
+        # one query for the logged post, no rebuild
+        with self.assertNumQueries(1):
+            posts, tags = self.reader.suggest('segun')
+        self.assertEqual([title for title, slug, publish in posts], ['Segunda entrada'])
+        self.assertEqual(self.reader.suggest('primer'), ([], []))
+
+    def test_changes_logged_while_behind_are_applied_together(self):
+        writer = SuggestionIndex()
+        writer.rebuild()
+        self.rename('Segunda entrada')
+        writer.refresh_posts([self.post.id])
+        self.rename('Tercera entrada')
+        writer.refresh_posts([self.post.id])
+        self.assertEqual(writer.suggest('terc')[0][0][0], 'Tercera entrada')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.reader.suggest('terc')[0][0][0], 'Tercera entrada')
+
+    def test_tag_counts_follow_the_changes(self):
+        other = make_post(self.post.author, 'segunda-entrada')
+        self.post.tags.add('django', 'orm')
+        other.tags.add('django')
+        writer = SuggestionIndex()
+        writer.refresh_posts([self.post.id, other.id])
+        self.assertEqual(self.tag_counts(), [('django', 2), ('orm', 1)])
+        # retagged, then unpublished: the counts go down and an unused tag leaves
+        self.post.tags.set(['django'])
+        writer.refresh_posts([self.post.id])
+        Post.objects.filter(id=other.id).update(status=Post.Status.DRAFT)
+        writer.refresh_posts([other.id])
+        self.assertEqual(self.tag_counts(), [('django', 1)])
+        self.assertEqual(self.reader.suggest('or')[1], [])
+        fresh = SuggestionIndex()
+        fresh.rebuild()
+        self.assertEqual(fresh.tags, self.reader.tags)
+
+    def test_invalidate_rebuilds(self):
+        self.rename('Segunda entrada')
+        invalidate_suggestions()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.reader.suggest('segun')[0][0][0], 'Segunda entrada')
+
+    def test_missing_log_entry_rebuilds(self):
+        self.rename('Segunda entrada')
+        version = _log_change([self.post.id])
+        cache.delete(CHANGE_KEY.format(version))
+        with self.assertNumQueries(2):
+            self.assertEqual(self.reader.suggest('segun')[0][0][0], 'Segunda entrada')
+
+
+class QueryPlanTests(TestCase):
+    # the endpoints of benchmark_endpoints, over a small generated corpus
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_data', posts=60, comments=300, tags=15, authors=3, seed=1, stdout=StringIO(),
+        )
+
+    def assertNoSequentialScans(self):
+        endpoints = BenchmarkCommand().endpoints(random.Random(0))
+        with plan_checking():
+            client = Client()
+            for name, urls in endpoints.items():
+                with self.subTest(endpoint=name):
+                    response, plans = endpoint_plans(client, urls[0])
+                    self.assertEqual(response.status_code, 200)
+                    self.assertTrue(plans)
+                    for query in plans:
+                        self.assertEqual(query['seq_scans'], [], query['sql'])
+
+    def test_no_sequential_scans(self):
+        self.assertNoSequentialScans()
+
+    @override_settings(POST_LIST_PAGINATION='keyset')
+    def test_no_sequential_scans_with_keyset_pagination(self):
+        self.assertNoSequentialScans()
+
+
+class FreshnessTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        now = timezone.now()
+        cls.newer = make_post(author, 'nueva', publish=now)
+        cls.older = make_post(author, 'vieja', publish=now - timedelta(days=1))
+        # Last-Modified has whole seconds
+        Post.objects.update(updated_on=now - timedelta(minutes=1))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_deleting_a_post_changes_the_validators(self):
+        url = reverse('blog:post_list')
+        response = self.client.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 304)
+        # the newest updated_on stays the same
+        with self.captureOnCommitCallbacks(execute=True):
+            self.older.delete()
+        response = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['Last-Modified'], last_modified)
+        feed = self.client.get(reverse('blog:post_feed'), headers={'if-modified-since': last_modified})
+        self.assertEqual(feed.status_code, 200)
+
+
+@override_settings(SITEMAP_SHARD_SIZE=1)
+class SitemapShardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        cls.published = make_post(author, 'publicada')
+        cls.draft = make_post(author, 'borrador', status=Post.Status.DRAFT)
+        cls.used = TagStats.objects.create(tag=Tag.objects.create(name='usada', slug='usada'), published_posts=1)
+        cls.unused = TagStats.objects.create(tag=Tag.objects.create(name='vacia', slug='vacia'))
+
+    def test_post_shards_list_published_posts_only(self):
+        sitemap = PostSitemap()
+        self.assertEqual([shard for shard, lastmod in sitemap.shards()], [self.published.id])
+        self.assertEqual(sitemap.shard_lastmod(self.published.id), self.published.updated_on)
+        self.assertIsNone(sitemap.shard_lastmod(self.draft.id))
+
+    def test_tag_shards_list_used_tags_only(self):
+        sitemap = TagSitemap()
+        self.assertEqual([shard for shard, lastmod in sitemap.shards()], [self.used.tag_id])
+        self.assertIsNone(sitemap.shard_lastmod(self.unused.tag_id))
+
+    def test_empty_shard_is_not_found(self):
+        response = self.client.get(reverse('sitemap_shard', kwargs={'section': 'tags', 'shard': self.unused.tag_id}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_index_answers_if_modified_since(self):
+        url = reverse('django.contrib.sitemaps.views.sitemap')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # one GROUP BY per section, shared by Last-Modified and the body
+        self.assertEqual(sum('GROUP BY' in query['sql'] for query in queries), 2)
+        self.assertIn(f"sitemap-posts-{self.published.id}.xml", response.content.decode())
+        response = self.client.get(url, headers={'if-modified-since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+
+class RecordingEmailBackend(locmem.EmailBackend):
+    # what the database looked like while each message was handed to the server
+    def __init__(self, *args, during_send=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.during_send = during_send
+        self.seen = []
+
+    def send_messages(self, messages):
+        self.seen.append((
+            connection.in_atomic_block,
+            list(OutboundEmail.objects.filter(to=messages[0].to[0]).values_list('status', flat=True)),
+        ))
+        if self.during_send:
+            self.during_send()
+        return super().send_messages(messages)
+
+
+class FailingEmailBackend(locmem.EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError('server went away')
+
+
+class MailQueueTests(TransactionTestCase):
+    def test_sends_outside_any_transaction_with_the_rows_claimed(self):
+        enqueue_mail('Hola', 'Texto', ['a@example.com', 'b@example.com'])
+        backend = RecordingEmailBackend()
+        self.assertEqual(send_queued_mail(connection=backend), (2, 2))
+        self.assertEqual(backend.seen, [(False, [OutboundEmail.Status.SENDING])] * 2)
+        self.assertEqual(
+            list(OutboundEmail.objects.values_list('status', 'attempts')),
+            [(OutboundEmail.Status.SENT, 1)] * 2,
+        )
+
+    def test_failed_message_is_queued_again(self):
+        enqueue_mail('Hola', 'Texto', ['a@example.com'])
+        self.assertEqual(send_queued_mail(connection=FailingEmailBackend()), (1, 0))
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.Status.QUEUED, 1))
+        self.assertEqual(email.last_error, 'ConnectionError: server went away')
+        self.assertGreater(email.next_attempt_on, timezone.now())
+
+    def test_expired_claim_is_sent_again(self):
+        OutboundEmail.objects.create(
+            subject='Hola', body='Texto', to='a@example.com', status=OutboundEmail.Status.SENDING,
+            attempts=1, next_attempt_on=timezone.now() - timedelta(seconds=1),
+        )
+        self.assertEqual(send_queued_mail(connection=RecordingEmailBackend()), (1, 1))
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.Status.SENT, 2))
+
+    def test_results_do_not_overwrite_a_later_claim(self):
+        enqueue_mail('Hola', 'Texto', ['a@example.com'])
+        later = timezone.now() + timedelta(hours=1)
+
+        def reclaimed():
+            # another worker took the row over meanwhile
+            OutboundEmail.objects.update(next_attempt_on=later)
+
+        send_queued_mail(connection=RecordingEmailBackend(during_send=reclaimed))
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.next_attempt_on), (OutboundEmail.Status.SENDING, later))
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def test_throttled_batch_does_not_stop_the_command(self):
+        OutboundEmail.objects.create(
+            subject='Antes', body='Texto', to='a@example.com', status=OutboundEmail.Status.SENT,
+            sent_on=timezone.now(),
+        )
+        # the oldest batch only holds messages to a throttled recipient
+        enqueue_mail('Hola', 'Texto', ['a@example.com'])
+        enqueue_mail('Hola', 'Texto', ['b@example.com'])
+        self.assertEqual(send_queued_mail(batch_size=1), (1, 0))
+        OutboundEmail.objects.filter(to='a@example.com', status=OutboundEmail.Status.QUEUED).update(
+            next_attempt_on=timezone.now() - timedelta(seconds=1),
+        )
+        mail.outbox = []
+        call_command('send_queued_mail', '--batch-size', '1', stdout=StringIO())
+        self.assertEqual([message.to for message in mail.outbox], [['b@example.com']])
+
+
+class BM25IndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        cls.first = make_post(cls.author, 'primera', body='Hablamos de django y de postgres.')
+        cls.second = make_post(cls.author, 'segunda', body='Hablamos de python.')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.backend = BM25SearchBackend(Path(directory.name) / 'index.bin')
+        self.backend.rebuild()
+        self.main_stamp = MappedIndex(self.backend.path).stamp
+
+    def test_changes_go_to_the_delta(self):
+        self.second.body = 'Ahora hablamos de django.'
+        self.second.save()
+        self.backend.index_post(self.second)
+        self.backend.remove_post(self.first.id)
+        self.assertEqual(self.backend.search_ids('django'), [self.second.id])
+        self.assertEqual(self.backend.search_ids('python'), [])
+        self.assertEqual(self.backend.search_ids('postgres'), [])
+        self.assertEqual(MappedIndex(self.backend.path).stamp, self.main_stamp)
+        self.assertTrue(self.backend.delta_path.exists())
+
+    def test_delta_is_merged_once_full(self):
+        self.backend.merge_docs = 2
+        third = make_post(self.author, 'tercera', body='Hablamos de django.')
+        self.backend.index_post(third)
+        self.assertTrue(self.backend.delta_path.exists())
+        self.backend.remove_post(self.first.id)
+        self.assertFalse(self.backend.delta_path.exists())
+        self.assertEqual(MappedIndex(self.backend.path).n_docs, 2)
+        self.assertEqual(self.backend.search_ids('django'), [third.id])
+
+    def test_delta_of_an_older_main_segment_is_ignored(self):
+        self.backend.remove_post(self.first.id)
+        old_delta = self.backend.delta_path.read_bytes()
+        self.backend.rebuild()
+        # what a reader sees between the two swaps of a merge
+        self.backend.delta_path.write_bytes(old_delta)
+        self.assertEqual(self.backend.search_ids('postgres'), [self.first.id])
+
+
+@override_settings(PAGE_CACHE_ENABLED=True, PAGE_CACHE_PURGE_HOOK=None)
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author')
+        now = timezone.now()
+        cls.posts = [make_post(author, f'entrada-{n}', publish=now - timedelta(days=n)) for n in range(5)]
+        # the sidebar's three most commented posts: 0, 1 and 2
+        for post, comments in zip(cls.posts, (4, 3, 2)):
+            for _ in range(comments):
+                comment(post)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, post):
+        return self.client.get(post.get_absolute_url())
+
+    def assertCached(self, post, cached=True):
+        self.assertEqual(self.get(post).get('X-Page-Cache') == 'hit', cached)
+
+    def test_post_purge_leaves_the_other_pages_alone(self):
+        for post in self.posts[3:]:
+            self.get(post)
+        purge([post_key(self.posts[3].id)])
+        self.assertCached(self.posts[3], False)
+        self.assertCached(self.posts[4])
+
+    def test_sidebar_version_is_the_sidebar_cache_token(self):
+        self.get(self.posts[4])
+        self.assertCached(self.posts[4])
+        # e.g. a comment: blog.signals invalidates the cached sidebar
+        invalidate_sidebar()
+        self.assertCached(self.posts[4], False)
+
+    def test_purging_the_sidebar_renders_nothing(self):
+        self.get(self.posts[4])
+        with self.assertNumQueries(0):
+            purge(['sidebar', post_key(self.posts[3].id)])
+        self.assertCached(self.posts[4], False)
+
+    def test_renamed_tag_purges_its_page_and_posts(self):
+        self.posts[4].tags.add('viejo')
+        tag = Tag.objects.get(slug='viejo')
+        old_url = reverse('blog:post_list_by_tag', args=['viejo'])
+        self.client.get(old_url)
+        self.get(self.posts[4])
+        self.get(self.posts[3])
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.name = tag.slug = 'nuevo'
+            tag.save()
+        self.assertEqual(self.client.get(old_url).status_code, 404)
+        self.assertCached(self.posts[4], False)
+
+    def test_deleted_tag_purges_its_page_and_posts(self):
+        self.posts[4].tags.add('viejo')
+        url = reverse('blog:post_list_by_tag', args=['viejo'])
+        self.client.get(url)
+        self.get(self.posts[4])
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.get(slug='viejo').delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertCached(self.posts[4], False)
+
+
+@override_settings(PAGE_CACHE_ENABLED=True, PAGE_CACHE_PURGE_HOOK='blog.pagecache.http_purge')
+class PurgeHookTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stand_in = PurgeStandIn(('127.0.0.1', 0))
+        thread = threading.Thread(target=self.stand_in.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.stand_in.server_close)
+        self.addCleanup(self.stand_in.shutdown)
+        host, port = self.stand_in.server_address
+        self.enterContext(override_settings(PAGE_CACHE_PURGE_URL=f'http://{host}:{port}/'))
+
+    def test_keys_reach_the_stand_in(self):
+        purge(['post-1', 'listing'])
+        self.assertTrue(get_purge_worker().flush(5))
+        self.assertEqual(self.stand_in.purges, [('/', ['listing', 'post-1'])])
+
+    def test_purge_does_not_wait_for_the_hook(self):
+        release = threading.Event()
+        self.stand_in.on_purge = lambda path, keys: release.wait(1)
+        started = time.monotonic()
+        purge(['post-1'])
+        purge(['post-2'])
+        self.assertLess(time.monotonic() - started, 0.5)
+        release.set()
+        self.assertTrue(get_purge_worker().flush(5))
+        received = {key for path, keys in self.stand_in.purges for key in keys}
+        self.assertEqual(received, {'post-1', 'post-2'})
+
+
+@unittest.skipUnless(settings.DATABASE_REPLICAS, 'set DB_REPLICA_HOSTS=<DB_HOST> for a replica alias')
+@override_settings(PAGE_CACHE_ENABLED=False)
+class ReplicaRoutingTests(TransactionTestCase):
+    # the replica aliases mirror the test database (TEST MIRROR in settings.py), so
+    # the rows have to be committed for them to see
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.post = make_post(User.objects.create_user('author'))
+        self.replica = settings.DATABASE_REPLICAS[0]
+
+    def request(self, method, url, **kwargs):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[self.replica]) as replica:
+            response = getattr(self.client, method)(url, **kwargs)
+        return response, [query['sql'] for query in primary], [query['sql'] for query in replica]
+
+    def comment_url(self):
+        return reverse('blog:post_comment', args=[self.post.id])
+
+    def test_reads_use_the_replica(self):
+        response, primary, replica = self.request('get', self.post.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        # the post itself; the sidebar is cached from the primary
+        lookup = '"blog_post"."slug" = '
+        self.assertTrue(any(lookup in sql for sql in replica))
+        self.assertFalse(any(lookup in sql for sql in primary))
+
+    def test_comment_is_written_to_the_primary_and_pins_the_next_read(self):
+        data = {'name': 'Ana', 'email': 'ana@example.com', 'body': 'Hola'}
+        response, primary, replica = self.request('post', self.comment_url(), data=data)
+        self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+        self.assertTrue(any(sql.startswith('INSERT INTO "blog_comment"') for sql in primary))
+        self.assertFalse(any(sql.startswith('INSERT') for sql in replica))
+        response, primary, replica = self.request('get', self.post.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replica, [])
+
+    @override_settings(PAGE_CACHE_ENABLED=True)
+    def test_page_cache_renders_from_the_primary_only_after_a_purge(self):
+        lookup = '"blog_post"."slug" = '
+        url = self.post.get_absolute_url()
+        # a cold miss reads from the replica
+        response, primary, replica = self.request('get', url)
+        self.assertTrue(any(lookup in sql for sql in replica))
+        purge([post_key(self.post.id)])
+        response, primary, replica = self.request('get', url)
+        self.assertTrue(any(lookup in sql for sql in primary))
+        self.assertFalse(any(lookup in sql for sql in replica))
+
+    def test_invalid_comment_does_not_pin(self):
+        response, primary, replica = self.request('post', self.comment_url(), data={'name': 'Ana'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
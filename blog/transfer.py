@@ -0,0 +1,307 @@
+import json
+import os
+from contextlib import contextmanager
+from itertools import groupby
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+from taggit.models import Tag
+
+from .models import Post, Comment, TaggedPost
+
+
+# Streaming import/export of the blog content (the export_blog / import_blog commands).
+#
+# The file is JSON Lines, one object per line, tags first, then posts, then comments:
+#
+#   {"type": "tag", "name": "django", "slug": "django"}
+#   {"type": "post", "id": 7, "title": ..., "author": "admin", "tags": ["django"], ...}
+#   {"type": "comment", "id": 31, "post": 7, "name": ..., "active": true, ...}
+#
+# Neither side ever holds more than one batch: the export walks each table by primary
+# key, the import reads the file line by line. Authors are referenced by username and
+# tags by name, resolved through dicts loaded once (rows that are missing are created
+# in bulk, one query per batch). Posts and comments keep their ids, as with loaddata,
+# so comments point straight at their post.
+#
+# Every batch is inserted with bulk_create() in its own transaction, and the number of
+# lines committed so far is written to a checkpoint file next to the input, so an
+# interrupted import continues after the last committed batch. Rows that already exist
+# are skipped, which makes re-importing a batch harmless. bulk_create() sends no
+# signals: the derived data (comment counts, similar posts, search index, sidebar) is
+# rebuilt once when the import is done, and the cached pages and the conditional GET
+# validators are invalidated then too. The rows keep the created_on / updated_on of
+# the file, set by one UPDATE per batch after the insert.
+#
+# A line that is not a record stops the import with a CommandError naming the line
+# (fix it and run again with --resume); comments of posts that are not in the file
+# nor the database are skipped and counted.
+
+COMMENT_COUNT_TRIGGER = 'blog_comment_active_count_insert_delete'
+
+
+@contextmanager
+def comment_count_trigger_disabled():
+    """
+    Skip the per-row Post.active_comment_count trigger for bulk comment inserts made
+    inside the block, which must run in a transaction; recompute the counts afterwards
+    (repair_comment_counts). ALTER TABLE locks the comments table until commit.
+    """
+    table = connection.ops.quote_name(Comment._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {table} DISABLE TRIGGER {COMMENT_COUNT_TRIGGER}')
+    yield
+    with connection.cursor() as cursor:
+        # the foreign key checks of the new rows are deferred to commit, and ALTER TABLE
+        # refuses to run while they are pending: run them now
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f'ALTER TABLE {table} ENABLE TRIGGER {COMMENT_COUNT_TRIGGER}')
+        cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+
+
+def restore_timestamps(model, records):
+    """
+    Give the rows of records, just inserted by bulk_create(), the created_on / updated_on
+    of the file, in one UPDATE ... FROM (VALUES ...): auto_now(_add) stamped them with
+    the current time.
+    """
+    if not records:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    values = ', '.join(['(%s, %s::timestamptz, %s::timestamptz)'] * len(records))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} AS t SET created_on = v.created_on, updated_on = v.updated_on '
+            f'FROM (VALUES {values}) AS v (id, created_on, updated_on) WHERE t.id = v.id',
+            [value for record in records for value in (record['id'], record['created_on'], record['updated_on'])],
+        )
+
+
+RECORD_TYPES = ('tag', 'post', 'comment')
+POST_FIELDS = ('id', 'title', 'slug', 'body', 'publish', 'created_on', 'updated_on', 'status')
+COMMENT_FIELDS = ('id', 'post', 'name', 'email', 'body', 'created_on', 'updated_on', 'active')
+DATETIME_FIELDS = ('publish', 'created_on', 'updated_on')
+
+
+def _by_id(queryset, batch_size):
+    # keyset walk over the primary key: every batch is one indexed range query
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]['id']
+
+
+def export_records(batch_size=1000):
+    """
+    Yield the records of the whole blog as dicts, in import order.
+    """
+    for name, slug in Tag.objects.order_by('id').values_list('name', 'slug').iterator(chunk_size=batch_size):
+        yield {'type': 'tag', 'name': name, 'slug': slug}
+
+    posts = Post.objects.values(*POST_FIELDS, author_username=F(f'author__{get_user_model().USERNAME_FIELD}'))
+    for batch in _by_id(posts, batch_size):
+        tags = {}
+        tagged = (
+            TaggedPost.objects.filter(content_object_id__in=[post['id'] for post in batch])
+            .order_by('content_object_id', 'tag__name')
+            .values_list('content_object_id', 'tag__name')
+        )
+        for post_id, names in groupby(tagged, key=lambda row: row[0]):
+            tags[post_id] = [name for _, name in names]
+        for post in batch:
+            yield {
+                'type': 'post',
+                **{field: post[field] for field in POST_FIELDS},
+                'author': post['author_username'],
+                'tags': tags.get(post['id'], []),
+            }
+
+    comments = Comment.objects.values(*COMMENT_FIELDS)
+    for batch in _by_id(comments, batch_size):
+        for comment in batch:
+            yield {'type': 'comment', **comment}
+
+
+def write_jsonl(records, stream):
+    count = 0
+    for record in records:
+        stream.write(json.dumps(record, cls=DjangoJSONEncoder) + '\n')
+        count += 1
+    return count
+
+
+class Importer:
+    def __init__(self, path, batch_size=1000, log=None):
+        self.path = path
+        self.checkpoint_path = f'{path}.checkpoint'
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self.counts = {record_type: 0 for record_type in RECORD_TYPES}
+        # comments whose post does not exist
+        self.skipped = 0
+        # ids of the posts inserted by this run, and of the other posts given comments
+        self.imported_posts = set()
+        self.commented_posts = set()
+
+        User = get_user_model()
+        self.User = User
+        self.authors = dict(User.objects.values_list(User.USERNAME_FIELD, 'id'))
+        self.tags = dict(Tag.objects.values_list('name', 'id'))
+
+    # checkpoint: the number of input lines whose records are committed
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, line):
+        temporary = f'{self.checkpoint_path}.tmp'
+        with open(temporary, 'w') as f:
+            f.write(str(line))
+        os.replace(temporary, self.checkpoint_path)
+
+    def clear_checkpoint(self):
+        try:
+            os.remove(self.checkpoint_path)
+        except FileNotFoundError:
+            pass
+
+    def run(self, resume=False):
+        """
+        Import the file and return {'tag': n, 'post': n, 'comment': n} of the records read.
+        """
+        skip = self.read_checkpoint() if resume else 0
+        if skip:
+            self.log(f'Resuming after line {skip}')
+        line_number = 0
+        batch, batch_type = [], None
+        with open(self.path) as f:
+            for line_number, line in enumerate(f, start=1):
+                if line_number <= skip or not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise CommandError(f'Line {line_number} is not JSON: {e}')
+                if not isinstance(record, dict) or record.get('type') not in RECORD_TYPES:
+                    raise CommandError(f'Line {line_number} is not a tag, post or comment record.')
+                if batch and (record['type'] != batch_type or len(batch) >= self.batch_size):
+                    self.commit(batch_type, batch, line_number - 1)
+                    batch = []
+                batch_type = record['type']
+                batch.append(record)
+        if batch:
+            self.commit(batch_type, batch, line_number)
+        self.reset_sequences()
+        self.clear_checkpoint()
+        return self.counts
+
+    def commit(self, record_type, records, line_number):
+        handler = {'tag': self.import_tags, 'post': self.import_posts, 'comment': self.import_comments}[record_type]
+        with transaction.atomic():
+            handler(records)
+        self.write_checkpoint(line_number)
+        self.counts[record_type] += len(records)
+        self.log(f"{self.counts[record_type]} {record_type}s (line {line_number})")
+
+    def resolve_tags(self, tags):
+        """
+        Make sure every tag of tags ({name: slug or None}) exists and is in self.tags.
+        """
+        missing = {name: slug for name, slug in tags.items() if name not in self.tags}
+        if not missing:
+            return
+        Tag.objects.bulk_create(
+            [Tag(name=name, slug=slug or Tag(name=name).slugify(name)) for name, slug in missing.items()],
+            ignore_conflicts=True,
+        )
+        self.tags.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+        for name in missing.keys() - self.tags.keys():
+            # the slug was taken by another tag; Tag.save() picks a free one
+            self.tags[name] = Tag.objects.create(name=name).id
+
+    def resolve_authors(self, usernames):
+        missing = {username for username in usernames if username not in self.authors}
+        if not missing:
+            return
+        # authors that do not exist here yet get an account they cannot log in with
+        unusable = make_password(None)
+        username_field = self.User.USERNAME_FIELD
+        self.User.objects.bulk_create(
+            [self.User(**{username_field: username, 'password': unusable}) for username in missing],
+            ignore_conflicts=True,
+        )
+        self.authors.update(
+            self.User.objects.filter(**{f'{username_field}__in': missing}).values_list(username_field, 'id')
+        )
+
+    def new_records(self, model, records):
+        # skip rows imported before (an interrupted batch, or a second run)
+        existing = set(model.objects.filter(id__in=[record['id'] for record in records]).values_list('id', flat=True))
+        return [
+            {field: parse_datetime(value) if field in DATETIME_FIELDS else value for field, value in record.items()}
+            for record in records
+            if record['id'] not in existing
+        ]
+
+    def import_tags(self, records):
+        self.resolve_tags({record['name']: record['slug'] for record in records})
+
+    def import_posts(self, records):
+        records = self.new_records(Post, records)
+        self.resolve_authors({record['author'] for record in records})
+        self.resolve_tags({name: None for record in records for name in record['tags']})
+
+        posts = []
+        for record in records:
+            post = Post(author_id=self.authors[record['author']], **{field: record[field] for field in POST_FIELDS})
+            # what Post.save() would do; the search_vector trigger fills in the rest
+            post.render_body()
+            posts.append(post)
+        Post.objects.bulk_create(posts)
+        restore_timestamps(Post, records)
+        TaggedPost.objects.bulk_create([
+            TaggedPost(content_object_id=record['id'], tag_id=self.tags[name])
+            for record in records
+            for name in record['tags']
+        ])
+        self.imported_posts.update(record['id'] for record in records)
+
+    def import_comments(self, records):
+        records = self.new_records(Comment, records)
+        posts = set(Post.objects.filter(id__in={record['post'] for record in records}).values_list('id', flat=True))
+        orphans = [record['id'] for record in records if record['post'] not in posts]
+        if orphans:
+            self.skipped += len(orphans)
+            self.log(f"Skipped {len(orphans)} comments of missing posts: {', '.join(map(str, orphans))}")
+            records = [record for record in records if record['post'] in posts]
+        if not records:
+            return
+        comments = [
+            Comment(post_id=record['post'], **{field: record[field] for field in COMMENT_FIELDS if field != 'post'})
+            for record in records
+        ]
+        with comment_count_trigger_disabled():
+            Comment.objects.bulk_create(comments)
+        restore_timestamps(Comment, records)
+        # the posts that already had a page, whose comments changed
+        self.commented_posts.update({record['post'] for record in records} - self.imported_posts)
+
+    def reset_sequences(self):
+        # the ids came from the file, move the id sequences past them
+        statements = connection.ops.sequence_reset_sql(no_style(), [Post, Comment])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
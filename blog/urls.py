@@ -1,25 +1,40 @@
+from django.conf import settings
 from django.urls import path
+from django.views.decorators.http import last_modified
 from . import views
 from .feeds import LatestPostsFeed
+from .freshness import posts_last_modified
 
 
 app_name = 'blog'
 
+# the public read views, sync (WSGI) or native async (ASGI) versions
+if settings.BLOG_ASYNC_VIEWS:
+    from . import async_views
+    read_views = async_views
+    post_feed = async_views.post_feed
+else:
+    read_views = views
+    # feed readers polling with If-Modified-Since get a 304 until a post changes
+    post_feed = last_modified(posts_last_modified)(LatestPostsFeed())
+
 urlpatterns = [
     # Post views
-    path('', views.post_list, name='post_list'),
-    path('tag/<slug:tag_slug>/', views.post_list, name='post_list_by_tag'),
+    path('', read_views.post_list, name='post_list'),
+    path('tag/<slug:tag_slug>/', read_views.post_list, name='post_list_by_tag'),
     # both above patterns points to the same view, but they have different names.
     # The first pattern will call the post_list view without any optional parameters,
     #  whereas the second pattern will call the view with the tag_slug parameter.
     # path('', views.PostListView.as_view(), name='post_list'),
 
     path('<int:year>/<int:month>/<int:day>/<slug:post>/',
-         views.post_detail, name='post_detail'),
+         read_views.post_detail, name='post_detail'),
     path('redirect/', views.redirect_me, name='redirect_me'),
     path('<int:post_id>/share/', views.post_share, name='post_share'),
     path('<int:post_id>/comment/', views.post_comment, name='post_comment'),
-    path('feed/', LatestPostsFeed(), name='post_feed'),
-    path('search/', views.post_search, name='post_search'),
+    path('<int:post_id>/comments/', views.post_comments, name='post_comments'),
+    path('feed/', post_feed, name='post_feed'),
+    path('search/', read_views.post_search, name='post_search'),
+    path('search/suggest/', views.post_suggest, name='post_suggest'),
 
 ]
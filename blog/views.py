@@ -1,16 +1,22 @@
-from django.core.mail import send_mail
 from django.shortcuts import render, get_object_or_404, redirect, reverse
-from .models import Post
-from django.http import Http404
+from .models import Post, Comment, TagStats
+from django.http import Http404, JsonResponse
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, condition
+from django.utils.decorators import method_decorator
+from .freshness import content_etag, content_last_modified
+from .mailqueue import enqueue_mail
+from .pagecache import add_surrogate_keys, post_key, tag_key
 
 from django.views.generic import ListView
-from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank, TrigramSimilarity
-from django.db import connection
+from django.conf import settings
+from .pagination import keyset_paginate, comment_page
 from .forms import EmailPostForm, CommentForm, SearchForm
 from taggit.models import Tag
-from django.db.models import Count
+from .search import get_search_backend
+from .search.cache import cached_search_ids
+from urllib.parse import urlencode
+from .search.suggest import get_suggestion_index
 
 
 # Building a Search View
@@ -18,8 +24,7 @@ def post_search(request):
     form = SearchForm()
     query = None
     results = []
-    print("GET parameters:", request.GET)  # Shows all GET parameters
-    print("Search query in GET request:", request.GET.get('query'))  # Shows just the query value
+    page_query = ''
 
     # When user submits the form
     if 'query' in request.GET:
@@ -31,68 +36,64 @@ def post_search(request):
 
         if form.is_valid():
             query = form.cleaned_data['query']
-            query_terms = query.strip().split()  # Handles spaces and splitting
-
-            # Handle empty query gracefully
-            if not query_terms:
-                results = []
-                print('Empty query')
-            else:
-
-                # The first term initializes the query
-                # config="spanish" >> executes stemming and removes stop words in Spanish
-                search_query = SearchQuery(query_terms[0], config='spanish')
-                # The loop iterates over the remaining terms (terms[1:]), adding each one
-                # to the search_query with the AND operator (&), OR operator(|)
-                for term in query_terms[1:]:
-                    search_query &= SearchQuery(term, config='spanish')
-
-                # This creates a combined searchable representation of the title and body fields.
-                # config="spanish" >> executes stemming and removes stop words in Spanish
-                search_vector = SearchVector('title', 'body', config='spanish')
-
-                # Example with usage of both SearchVector and SearchRank
-                # results = (
-                #     Post.published.annotate(
-                #         search=search_vector,
-                #         # Using SearchRank to rank results based on relevance
-                #         rank=SearchRank(search_vector, search_query)
-                #     )
-                #     .filter(search=search_query)
-                #     .order_by('-rank')
-                # )
-
-                # Example using TrigramSimilarity ONLY
-                results = (
-                    Post.published.annotate(
-                        # The TrigramSimilarity function expects plain text (like a string or a field name)
-                        # for its comparison
-                        similarity=TrigramSimilarity('title', query) + TrigramSimilarity('body', query)
-                    ).filter(similarity__gt=0.1)
-                    .order_by('-similarity')
-                )
-                print(f'SEARCH QUERY: {search_query}')
-                # Force execution by converting results to a list
-                list(results)
-                print(f'~~~~connection queries from database: {connection.queries[-1]}')  # View the generated SQL
-        # Post.published starts with only published posts (likely filtered by a custom manager)
-        # .annotate() adds a new temporary field called 'search' to each post
-        # SearchVector('title', 'body') combines the text from both the title and body fields into a searchable formats
-        # .filter(search=query) matches the user's query against this combined text
+            mode = form.cleaned_data['mode']
+            # The engine is chosen with the SEARCH_BACKEND setting (see blog/search/);
+            # repeated searches are answered from the result cache in blog/search/cache.py
+            results = search_page(query, mode, request.GET.get('page', 1))
+            # keeps the search in the pagination links
+            page_query = urlencode({'query': query, 'mode': mode}) + '&'
 
     return render(request,
                   'blog/post/search.html',
                   {
                       'form': form,
                       'query': query,
-                      'results': results
+                      'results': results,
+                      'page_query': page_query,
                   }
                   )
 
 
+def search_page(query, mode, page_number):
+    # the ranked ids are paginated; only the posts of the requested page are loaded,
+    # each with its highlighted snippet
+    page = numbered_page(cached_search_ids(query, mode), page_number, settings.SEARCH_RESULTS_PER_PAGE)
+    page.object_list = get_search_backend().snippets(list(page.object_list), query)
+    return page
+
+
+# Autocomplete for the search box: ?q=<what was typed so far> returns the newest
+# matching post titles and the most used matching tags as JSON. It is answered from
+# the in-memory prefix index of blog/search/suggest.py, without any query.
+def post_suggest(request):
+    query = request.GET.get('q', '')[:100]
+    try:
+        limit = min(max(int(request.GET.get('limit', settings.SEARCH_SUGGEST_LIMIT)), 1), 20)
+    except ValueError:
+        limit = settings.SEARCH_SUGGEST_LIMIT
+    posts, tags = get_suggestion_index().suggest(query, limit)
+    return JsonResponse({
+        'query': query,
+        'posts': [
+            # an unsaved instance reuses Post.get_absolute_url without loading the row
+            {'title': title, 'url': Post(slug=slug, publish=publish).get_absolute_url()}
+            for title, slug, publish in posts
+        ],
+        'tags': [
+            {'name': name, 'url': reverse('blog:post_list_by_tag', args=[slug])}
+            for name, slug in tags
+        ],
+    })
+
+
 @require_POST  # Ensures only POST requests are accepted
 def post_comment(request, post_id):
-    post = get_object_or_404(Post, id=post_id, status=Post.Status.PUBLISHED)
+    # only what the templates below use (the comment signals read post.status)
+    post = get_object_or_404(
+        Post.objects.only('id', 'title', 'slug', 'publish', 'status'),
+        id=post_id,
+        status=Post.Status.PUBLISHED,
+    )
     comment = None
     # A comment was posted
     form = CommentForm(data=request.POST)
@@ -103,6 +104,12 @@ def post_comment(request, post_id):
         comment.post = post
         # Save the comment to the database
         comment.save()
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        # the form on post_detail adds just the new comment to the page (or shows the
+        # form again with its errors) instead of reloading the whole thread
+        if comment:
+            return render(request, 'blog/post/includes/comment_item.html', {'comment': comment}, status=201)
+        return render(request, 'blog/post/includes/comment_form.html', {'post': post, 'form': form}, status=400)
     return render(request, 'blog/post/comment.html', {
         'post': post,
         'form': form,
@@ -147,7 +154,7 @@ def post_share(request, post_id):
                 f"Read \"{post.title}\" at {post_url}\n\n"
                 f"{cd['name']} \'s comments: {cd['comments']}"
             )
-            send_mail(
+            enqueue_mail(
                 subject=subject,
                 message=message,
                 from_email=None,
@@ -155,7 +162,8 @@ def post_share(request, post_id):
             )
             # In the from_email parameter, we pass the None value,
             # so the value of the DEFAULT_FROM_EMAIL setting will be used for the sender.
-            # Finally, we send the email to the email address contained in the to field of the form
+            # The email is only queued here; the send_queued_mail worker delivers it to the
+            # address in the to field, so the request never waits for the SMTP server.
 
             sent = True
 
@@ -173,11 +181,14 @@ def post_share(request, post_id):
 
 
 # Class Based View for post_list
+# condition() answers If-None-Match / If-Modified-Since with a 304 before the
+# queryset is paginated or the template rendered (see blog/freshness.py)
+@method_decorator(condition(etag_func=content_etag, last_modified_func=content_last_modified), name='dispatch')
 class PostListView(ListView):
     """
     Alternative post list view
     """
-    queryset = Post.published.all()
+    queryset = Post.published.for_listing()
     context_object_name = 'posts'
     paginate_by = 3
     template_name = 'blog/post/list.html'
@@ -187,6 +198,13 @@ class PostListView(ListView):
     # page_obj: The current page of objects
     # is_paginated: Boolean indicating if pagination is active
 
+    def paginate_queryset(self, queryset, page_size):
+        if settings.POST_LIST_PAGINATION == 'keyset':
+            # cursor pagination has no Paginator object, only the current page
+            page = keyset_paginate(queryset, page_size, self.request.GET)
+            return None, page, page.object_list, page.has_other_pages()
+        return super().paginate_queryset(queryset, page_size)
+
     def get_context_data(self, **kwargs):
         # First get the default context from the parent class (ListView)
         context = super().get_context_data(**kwargs)
@@ -194,6 +212,10 @@ class PostListView(ListView):
 
         # Get the paginator object from the context
         paginator = context['paginator']
+        if paginator is None:
+            # keyset mode: page_obj already is the page selected by ?after= / ?before=
+            context['posts'] = context['page_obj']
+            return context
         # Retrieve the page number from the GET request
         page_number = self.request.GET.get('page', 1)
 
@@ -211,44 +233,67 @@ class PostListView(ListView):
 
         # Update the paginated posts to the context
         context['posts'] = posts
-        print("Final context:", context)
         return context
 
 
-# Function Based View for post_list
-# The None default allows flexible routing - the view can handle URLs with or without a tag parameter.
-def post_list(request, tag_slug=None):
-    published_list = Post.published.all()
-    tag = None
-    if tag_slug:
-        tag = get_object_or_404(Tag, slug=tag_slug)
-        published_list = published_list.filter(tags__in=[tag])
-        # the above line filters the published_list to include only posts associated
-        # with the specific tag from the URL
-    #     tags refers to a ManyToManyField (or ForeignKey) on the Post model that
-    #     represents the relationship between posts and tags.
-    #     tags = TaggableManager() from Post model.
-
-    paginator = Paginator(published_list, 3)
-    page_number = request.GET.get('page', 1)
+def numbered_page(published_list, page_number, per_page=3, count=None):
+    paginator = Paginator(published_list, per_page)
+    if count is not None:
+        # already known (e.g. from the tag statistics): no COUNT(*) query
+        paginator.count = count
     # We retrieve the page GET HTTP parameter and store it in the page_number variable.
     # This parameter contains the requested page number. If the page parameter is not in the GET parameters
     # of the request, we use the default value 1 to load the first page of results.
     try:
-        posts = paginator.page(page_number)
+        return paginator.page(page_number)
     # We obtain the objects for the desired page by calling the page() method of Paginator. This
-    # method returns a Page object that we store in the posts variable.
+    # method returns a Page object.
     except (EmptyPage, PageNotAnInteger) as e:
         # if page_number is not an integer get the first page
         if isinstance(e, PageNotAnInteger):
-            posts = paginator.page(1)
+            return paginator.page(1)
 
         # if page_number is out of range get last page or results
         else:
             # paginator.num_pages will return total no. os pages, which is also last page no.
-            posts = paginator.page(paginator.num_pages)
+            return paginator.page(paginator.num_pages)
+
+
+def tag_post_count(tag):
+    # the tag page's post count from the tag statistics (blog/tagstats.py), instead of
+    # a COUNT(*) joined through the tagging table
+    try:
+        return tag.stats.published_posts
+    except TagStats.DoesNotExist:
+        return None
+
+
+# Function Based View for post_list
+# The None default allows flexible routing - the view can handle URLs with or without a tag parameter.
+@condition(etag_func=content_etag, last_modified_func=content_last_modified)
+def post_list(request, tag_slug=None):
+    # for_listing() fetches authors and tags for the whole page in a constant number of queries
+    published_list = Post.published.for_listing()
+    tag = None
+    count = None
+    if tag_slug:
+        tag = get_object_or_404(Tag.objects.select_related('stats'), slug=tag_slug)
+        published_list = published_list.filter(tags__in=[tag])
+        count = tag_post_count(tag)
+        # the above line filters the published_list to include only posts associated
+        # with the specific tag from the URL
+    #     tags refers to a ManyToManyField (or ForeignKey) on the Post model that
+    #     represents the relationship between posts and tags.
+    #     tags = TaggableManager() from Post model.
+
+    if settings.POST_LIST_PAGINATION == 'keyset':
+        # ?after= / ?before= cursors on (publish, id): no COUNT(*) and no OFFSET,
+        # so deep pages cost the same as the first one (see blog/pagination.py)
+        posts = keyset_paginate(published_list, 3, request.GET)
+    else:
+        posts = numbered_page(published_list, request.GET.get('page', 1), count=count)
 
-    return render(
+    response = render(
         request,
         'blog/post/list.html',
         {
@@ -256,46 +301,49 @@ def post_list(request, tag_slug=None):
             'tag': tag,
         }
     )
+    # what the page shows, for the full-page cache (blog/pagecache.py)
+    return add_surrogate_keys(response, listing_keys(posts, tag))
+
+
+def listing_keys(posts, tag):
+    keys = ['listing', 'sidebar', *(post_key(post.id) for post in posts)]
+    if tag is not None:
+        keys.append(tag_key(tag.slug))
+    return keys
 
 
+@condition(etag_func=content_etag, last_modified_func=content_last_modified)
 def post_detail(request, year, month, day, post):
     # try:
     #     post = Post.published.get(id=pk)
     # except Post.DoesNotExist:
     #     raise Http404("NO POST FOUND")
 
-    # to check the value fetched from the URL pattern.
-    print(f"Year: {year}")
-    print(f"Month: {month}")
-    print(f"Day: {day}")
-    print(f"Post slug: {post}")
+    # the values fetched from the URL pattern (and the time and queries this view takes)
+    # are recorded by blog.perflog.PerformanceLogMiddleware instead of being printed
 
-    post = get_object_or_404(Post,
-                             status=Post.Status.PUBLISHED,
+    post = get_object_or_404(Post.published.published_on(year, month, day)
+                             .select_related('author').defer('body', 'search_vector'),
                              slug=post,
-                             publish__year=year,
-                             publish__month=month,
-                             publish__day=day
                              )
 
     # List of active comments for this post
     # We use the comments manager for
     # the related Comment objects that we previously defined in the Comment
     # model, using the related_name attribute of the ForeignKey field to the Post model.
-    comments = post.comments.filter(active=True)
+    # Only the first page is rendered here, the post_comments view serves the rest.
+    comments = comment_page(post.comments.filter(active=True), settings.COMMENTS_PER_PAGE)
     # Form for users to comment
     form = CommentForm()
 
     # List of similar posts
-    post_tags_ids = post.tags.values_list('id', flat=True)
+    # precomputed by blog/similarity.py (posts sharing the most tags, newest first),
+    # so this is a single lookup on the (post, rank) index of SimilarPost
     similar_posts = Post.published.filter(
-        tags__in=post_tags_ids
-    ).exclude(id=post.id)
-    similar_posts = similar_posts.annotate(
-        same_tags=Count('tags')
-    ).order_by('-same_tags', '-publish')[:4]
+        similar_to__post=post
+    ).only('title', 'slug', 'publish').order_by('similar_to__rank')
 
-    return render(
+    response = render(
         request,
         'blog/post/detail.html',
         {
@@ -305,6 +353,35 @@ def post_detail(request, year, month, day, post):
             'similar_posts': similar_posts,
         }
     )
+    return add_surrogate_keys(response, detail_keys(post, similar_posts))
+
+
+def detail_keys(post, similar_posts):
+    # the titles of the similar posts are on the page too
+    return ['sidebar', post_key(post.id), *(post_key(similar.id) for similar in similar_posts)]
+
+
+# The rest of a comment thread, one page at a time after the ?after= cursor of the
+# previous page (see comment_page in blog/pagination.py), as an HTML fragment or,
+# with ?format=json, as JSON.
+@condition(etag_func=content_etag, last_modified_func=content_last_modified)
+def post_comments(request, post_id):
+    # unpublished posts simply have no comments to show
+    comments = Comment.objects.filter(post_id=post_id, post__status=Post.Status.PUBLISHED, active=True)
+    page = comment_page(comments, settings.COMMENTS_PER_PAGE, request.GET.get('after'))
+
+    if request.GET.get('format') == 'json':
+        next_url = None
+        if page.has_next():
+            next_url = f"{reverse('blog:post_comments', args=[post_id])}?format=json&after={page.next_cursor}"
+        return JsonResponse({
+            'comments': [
+                {'id': comment.id, 'name': comment.name, 'created_on': comment.created_on, 'body': comment.body}
+                for comment in page
+            ],
+            'next': next_url,
+        })
+    return render(request, 'blog/post/includes/comments.html', {'page': page, 'post_id': post_id})
 
 
 # example use of reverse and redirect
@@ -10,7 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
-from decouple import config
+import copy
+import sys
+
+from decouple import Csv, config
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +48,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its timings cover the rest of the stack (see blog/perflog.py)
+    'blog.perflog.PerformanceLogMiddleware',
+    # sends the reads of the public pages to the replicas (see blog/routers.py)
+    'blog.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,13 +59,17 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # after the CSRF and authentication middleware (see blog/pagecache.py)
+    'blog.pagecache.PageCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'myblog.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that also reports render times to the performance log
+        'BACKEND': 'blog.perflog.TimedDjangoTemplates',
+        'NAME': 'django',  # keep the alias of the stock backend
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -77,6 +88,26 @@ WSGI_APPLICATION = 'myblog.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# DB_POOL=True uses psycopg's connection pool (pip install "psycopg[pool]"), one per
+# alias and process; connections are checked when taken from the pool. Django needs
+# CONN_MAX_AGE = 0 with a pool.
+DB_POOL = config('DB_POOL', default=False, cast=bool)
+if DB_POOL:
+    from psycopg_pool import ConnectionPool
+
+    DB_CONN_MAX_AGE = 0
+    DB_OPTIONS = {
+        'pool': {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'timeout': 10,
+            'check': ConnectionPool.check_connection,
+        },
+    }
+else:
+    DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+    DB_OPTIONS = {}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -86,9 +117,95 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
         'PORT': 5432,
+        # keep connections open between requests (seconds, None = forever) instead of
+        # connecting for every request; a reused connection is checked before its first query
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': DB_OPTIONS,
     }
 }
 
+# Read replicas (blog/routers.py): one alias per host in DB_REPLICA_HOSTS, with the
+# primary's name and credentials. DB_REPLICA_HOSTS=<DB_HOST> gives a second alias onto
+# the same local database, enough to try the routing.
+DATABASE_REPLICAS = []
+for number, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), start=1):
+    alias = f'replica{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'OPTIONS': copy.deepcopy(DB_OPTIONS),
+        # tests use the primary's test database through this alias
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['blog.routers.PrimaryReplicaRouter']
+# the views whose GET requests read from a replica
+REPLICA_VIEWS = [
+    'blog:post_list',
+    'blog:post_list_by_tag',
+    'blog:post_detail',
+    'blog:post_comments',
+    'blog:post_search',
+    'blog:post_suggest',
+    'blog:post_feed',
+    'django.contrib.sitemaps.views.sitemap',
+    'sitemap_shard',
+]
+# after a write the browser reads from the primary for this long (read-your-writes)
+REPLICA_PIN_COOKIE = 'pin_primary'
+REPLICA_PIN_SECONDS = 10
+
+# Per-request performance log written by blog.perflog.PerformanceLogMiddleware
+# (summarize it with `python manage.py perf_report`). Off unless PERF_LOG_ENABLED=true
+# is set in the environment, and always off under `manage.py test`, so the test suite
+# never writes to logs/
+PERF_LOG_ENABLED = config('PERF_LOG_ENABLED', default=False, cast=bool) and sys.argv[1:2] != ['test']
+PERF_LOG_PATH = BASE_DIR / 'logs' / 'requests.jsonl'
+PERF_LOG_SAMPLE_RATE = config('PERF_LOG_SAMPLE_RATE', default=1.0, cast=float)  # fraction of requests logged
+PERF_LOG_SLOW_MS = 500  # requests slower than this are always logged
+PERF_LOG_MAX_BYTES = 10 * 1024 * 1024
+PERF_LOG_BACKUP_COUNT = 5
+# Admin changelists (blog/changelist.py): counts above this are planner estimates,
+# facet counts are cached this many seconds
+ADMIN_EXACT_COUNT_LIMIT = 10000
+ADMIN_FACET_CACHE_TIMEOUT = 300
+
+# saved baselines of `python manage.py benchmark_endpoints --save <name>`
+BENCHMARK_DIR = BASE_DIR / 'benchmarks'
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The local-memory default is per process; point CACHE_BACKEND/CACHE_LOCATION at a
+# shared cache (e.g. django.core.cache.backends.redis.RedisCache) when running several workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
+# Full-page cache for anonymous visitors (blog/pagecache.py), off by default
+PAGE_CACHE_ENABLED = config('PAGE_CACHE_ENABLED', default=False, cast=bool)
+PAGE_CACHE_ALIAS = 'default'
+PAGE_CACHE_TIMEOUT = 60 * 10
+PAGE_CACHE_VIEWS = [
+    'blog:post_list',
+    'blog:post_list_by_tag',
+    'blog:post_detail',
+]
+# callable given the purged surrogate keys, e.g. 'blog.pagecache.http_purge' to send
+# them to a reverse proxy at PAGE_CACHE_PURGE_URL
+PAGE_CACHE_PURGE_HOOK = config('PAGE_CACHE_PURGE_HOOK', default=None)
+PAGE_CACHE_PURGE_URL = config('PAGE_CACHE_PURGE_URL', default='http://127.0.0.1:6081/')
+PAGE_CACHE_PURGE_TIMEOUT = 2
+
+# Cache alias and lifetime (seconds) of the sidebar rendered by {% cached_sidebar %}
+SIDEBAR_CACHE_ALIAS = 'default'
+SIDEBAR_CACHE_TIMEOUT = 60 * 60
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -136,5 +253,46 @@ EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL')
 
+# Outbound mail queue drained by `python manage.py send_queued_mail` (see blog/mailqueue.py)
+MAIL_QUEUE_BATCH_SIZE = 50
+MAIL_QUEUE_MAX_ATTEMPTS = 5
+MAIL_QUEUE_RETRY_DELAY = 60  # seconds before the first retry, doubled on each further attempt
+MAIL_QUEUE_RECIPIENT_INTERVAL = 60  # at most one e-mail per address in this many seconds
+MAIL_QUEUE_SENDING_TIMEOUT = 600  # a claimed batch is sent again after this many seconds
+
 # for sitemap
 SITE_ID = 1
+# objects per sitemap shard (id range) and how long a rendered shard stays cached
+SITEMAP_SHARD_SIZE = 10000
+SITEMAP_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Pagination of the post listings: 'numbered' (?page=N, with a page count) or
+# 'keyset' (?after= / ?before= cursors, constant cost on large archives)
+POST_LIST_PAGINATION = config('POST_LIST_PAGINATION', default='numbered')
+
+# Comments rendered on post_detail; the rest of the thread is loaded page by page
+COMMENTS_PER_PAGE = 20
+
+# Serve post_list, post_detail, post_search and the feed with the native async views of
+# blog/async_views.py; only worth it under ASGI (uvicorn myblog.asgi:application)
+BLOG_ASYNC_VIEWS = config('BLOG_ASYNC_VIEWS', default=False, cast=bool)
+
+# Markdown extensions used to pre-render Post.body_html
+# (run `python manage.py rerender_posts` after changing them)
+MARKDOWN_EXTENSIONS = []
+
+# Search engine used by post_search (see blog/search/):
+# 'postgres' for the trigram/full-text path, 'bm25' for the in-process index
+SEARCH_BACKEND = config('SEARCH_BACKEND', default='postgres')
+# index file mapped by every worker when SEARCH_BACKEND = 'bm25'
+SEARCH_INDEX_PATH = BASE_DIR / 'search_index.bin'
+# changed posts are kept in a small delta next to it, merged in once it holds this many
+SEARCH_INDEX_MERGE_DOCS = 1000
+# search ranking: only the newest this many matches are scored, rank/similarity mix of 'blend'
+SEARCH_MAX_CANDIDATES = 500
+SEARCH_BLEND_RANK_WEIGHT = 0.7
+SEARCH_RESULTS_PER_PAGE = 10
+# searches whose ranked post ids are kept per process (blog/search/cache.py)
+SEARCH_CACHE_SIZE = 1000
+# number of titles (and of tags) returned by the search/suggest/ autocomplete
+SEARCH_SUGGEST_LIMIT = 8
@@ -15,9 +15,8 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.contrib.sitemaps.views import sitemap
 from django.urls import path, include
-from blog.sitemaps import PostSitemap, TagSitemap
+from blog.sitemaps import PostSitemap, TagSitemap, sitemap_index, sitemap_shard
 
 
 sitemaps = {
@@ -31,10 +30,18 @@ urlpatterns = [
     path('blog/', include('blog.urls', namespace='blog')),
     path(
         'sitemap.xml',  # URL will be your_site.com/sitemap.xml
-        sitemap,        # Django's built-in view called (sitemap) located in django.contrib.sitemaps.views
+        # a sitemap index listing the shards below, each with its own lastmod
+        sitemap_index,
         {'sitemaps': sitemaps},     # Passes our sitemap dictionary
         name='django.contrib.sitemaps.views.sitemap'
         # the name given to a URL pattern is an internal identifier used for reverse URL lookup and does not
         # affect the actual URL that users type in their browsers.
-    )
+    ),
+    path(
+        # e.g. your_site.com/sitemap-posts-0.xml, streamed from blog.sitemaps
+        'sitemap-<slug:section>-<int:shard>.xml',
+        sitemap_shard,
+        {'sitemaps': sitemaps},
+        name='sitemap_shard'
+    ),
 ]